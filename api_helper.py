@@ -3,6 +3,8 @@ import time
 import logging
 import json
 import random
+from draw_buffer import feed_buffer
+from number_shot import feed_stats
 
 logger = logging.getLogger(__name__)
 
@@ -107,6 +109,8 @@ def get_game_data(game_type="30s", platform="Tiranga"):
                 clean_history.append({'p': period, 'r': result_num, 'o': outcome})
             
             clean_history.reverse()
+            feed_buffer(platform, game_type).extend(clean_history)
+            feed_stats(platform, game_type).observe(clean_history)
 
         except Exception as e:
             logger.error(f"Error fetching history ({platform}): {e}")
@@ -0,0 +1,268 @@
+"""
+Backtest of the prediction engines (V1-V5, Sureshot, Target) over a draw history.
+
+Draws are loaded into NumPy arrays and every engine is evaluated over the whole
+series at once; the only per-draw Python work is the SHA-256 of each period.
+A prediction for draw i only sees draws before i (the live API shows the last 10).
+
+Usage: python backtest.py [--source fake|csv|archive] [--csv draws.csv] [--draws 1000000]
+                          [--game-type 30s|1m] [--platforms Tiranga TrustWin]
+                          [--payout 1.96] [--session 100] [--bankroll 63]
+"""
+import argparse
+import csv
+import time
+import numpy as np
+from config import BETTING_SEQUENCE, MAX_LEVEL, ALL_PATTERNS, V5_SALT, TRUSTWIN_SALT, TARGET_PACKS
+from config import TARGET_SEQUENCE_PERCENTAGES, TARGET_MIN_BALANCE, MAX_LADDER_LEVEL
+from pattern_automaton import PatternAutomaton
+from v5_table import digits_for
+
+WINDOW = 10           # history items the live API returns / the engines look at
+LADDER_STEPS = MAX_LADDER_LEVEL
+TARGET_MAX_STEPS = 2000
+TARGET_FRACTIONS = np.array(TARGET_SEQUENCE_PERCENTAGES)  # target_engine.calculate_sequence
+
+# ==========================================
+# LOADING (outcomes: 1 = Big, 0 = Small)
+# ==========================================
+
+def fake_draws(n, seed=0):
+    rng = np.random.default_rng(seed)
+    periods = [str(20260101100000000 + i) for i in range(n)]
+    return periods, rng.integers(0, 10, n, dtype=np.int8)
+
+def load_csv(path):
+    """CSV with a period column (period / issueNumber) and a number column (number / result)."""
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        header = [h.strip().lower() for h in next(reader)]
+        p_col = next(i for i, h in enumerate(header) if h in ("period", "issuenumber", "p"))
+        r_col = next(i for i, h in enumerate(header) if h in ("number", "result", "r"))
+        periods, numbers = [], []
+        for row in reader:
+            periods.append(row[p_col].strip())
+            numbers.append(int(row[r_col]))
+    order = np.argsort(np.array(periods))
+    return [periods[i] for i in order], np.array(numbers, dtype=np.int8)[order]
+
+def load_archive(platform, game_type):
+    from database import iter_draws  # only this source needs Mongo
+    periods, numbers = [], []
+    for p, r in iter_draws(platform, game_type):
+        periods.append(p)
+        numbers.append(r)
+    return periods, np.array(numbers, dtype=np.int8)
+
+# ==========================================
+# ENGINES (vectorized; index i predicts draw i)
+# ==========================================
+
+def lagged(o, k):
+    """o shifted right by k (draw i sees o[i-k]); the first k entries are 0."""
+    out = np.zeros_like(o)
+    out[k:] = o[:-k]
+    return out
+
+def trend_signals(o):
+    """get_high_confidence_prediction / is_super_trend over the previous 10 draws."""
+    p1, p2, p3, p4, p5 = (lagged(o, k) for k in range(1, 6))
+    streak4 = (p1 == p2) & (p2 == p3) & (p3 == p4)
+    zigzag = (p1 != p2) & (p2 != p3) & (p3 != p4)
+    has_trend = streak4 | zigzag
+    trend = np.where(streak4, p1, 1 - p1).astype(np.int8)
+    super_trend = streak4 & (p4 == p5)
+    return has_trend, trend, super_trend
+
+def v5_engine(o, periods, salt):
+    """Returns (final V5 pick, hash-only pick, sureshot confluence mask)."""
+    hash_pred = (np.frombuffer(digits_for(periods, salt), dtype=np.int8) > 4).astype(np.int8)
+    has_trend, trend, super_trend = trend_signals(o)
+    final = np.where(has_trend & (trend != hash_pred) & super_trend, trend, hash_pred).astype(np.int8)
+    confluence = has_trend & (trend == final)
+    return final, hash_pred, confluence
+
+def v1_engine(o):
+    """
+    Pattern automaton (built-in ALL_PATTERNS) over the draw stream, else follow
+    the last draw. Only the last max_len draws decide the automaton state, so
+    the pick is precomputed for every possible window and looked up per draw.
+    """
+    ac = PatternAutomaton([("".join(x[0] for x in seq), seq[0], 1.0, name) for seq, name in ALL_PATTERNS])
+    width = ac.max_len
+    table = np.empty(1 << width, dtype=np.int8)
+    for code in range(1 << width):
+        recent = ["Big" if code >> (width - 1 - k) & 1 else "Small" for k in range(width)]
+        pred, _, _ = ac.predict(ac.run(recent))
+        table[code] = (pred or recent[-1]) == "Big"
+    code = np.zeros(len(o), dtype=np.int64)
+    for k in range(width, 0, -1):
+        code = code << 1 | lagged(o, k)
+    return table[code]
+
+def v2_engine(o):
+    # Win -> repeat the pick (= last result); loss -> flip it (= last result too)
+    return lagged(o, 1)
+
+def v3_engine(o, seed=0):
+    return (np.random.default_rng(seed).integers(0, 10, len(o)) > 4).astype(np.int8)
+
+def v4_engine(o):
+    """
+    The V4 pick depends on the previous pick and the martingale level, so it is
+    run as a 12-state machine (pick x level) scanned in log2(n) vectorized passes.
+    """
+    n = len(o)
+    prev, streak3 = lagged(o, 1), (lagged(o, 1) == lagged(o, 2)) & (lagged(o, 2) == lagged(o, 3))
+    streak3[:3] = False  # fewer than 3 draws seen
+    trans = np.empty((n, 2 * MAX_LEVEL), dtype=np.int8)
+    for pick in (0, 1):
+        for level in range(1, MAX_LEVEL + 1):
+            switch = np.int8(1 - pick)
+            pred = switch if level == 4 else np.where(streak3, prev, switch)
+            next_level = np.where(pred == o, 1, min(level + 1, MAX_LEVEL))
+            trans[:, pick * MAX_LEVEL + level - 1] = pred * MAX_LEVEL + next_level - 1
+    after = scan_states(trans, init=0)  # starts on "Small", level 1
+    return (after // MAX_LEVEL).astype(np.int8)
+
+def scan_states(trans, init):
+    """State after each step of a finite-state machine; trans[i, s] is the next state."""
+    shift = 1
+    while shift < len(trans):
+        trans[shift:] = np.take_along_axis(trans[shift:], trans[:-shift], axis=1)
+        shift *= 2
+    return trans[:, init]
+
+# ==========================================
+# MONEY MANAGEMENT
+# ==========================================
+
+def loss_runs(win):
+    """Consecutive losses ending at each bet (0 on a win)."""
+    idx = np.arange(len(win))
+    return idx - np.maximum.accumulate(np.where(win, idx, -1))
+
+def martingale_stats(win, payout, session, bankroll):
+    """Flat BETTING_SEQUENCE martingale (level resets on a win, holds at MAX_LEVEL)."""
+    if len(win) == 0: return None
+    runs = loss_runs(win)
+    level = np.minimum(np.concatenate(([0], runs[:-1])), MAX_LEVEL - 1)
+    stake = np.asarray(BETTING_SEQUENCE, dtype=np.float64)[level]
+    pnl = np.where(win, stake * (payout - 1), -stake)
+    equity = np.cumsum(pnl)
+    drawdown = np.max(np.maximum.accumulate(np.maximum(equity, 0)) - equity)  # peak counted from 0
+
+    sessions = len(pnl) // session
+    ruin = None
+    if sessions:
+        per_session = np.cumsum(pnl[:sessions * session].reshape(sessions, session), axis=1)
+        ruin = float(np.mean(per_session.min(axis=1) <= -bankroll))
+    return {
+        "bets": len(win), "hit": float(win.mean()), "streak": int(runs.max()),
+        "pnl": float(equity[-1]), "drawdown": float(drawdown), "ruin": ruin,
+    }
+
+def ladder_success(win_on_signal):
+    """Share of sureshot ladders (start at any signal) that win LADDER_STEPS in a row."""
+    if len(win_on_signal) < LADDER_STEPS: return None
+    c = np.concatenate(([0], np.cumsum(win_on_signal)))
+    return float(np.mean(c[LADDER_STEPS:] - c[:-LADDER_STEPS] == LADDER_STEPS))
+
+def target_stats(win, pack, sessions=2000, seed=0):
+    """
+    Target packs (calculate_sequence): many sessions started at random draws are
+    stepped together, one vectorized update per draw offset.
+    """
+    n = len(win)
+    if n <= TARGET_MAX_STEPS: return None
+    starts = np.random.default_rng(seed).integers(0, n - TARGET_MAX_STEPS, sessions)
+    bal = np.full(sessions, float(pack["start"]))
+    seq = _target_sequence(bal)
+    level = np.zeros(sessions, dtype=np.int64)
+    alive = np.ones(sessions, dtype=bool)
+    outcome = np.zeros(sessions, dtype=np.int8)   # 1 target, -1 bankrupt
+    rows = np.arange(sessions)
+    for t in range(TARGET_MAX_STEPS):
+        if not alive.any(): break
+        w = win[starts + t]
+        bet = seq[rows, level]
+        bal = np.where(alive, bal + np.where(w, bet, -bet), bal)
+        at_end = level >= len(TARGET_FRACTIONS) - 1
+        reseq = alive & (w | at_end)
+        level = np.where(alive, np.where(w | at_end, 0, level + 1), level)
+        if reseq.any(): seq[reseq] = _target_sequence(bal[reseq])
+        hit, bust = alive & (bal >= pack["target"]), alive & (bal <= TARGET_MIN_BALANCE)
+        outcome[hit], outcome[bust] = 1, -1
+        alive &= ~(hit | bust)
+    return {"target": float(np.mean(outcome == 1)), "bust": float(np.mean(outcome == -1))}
+
+def _target_sequence(bal):
+    seq = np.floor(np.maximum(bal, TARGET_MIN_BALANCE)[:, None] * TARGET_FRACTIONS).astype(np.float64)
+    over = seq.sum(axis=1) > bal
+    seq[over, -1] = bal[over] - seq[over, :-1].sum(axis=1)
+    return seq
+
+# ==========================================
+# REPORT
+# ==========================================
+
+def backtest(periods, numbers, platform, args):
+    o = (numbers > 4).astype(np.int8)
+    v5, hash_only, confluence = v5_engine(o, periods, TRUSTWIN_SALT if platform == "TrustWin" else V5_SALT)
+    picks = {"V1": v1_engine(o), "V2": v2_engine(o), "V3": v3_engine(o), "V4": v4_engine(o), "V5": v5}
+
+    live = np.arange(len(o)) >= WINDOW  # skip the warm-up draws
+    rows = {name: martingale_stats((p == o)[live], args.payout, args.session, args.bankroll) for name, p in picks.items()}
+    # Sureshot only bets on confluence signals (Tiranga salt, as in target_engine)
+    if platform != "Tiranga":
+        v5_t, _, confluence = v5_engine(o, periods, V5_SALT)
+    else:
+        v5_t = v5
+    ss_win = (v5_t == o)[live & confluence]
+    rows["Sureshot"] = martingale_stats(ss_win, args.payout, args.session, args.bankroll)
+    ladders = ladder_success(ss_win)
+    # Target sessions use the plain hash pick (no history is passed there)
+    targets = {key: target_stats((hash_only == o)[live], pack) for key, pack in TARGET_PACKS.items()}
+    return rows, ladders, targets
+
+def print_report(platform, n, elapsed, rows, ladders, targets):
+    print(f"\n{platform}: {n} draws in {elapsed:.2f}s")
+    print(f"{'engine':<10}{'bets':>9}{'hit %':>8}{'max L':>7}{'P&L':>11}{'max DD':>9}{'ruin %':>8}")
+    for name, r in rows.items():
+        if r is None:
+            print(f"{name:<10}{'-':>9}")
+            continue
+        ruin = f"{r['ruin'] * 100:.1f}" if r["ruin"] is not None else "-"
+        print(f"{name:<10}{r['bets']:>9}{r['hit'] * 100:>8.2f}{r['streak']:>7}{r['pnl']:>11.1f}{r['drawdown']:>9.1f}{ruin:>8}")
+    if ladders is not None:
+        print(f"Sureshot ladder ({LADDER_STEPS} wins): {ladders * 100:.2f}% complete")
+    for key, t in targets.items():
+        if t: print(f"{TARGET_PACKS[key]['name']:<16} target {t['target'] * 100:5.1f}%  bankrupt {t['bust'] * 100:5.1f}%")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--source", choices=["fake", "csv", "archive"], default="fake")
+    ap.add_argument("--csv", help="draw CSV (with --source csv)")
+    ap.add_argument("--draws", type=int, default=1_000_000, help="draws to generate (fake source)")
+    ap.add_argument("--game-type", choices=["30s", "1m"], default="30s")
+    ap.add_argument("--platforms", nargs="+", default=["Tiranga", "TrustWin"])
+    ap.add_argument("--payout", type=float, default=1.96, help="return per unit staked on a win")
+    ap.add_argument("--session", type=int, default=100, help="bets per session (ruin probability)")
+    ap.add_argument("--bankroll", type=float, default=sum(BETTING_SEQUENCE), help="units a session may lose before ruin")
+    args = ap.parse_args()
+
+    shared = None
+    if args.source == "fake": shared = fake_draws(args.draws)
+    elif args.source == "csv": shared = load_csv(args.csv)
+
+    for platform in args.platforms:
+        periods, numbers = shared or load_archive(platform, args.game_type)
+        if len(numbers) <= WINDOW:
+            print(f"\n{platform}: not enough draws ({len(numbers)})")
+            continue
+        t = time.perf_counter()
+        rows, ladders, targets = backtest(periods, numbers, platform, args)
+        print_report(platform, len(numbers), time.perf_counter() - t, rows, ladders, targets)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Chart backend benchmark: per-render time and memory, native (Pillow) vs matplotlib.
+
+Each backend runs in its own subprocess so import cost and RSS are not shared.
+Usage: python bench_charts.py [--renders 200] [--points 20] [--style line|candle]
+"""
+import argparse
+import json
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BACKENDS = ["native", "matplotlib"]
+
+def rss_mb():
+    # ru_maxrss is KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def fake_history(points, seed):
+    rng = random.Random(seed)
+    price, hist = 10.0, []
+    for _ in range(points):
+        price = round(price * rng.uniform(0.95, 1.05), 2)
+        hist.append(price)
+    return hist
+
+def run_worker(backend, renders, points, style):
+    rss_start = rss_mb()
+    t0 = time.perf_counter()
+    import chart_renderer
+    render = chart_renderer.render_native if backend == "native" else chart_renderer.render_matplotlib
+    # First render pays the lazy import (matplotlib) / font load (Pillow)
+    render("TET", fake_history(points, 0), style)
+    cold_ms = (time.perf_counter() - t0) * 1000
+
+    times, peaks, sizes = [], [], []
+    for i in range(renders):
+        hist = fake_history(points, i + 1)
+        tracemalloc.start()
+        t = time.perf_counter()
+        buf = render("TET", hist, style)
+        times.append((time.perf_counter() - t) * 1000)
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+        sizes.append(len(buf.getvalue()) / 1024)
+
+    times.sort()
+    print(json.dumps({
+        "backend": backend,
+        "cold_ms": cold_ms,
+        "mean_ms": statistics.mean(times),
+        "p95_ms": times[int(len(times) * 0.95) - 1],
+        "py_peak_kb": statistics.mean(peaks),
+        "rss_delta_mb": rss_mb() - rss_start,
+        "png_kb": statistics.mean(sizes),
+    }))
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--renders", type=int, default=200)
+    ap.add_argument("--points", type=int, default=20)
+    ap.add_argument("--style", choices=["line", "candle"], default="line")
+    ap.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        return run_worker(args.worker, args.renders, args.points, args.style)
+
+    rows = []
+    for backend in BACKENDS:
+        cmd = [sys.executable, __file__, "--worker", backend, "--renders", str(args.renders),
+               "--points", str(args.points), "--style", args.style]
+        out = subprocess.run(cmd, capture_output=True, text=True)
+        if out.returncode != 0:
+            print(f"{backend}: FAILED\n{out.stderr.strip()}")
+            continue
+        rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{args.renders} renders x {args.points} points ({args.style})")
+    print(f"{'backend':<11}{'cold ms':>9}{'mean ms':>9}{'p95 ms':>9}{'py peak KB':>12}{'RSS +MB':>9}{'PNG KB':>8}")
+    for r in rows:
+        print(f"{r['backend']:<11}{r['cold_ms']:>9.1f}{r['mean_ms']:>9.2f}{r['p95_ms']:>9.2f}"
+              f"{r['py_peak_kb']:>12.1f}{r['rss_delta_mb']:>9.1f}{r['png_kb']:>8.1f}")
+
+if __name__ == "__main__":
+    main()
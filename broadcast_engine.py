@@ -0,0 +1,130 @@
+import re
+import time
+import asyncio
+import logging
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from database import get_running_broadcasts, update_broadcast, get_audience_batch, mark_users_blocked
+from segments import compile_audience, describe
+from bulk_sender import send_limited, SENT, BLOCKED
+from outbound_scheduler import PRIORITY_BROADCAST
+from config import BROADCAST_BATCH_SIZE, BROADCAST_CONCURRENCY, BROADCAST_PROGRESS_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+# --- RESUMABLE BROADCASTS ---
+# Users are read from Mongo in user_id order, one batch at a time. After each
+# batch the cursor (last user_id) and counters are saved, so a restart resumes
+# from the next batch instead of starting over. Sends go through the outbound
+# scheduler at broadcast priority and are capped at BROADCAST_CONCURRENCY in flight.
+_tasks = {}     # broadcast_id -> asyncio.Task
+_stopping = set()
+VARIANT_MARKER = re.compile(r"^\[([A-Z]{2})\]\s*$", re.MULTILINE)  # a line like "[HI]" starts a variant
+
+def parse_variants(text):
+    """
+    "Hello\n[HI]\nनमस्ते" -> {"default": "Hello", "HI": "नमस्ते"}.
+    Users get the variant for their language, else the default (first) block.
+    """
+    parts = VARIANT_MARKER.split(text)
+    variants = {"default": parts[0].strip()}
+    for lang, body in zip(parts[1::2], parts[2::2]):
+        variants[lang] = body.strip()
+    if not variants["default"]:
+        variants["default"] = variants.get("EN") or next((v for v in variants.values() if v), "")
+    return variants
+
+def format_progress(b, rate=None):
+    done = b["sent"] + b["failed"] + b["blocked"]
+    pct = done / b["total"] * 100 if b["total"] else 100
+    bar = "█" * int(pct // 10) + "░" * (10 - int(pct // 10))
+    title = {"running": "📢 **BROADCASTING...**", "done": "✅ **BROADCAST COMPLETE**", "stopped": "⏹ **BROADCAST STOPPED**"}[b["status"]]
+    msg = (
+        f"{title}\n━━━━━━━━━━━━━━\n"
+        f"`{bar}` {pct:.0f}%\n"
+        f"✅ Sent: `{b['sent']}`  🚫 Blocked: `{b['blocked']}`  ❌ Failed: `{b['failed']}`\n"
+        f"👥 Audience: `{b['total']}` ({describe(b.get('segments', []))})"
+    )
+    if rate and b["status"] == "running":
+        left = max(0, b["total"] - done)
+        msg += f"\n⚡ {rate:.1f} msg/s · ETA {int(left / rate // 60)}m {int(left / rate % 60)}s"
+    return msg
+
+def progress_markup(b):
+    if b["status"] != "running": return None
+    return InlineKeyboardMarkup([[InlineKeyboardButton("⏹ Stop", callback_data=f"bc_stop_{b['broadcast_id']}")]])
+
+async def _edit_progress(bot, b, rate=None):
+    if not b.get("progress_chat_id") or not b.get("progress_message_id"): return
+    try:
+        await bot.edit_message_text(
+            format_progress(b, rate), chat_id=b["progress_chat_id"], message_id=b["progress_message_id"],
+            reply_markup=progress_markup(b), parse_mode="Markdown"
+        )
+    except Exception as e:
+        logger.debug(f"Progress edit skipped: {e}")
+
+async def _run(bot, b):
+    bid = b["broadcast_id"]
+    gate = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+    started, sent_at_start = time.monotonic(), b["sent"]
+    last_edit = 0.0
+
+    variants = b.get("variants") or {"default": b.get("text", "")}
+    audience = compile_audience(b.get("segments", []), b.get("ref_time"))
+
+    async def deliver(uid, lang):
+        async with gate:
+            return uid, await send_limited(bot, uid, variants.get(lang, variants["default"]), parse_mode="Markdown", priority=PRIORITY_BROADCAST)
+
+    try:
+        while bid not in _stopping:
+            batch = await asyncio.to_thread(get_audience_batch, audience, b["cursor"], BROADCAST_BATCH_SIZE)
+            if not batch: break
+            results = await asyncio.gather(*(deliver(uid, lang) for uid, lang in batch))
+
+            counts = {"sent": 0, "failed": 0, "blocked": 0}
+            blocked = []
+            for uid, status in results:
+                if status == SENT: counts["sent"] += 1
+                elif status == BLOCKED:
+                    counts["blocked"] += 1
+                    blocked.append(uid)
+                else: counts["failed"] += 1
+            b["cursor"] = batch[-1][0]
+            for k, v in counts.items(): b[k] += v
+            # Persist before moving on: a crash re-sends at most this one batch
+            await asyncio.to_thread(update_broadcast, bid, {"cursor": b["cursor"]}, counts)
+            if blocked: await asyncio.to_thread(mark_users_blocked, blocked)
+
+            if time.monotonic() - last_edit >= BROADCAST_PROGRESS_INTERVAL:
+                last_edit = time.monotonic()
+                rate = (b["sent"] - sent_at_start) / max(last_edit - started, 1e-6)
+                await _edit_progress(bot, b, rate)
+
+        b["status"] = "stopped" if bid in _stopping else "done"
+        update_broadcast(bid, {"status": b["status"], "finished_at": time.time()})
+        await _edit_progress(bot, b)
+        logger.info(f"📢 Broadcast {bid} {b['status']}: sent {b['sent']}, blocked {b['blocked']}, failed {b['failed']}")
+    except Exception as e:
+        # Left as "running" so the next start resumes from the saved cursor
+        logger.error(f"Broadcast {bid} interrupted: {e}")
+    finally:
+        _tasks.pop(bid, None)
+        _stopping.discard(bid)
+
+def start_broadcast(application, b):
+    """Runs a broadcast in the background (no-op if it is already running in this process)."""
+    if b["broadcast_id"] in _tasks: return
+    _tasks[b["broadcast_id"]] = application.create_task(_run(application.bot, b))
+
+def stop_broadcast(broadcast_id):
+    if broadcast_id not in _tasks: return False
+    _stopping.add(broadcast_id)
+    return True
+
+async def resume_broadcasts_job(context):
+    """JobQueue callback (run once at startup): continues broadcasts cut off by a restart."""
+    for b in await asyncio.to_thread(get_running_broadcasts):
+        logger.info(f"📢 Resuming broadcast {b['broadcast_id']} after user {b['cursor']}")
+        start_broadcast(context.application, b)
+        await _edit_progress(context.bot, b)
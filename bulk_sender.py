@@ -0,0 +1,38 @@
+import asyncio
+import logging
+from telegram.error import RetryAfter, Forbidden, BadRequest
+from outbound_scheduler import PRIORITY_ADMIN
+
+logger = logging.getLogger(__name__)
+
+# Delivery outcomes
+SENT, BLOCKED, FAILED = "sent", "blocked", "failed"
+
+async def send_limited(bot, chat_id, text, reply_markup=None, parse_mode=None, priority=PRIORITY_ADMIN):
+    """
+    One send through the bot's outbound scheduler (which paces it and retries
+    RetryAfter). A blocked / deleted chat returns BLOCKED so callers can prune it.
+    """
+    try:
+        await bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode, rate_limit_args=priority)
+        return SENT
+    except Forbidden:
+        return BLOCKED
+    except BadRequest as e:
+        if "chat not found" in str(e).lower(): return BLOCKED
+        logger.warning(f"Send to {chat_id} failed: {e}")
+    except RetryAfter as e:
+        logger.warning(f"Send to {chat_id} gave up after repeated flood waits: {e}")
+    except Exception as e:
+        logger.warning(f"Send to {chat_id} failed: {e}")
+    return FAILED
+
+async def send_bulk(bot, messages, parse_mode=None, priority=PRIORITY_ADMIN):
+    """
+    Sends (chat_id, text, reply_markup) messages. All sends are scheduled at once and
+    the scheduler paces them, so throughput is bounded by the global rate, not by
+    round-trip latency. Returns (sent, failed).
+    """
+    results = await asyncio.gather(*(send_limited(bot, cid, text, kb, parse_mode, priority) for cid, text, kb in messages))
+    sent = sum(1 for r in results if r == SENT)
+    return sent, len(results) - sent
@@ -0,0 +1,170 @@
+import io
+import logging
+from config import CHART_BACKEND
+
+logger = logging.getLogger(__name__)
+
+# --- SHARED STYLE (mirrors the original matplotlib chart) ---
+WIDTH, HEIGHT = 600, 300         # figsize=(6, 3) @ dpi=100
+UP_COLOR = (0x00, 0xff, 0x00)    # '#00ff00'
+DOWN_COLOR = (0xff, 0x00, 0x00)  # '#ff0000'
+GRID_COLOR = (178, 178, 178)     # black @ alpha 0.3 on white
+TEXT_COLOR = (0, 0, 0)
+PLOT_BOX = (70, 30, WIDTH - 20, HEIGHT - 30)  # left, top, right, bottom
+CANDLE_BUCKET = 4                # history points per candle
+
+def trend_color(history):
+    """Green if up, Red if down (same rule as the old chart)."""
+    return UP_COLOR if len(history) > 1 and history[-1] >= history[0] else DOWN_COLOR
+
+def to_candles(history, bucket=CANDLE_BUCKET):
+    """Groups a flat price history into (open, high, low, close) tuples."""
+    candles = []
+    for i in range(0, len(history), bucket):
+        chunk = history[i:i + bucket]
+        # Each candle opens at the previous close so bodies connect
+        opn = history[i - 1] if i > 0 else chunk[0]
+        candles.append((opn, max(opn, *chunk), min(opn, *chunk), chunk[-1]))
+    return candles
+
+def render_chart(symbol, history, style="line"):
+    """
+    Renders a price chart PNG into a BytesIO buffer.
+    Uses the Pillow renderer unless CHART_BACKEND=matplotlib is configured.
+    Returns None on failure (caller falls back to a text-only message).
+    """
+    try:
+        if CHART_BACKEND == "matplotlib":
+            return render_matplotlib(symbol, history, style)
+        return render_native(symbol, history, style)
+    except Exception as e:
+        logger.error(f"Chart Error ({CHART_BACKEND}): {e}")
+        return None
+
+# ==========================================
+# NATIVE (PILLOW) BACKEND
+# ==========================================
+
+def render_native(symbol, history, style="line"):
+    from PIL import Image, ImageDraw, ImageFont
+
+    img = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+    left, top, right, bottom = PLOT_BOX
+
+    lo, hi = min(history), max(history)
+    if hi == lo:
+        pad = abs(hi) * 0.05 or 1.0
+        lo, hi = lo - pad, hi + pad
+    margin = (hi - lo) * 0.05  # matplotlib-like margins
+    lo, hi = lo - margin, hi + margin
+    span = hi - lo
+
+    def y_of(price):
+        return bottom - (price - lo) / span * (bottom - top)
+
+    # Grid + Y tick labels (5 ticks)
+    for i in range(5):
+        price = lo + span * i / 4
+        y = y_of(price)
+        _dashed_line(draw, (left, y), (right, y), GRID_COLOR)
+        label = f"{price:.2f}"
+        draw.text((left - 6 - draw.textlength(label, font=font), y - 5), label, fill=TEXT_COLOR, font=font)
+
+    if style == "candle":
+        _draw_candles(draw, to_candles(history), left, right, y_of)
+    else:
+        _draw_line(draw, history, left, right, y_of, trend_color(history))
+
+    # Axes frame
+    draw.rectangle((left, top, right, bottom), outline=TEXT_COLOR)
+
+    # Title
+    title = f"{symbol} Price History"
+    draw.text(((left + right - draw.textlength(title, font=font)) / 2, 10), title, fill=TEXT_COLOR, font=font)
+
+    # Rotated Y label
+    ylabel = "Price (INR)"
+    lbl = Image.new("RGB", (int(draw.textlength(ylabel, font=font)) + 2, 12), "white")
+    ImageDraw.Draw(lbl).text((1, 0), ylabel, fill=TEXT_COLOR, font=font)
+    lbl = lbl.rotate(90, expand=True)
+    img.paste(lbl, (4, int((top + bottom - lbl.height) / 2)))
+
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    buf.seek(0)
+    return buf
+
+def _dashed_line(draw, start, end, color, dash=4, gap=3):
+    (x1, y1), (x2, y2) = start, end
+    length = max(abs(x2 - x1), abs(y2 - y1))
+    if length == 0: return
+    pos = 0
+    while pos < length:
+        a, b = pos / length, min(pos + dash, length) / length
+        draw.line((x1 + (x2 - x1) * a, y1 + (y2 - y1) * a, x1 + (x2 - x1) * b, y1 + (y2 - y1) * b), fill=color)
+        pos += dash + gap
+
+def _x_positions(count, left, right):
+    if count == 1: return [(left + right) / 2]
+    inner = (right - left) * 0.05  # matplotlib-like margins
+    step = (right - left - 2 * inner) / (count - 1)
+    return [left + inner + i * step for i in range(count)]
+
+def _draw_line(draw, history, left, right, y_of, color):
+    xs = _x_positions(len(history), left, right)
+    points = [(x, y_of(p)) for x, p in zip(xs, history)]
+    for x in xs:
+        _dashed_line(draw, (x, PLOT_BOX[1]), (x, PLOT_BOX[3]), GRID_COLOR)
+    if len(points) > 1:
+        draw.line(points, fill=color, width=2, joint="curve")
+    for x, y in points:
+        draw.ellipse((x - 3, y - 3, x + 3, y + 3), fill=color)
+
+def _draw_candles(draw, candles, left, right, y_of):
+    xs = _x_positions(len(candles), left, right)
+    half = max(2, min(12, (right - left) / (len(candles) * 3)))
+    for x, (opn, high, low, close) in zip(xs, candles):
+        color = UP_COLOR if close >= opn else DOWN_COLOR
+        draw.line((x, y_of(high), x, y_of(low)), fill=color, width=1)
+        y1, y2 = sorted((y_of(opn), y_of(close)))
+        draw.rectangle((x - half, y1, x + half, max(y2, y1 + 1)), fill=color)
+
+# ==========================================
+# MATPLOTLIB BACKEND (opt-in, imported lazily)
+# ==========================================
+
+_plt = None
+
+def _pyplot():
+    global _plt
+    if _plt is None:
+        import matplotlib
+        matplotlib.use('Agg') # Safe mode for servers
+        import matplotlib.pyplot as plt
+        _plt = plt
+    return _plt
+
+def render_matplotlib(symbol, history, style="line"):
+    plt = _pyplot()
+    fig, ax = plt.subplots(figsize=(6, 3), dpi=100)
+    try:
+        if style == "candle":
+            for i, (opn, high, low, close) in enumerate(to_candles(history)):
+                color = '#00ff00' if close >= opn else '#ff0000'
+                ax.vlines(i, low, high, color=color, linewidth=1)
+                ax.bar(i, abs(close - opn) or 1e-9, bottom=min(opn, close), color=color, width=0.6)
+        else:
+            color = '#00ff00' if trend_color(history) == UP_COLOR else '#ff0000'
+            ax.plot(history, marker='o', linestyle='-', color=color, linewidth=2, markersize=4)
+        ax.set_title(f"{symbol} Price History")
+        ax.set_ylabel("Price (INR)")
+        ax.grid(True, linestyle='--', alpha=0.3)
+
+        buf = io.BytesIO()
+        fig.savefig(buf, format='png', bbox_inches='tight')
+        buf.seek(0)
+        return buf
+    finally:
+        plt.close(fig)
@@ -13,6 +13,10 @@ REGISTER_LINK = "https://t.me/+pR0EE-BzatNjZjNl"
 PAYMENT_IMAGE_URL = "https://cdn.discordapp.com/attachments/888361275464220733/1451949298928455831/Screenshot_20251029-1135273.png?ex=698bede8&is=698a9c68&hm=2e188319c562c1c703c2f937fbc5802d62654854e50ac9e01a7ab5ab1553edd6&"
 PREDICTION_PROMPT = "➡️ **Please wait for the next period...**"
 
+# --- Charts ---
+# "native" = Pillow renderer (fast, light). "matplotlib" = legacy renderer, imported lazily.
+CHART_BACKEND = os.getenv("CHART_BACKEND", "native").lower()
+
 # --- Localization (FULL CONTENT RESTORED) ---
 LANGUAGES = {
     "EN": {
@@ -47,6 +51,11 @@ PREDICTION_PLANS = {
 # --- Packs & Target ---
 NUMBER_SHOT_PRICE = "100₹"
 NUMBER_SHOT_KEY = "number_shot_pack"
+NUMBER_SHOT_WINDOW = 100            # draws in the rolling 0-9 frequency histogram
+NUMBER_SHOT_WEIGHTS = (0.4, 0.4, 0.2)  # blend of window frequency, pair transition, gap
+NUMBER_SHOT_ALPHA = 1.0             # additive smoothing of the frequency and pair terms
+NUMBER_SHOT_MIN_HISTORY = 20        # draws needed before exact-number picks
+NUMBER_SHOT_TOP_K = 3               # numbers shown per Number Shot pick
 
 TARGET_PACKS = {
     "target_2k": {"name": "1K - 2K Target", "price": "200₹", "target": 2000, "start": 1000},
@@ -54,6 +63,12 @@ TARGET_PACKS = {
     "target_4k": {"name": "1K - 4K Target", "price": "400₹", "target": 4000, "start": 1000},
     "target_5k": {"name": "1K - 5K Target", "price": "500₹", "target": 5000, "start": 1000},
 }
+TARGET_SEQUENCE_PERCENTAGES = (0.01, 0.02, 0.05, 0.12, 0.30, 0.50)  # stake per loss step, share of balance
+TARGET_MIN_BALANCE = 50             # sequences are sized from at least this; at or below it a session is bankrupt
+MAX_LADDER_LEVEL = 5                # sureshot wins needed to complete the ladder
+LADDER_START_BET = 100              # first sureshot stake
+LADDER_PAYOUT = 1.96                # sureshot win returns stake x this (compounded)
+GAME_ROUND_SECONDS = {"30s": 30, "1m": 60}
 
 # --- Game Logic Constants ---
 BETTING_SEQUENCE = [1, 2, 4, 8, 16, 32] 
@@ -61,6 +76,45 @@ MAX_LEVEL = len(BETTING_SEQUENCE)
 MAX_HISTORY_LENGTH = 12 
 PATTERN_LENGTH = 4
 PATTERN_PROBABILITY = 0.8
+PREDICTION_CACHE_PERIODS = 6       # newest periods kept per (platform, game type) in the V5 cache
+V5_TABLE_PERIODS = 20000            # upcoming periods whose V5 hash digit is precomputed per feed
+V5_TABLE_REFRESH = 300              # seconds between V5 table top-ups
+TREND_STREAK = 4                    # same-side draws in a row that count as a streak
+TREND_SUPER_STREAK = 5              # streak length that overrides the V5 hash
+TREND_ZIGZAG = 4                    # alternating draws in a row that count as a zigzag
+TREND_MIN_HISTORY = 10              # draws needed before any trend call
+TREND_WINDOWS = (10, 20, 50, 100)   # rolling Big/Small count windows per feed
+DRAW_BUFFER_SIZE = 10000            # recent draws kept per feed (draw_buffer.py)
+DRAW_ARCHIVE_INTERVAL = 30          # seconds between writes of queued draws to the archive
+MARKOV_ORDER = 8                    # longest Big/Small context of the V6 model
+MARKOV_NUMBER_ORDER = 2             # longest number (0-9) context of the V6 model
+MARKOV_MIN_COUNT = 20               # observations a context needs before V6 trusts it
+MARKOV_ALPHA = 1.0                  # additive smoothing of V6 probabilities
+MARKOV_PERSIST_INTERVAL = 600       # seconds between V6 model saves
+DEFAULT_ENGINE = "V5"               # prediction engine of users who never picked one
+ENGINE_LATENCY_BUCKETS = (0.001, 0.005, 0.02, 0.1, 0.5)  # engine timing histogram limits (seconds)
+
+# --- Wallet ---
+VALUATION_SNAPSHOT_INTERVAL = 3600  # seconds between net-worth history snapshots
+ROI_CACHE_TTL = 60                  # seconds the admin ROI leaderboard is served from cache
+PORTFOLIO_CACHE_SIZE = 5000         # user portfolios kept in memory (least recently used are evicted)
+PORTFOLIO_CACHE_TTL = 300           # seconds before a cached portfolio is reloaded from the database
+LEDGER_SNAPSHOT_EVERY = 50          # ledger entries between per-user balance snapshots
+MARKET_TICK_INTERVAL = 30           # seconds between scheduled market moves (limit/stop orders trigger on these)
+ORDER_RELEASE_RETRY_AFTER = 60      # seconds before a cancelled order's unreleased escrow is retried
+ORDER_RELEASE_MEMORY = 20           # recent escrow releases a wallet remembers (retries never pay twice)
+
+# --- Admin / Notifications ---
+OUTBOUND_RATE = 28                  # global messages/second across the bot (Telegram allows ~30/s)
+OUTBOUND_PRIVATE_CHAT_RATE = 1.0    # messages/second into one private chat
+OUTBOUND_GROUP_CHAT_RATE = 20 / 60  # messages/second into one group (20/min)
+OUTBOUND_MAX_RETRIES = 3            # RetryAfter retries per request
+QUEUE_PAGE_SIZE = 8                 # pending items per admin queue page
+BROADCAST_BATCH_SIZE = 500          # user_ids read (and progress saved) per broadcast batch
+BROADCAST_CONCURRENCY = 20          # max in-flight sends per broadcast
+BROADCAST_PROGRESS_INTERVAL = 5     # seconds between live progress edits
+ACTIVITY_TOUCH_INTERVAL = 3600      # min seconds between last_active writes per user
+EDIT_COALESCE_WINDOW = 0.5          # seconds; rapid edits of one message collapse into the newest
 
 # --- SALTS ---
 V5_SALT = "ar-lottery-v5-plus"
@@ -3,8 +3,10 @@ import random
 import logging
 import uuid
 from datetime import datetime
-from pymongo import MongoClient
-from config import MONGO_URI
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from bson import ObjectId
+from config import MONGO_URI, LEDGER_SNAPSHOT_EVERY, ORDER_RELEASE_RETRY_AFTER, ORDER_RELEASE_MEMORY
 
 logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -14,6 +16,16 @@ settings_collection = None
 codes_collection = None
 tokens_collection = None       # NEW
 transactions_collection = None # NEW
+media_collection = None        # Telegram file_id registry
+valuations_collection = None   # Net-worth history snapshots
+orders_collection = None       # Resting limit / stop orders
+ledger_collection = None       # Append-only balance / holding ledger
+ledger_snapshots_collection = None
+purchases_collection = None    # Shop purchases awaiting payment verification
+broadcasts_collection = None   # Broadcast jobs + resumable progress
+draws_collection = None        # Archived game results (backtesting)
+models_collection = None       # Persisted prediction-engine state (markov_engine.py)
+sessions_collection = None     # Target / sureshot game sessions (one document each)
 
 try:
     client = MongoClient(MONGO_URI)
@@ -23,6 +35,47 @@ try:
     codes_collection = db.codes
     tokens_collection = db.tokens             # NEW
     transactions_collection = db.transactions # NEW
+    media_collection = db.media
+    media_collection.create_index("key", unique=True)
+    valuations_collection = db.valuation_snapshots
+    valuations_collection.create_index([("user_id", 1), ("ts", -1)])
+    users_collection.create_index("wallet.holdings")  # ROI leaderboard prefilter
+    orders_collection = db.orders
+    orders_collection.create_index("order_id", unique=True)
+    orders_collection.create_index([("status", 1), ("symbol", 1)])
+    orders_collection.create_index([("user_id", 1), ("status", 1)])
+    ledger_collection = db.ledger
+    ledger_collection.create_index([("user_id", 1), ("seq", 1)], unique=True)
+    ledger_snapshots_collection = db.ledger_snapshots
+    ledger_snapshots_collection.create_index([("user_id", 1), ("seq", -1)], unique=True)
+    tokens_collection.create_index("symbol")          # $lookup target
+    # One claim per UTR: a second deposit/purchase with the same UTR is rejected at insert
+    utr_unique = {"unique": True, "partialFilterExpression": {"utr": {"$type": "string"}}}
+    transactions_collection.create_index("utr", **utr_unique)
+    transactions_collection.create_index([("status", 1), ("type", 1), ("_id", 1)])  # pending queue (keyset pages)
+    purchases_collection = db.purchases
+    purchases_collection.create_index("purchase_id", unique=True)
+    purchases_collection.create_index("utr", **utr_unique)
+    purchases_collection.create_index([("user_id", 1), ("status", 1)])
+    purchases_collection.create_index([("status", 1), ("_id", 1)])
+    users_collection.create_index("user_id")          # broadcast cursor (range scan)
+    # Broadcast segments (segments.py)
+    users_collection.create_index([("prediction_status", 1), ("expiry_timestamp", 1)])
+    users_collection.create_index("expiry_timestamp")
+    users_collection.create_index("language")
+    users_collection.create_index("target_access")
+    users_collection.create_index("last_active")
+    broadcasts_collection = db.broadcasts
+    broadcasts_collection.create_index("broadcast_id", unique=True)
+    broadcasts_collection.create_index("status")
+    draws_collection = db.draws
+    draws_collection.create_index([("platform", 1), ("game_type", 1), ("p", 1)], unique=True)
+    models_collection = db.markov_models
+    sessions_collection = db.sessions
+    sessions_collection.create_index([("user_id", 1), ("kind", 1), ("state", 1)])
+    sessions_collection.create_index("session_id", unique=True)
+    # At most one active session per user and kind, whatever races start_session
+    sessions_collection.create_index([("user_id", 1), ("kind", 1)], unique=True, partialFilterExpression={"state": "active"})
     logger.info("✅ Successfully connected to MongoDB.")
 except Exception as e:
     logger.error(f"❌ Failed to connect to MongoDB: {e}")
@@ -33,6 +86,10 @@ def update_user_field(user_id, field, value):
     if users_collection is not None:
         users_collection.update_one({"user_id": user_id}, {"$set": {field: value}})
 
+def update_user_fields(user_id, fields):
+    if users_collection is not None and fields:
+        users_collection.update_one({"user_id": user_id}, {"$set": fields})
+
 def increment_user_field(user_id, field, amount=1):
     if users_collection is not None:
         users_collection.update_one({"user_id": user_id}, {"$inc": {field: amount}})
@@ -57,8 +114,6 @@ def get_user_data(user_id):
             "prediction_mode": "V5", 
             "has_number_shot": False,
             "target_access": None,
-            "target_session": None,
-            "sureshot_session": None,
             "referred_by": None,
             "referral_purchases": 0,
             "total_wins": 0,
@@ -95,6 +150,26 @@ def set_maintenance_mode(status: bool):
     if settings_collection is not None:
         settings_collection.update_one({"_id": "global_settings"}, {"$set": {"maintenance_mode": status}}, upsert=True)
 
+# --- V1 PATTERNS (admin-defined) ---
+def get_custom_patterns():
+    if settings_collection is None: return []
+    s = settings_collection.find_one({"_id": "global_settings"}, {"v1_patterns": 1})
+    return (s or {}).get("v1_patterns", [])
+
+def save_custom_pattern(seq, nxt, weight=1.0, name=None):
+    """Adds or replaces the pattern with this sequence."""
+    if settings_collection is None: return
+    settings_collection.update_one({"_id": "global_settings"}, {"$pull": {"v1_patterns": {"seq": seq}}}, upsert=True)
+    settings_collection.update_one(
+        {"_id": "global_settings"},
+        {"$push": {"v1_patterns": {"seq": seq, "next": nxt, "weight": weight, "name": name or seq}}}
+    )
+
+def delete_custom_pattern(seq):
+    if settings_collection is None: return False
+    res = settings_collection.update_one({"_id": "global_settings"}, {"$pull": {"v1_patterns": {"seq": seq}}})
+    return res.modified_count > 0
+
 # --- GIFT CODES ---
 def create_gift_code(plan_type, duration):
     if codes_collection is None: return "ERROR-DB"
@@ -132,6 +207,63 @@ def get_all_user_ids():
     if users_collection is not None: return users_collection.find({}, {"user_id": 1})
     return []
 
+# ==========================================
+# BROADCASTS
+# ==========================================
+# Users the bot can no longer reach are marked is_blocked_bot and skipped.
+BROADCAST_AUDIENCE = {"is_blocked_bot": {"$ne": True}}
+
+def create_broadcast(variants, created_by, progress_chat_id=None, segments=(), audience=BROADCAST_AUDIENCE, ref_time=None):
+    """
+    `variants` = {"default": text, "<LANG>": text, ...}. `segments` are stored (not the compiled
+    filter) together with `ref_time` so a resume recompiles the same audience.
+    Returns the new broadcast doc (status "running", cursor before the first user_id).
+    """
+    if broadcasts_collection is None: return None
+    doc = {
+        "broadcast_id": str(uuid.uuid4())[:8], "variants": variants, "created_by": created_by,
+        "segments": list(segments), "ref_time": int(ref_time or time.time()),
+        "total": users_collection.count_documents(audience),
+        "cursor": None, "sent": 0, "failed": 0, "blocked": 0, "status": "running",
+        "progress_chat_id": progress_chat_id, "progress_message_id": None,
+        "created_at": time.time(), "updated_at": time.time()
+    }
+    broadcasts_collection.insert_one(doc)
+    doc.pop("_id", None)
+    return doc
+
+def get_broadcast(broadcast_id):
+    if broadcasts_collection is None: return None
+    return broadcasts_collection.find_one({"broadcast_id": broadcast_id}, {"_id": 0})
+
+def get_running_broadcasts():
+    if broadcasts_collection is None: return []
+    return list(broadcasts_collection.find({"status": "running"}, {"_id": 0}))
+
+def update_broadcast(broadcast_id, fields=None, inc=None):
+    if broadcasts_collection is None: return
+    update = {"$set": {**(fields or {}), "updated_at": time.time()}}
+    if inc: update["$inc"] = inc
+    broadcasts_collection.update_one({"broadcast_id": broadcast_id}, update)
+
+def get_audience_batch(audience, after_user_id=None, limit=500):
+    """Next batch of (user_id, language) after the cursor (range scan on the user_id index)."""
+    if users_collection is None: return []
+    flt = audience if after_user_id is None else {"$and": [audience, {"user_id": {"$gt": after_user_id}}]}
+    return [(u["user_id"], u.get("language") or "EN")
+            for u in users_collection.find(flt, {"_id": 0, "user_id": 1, "language": 1}).sort("user_id", 1).limit(limit)]
+
+def count_audience(audience):
+    return users_collection.count_documents(audience) if users_collection is not None else 0
+
+def touch_last_active(user_id, ts=None):
+    if users_collection is not None:
+        users_collection.update_one({"user_id": user_id}, {"$set": {"last_active": int(ts or time.time())}})
+
+def mark_users_blocked(user_ids):
+    if users_collection is not None and user_ids:
+        users_collection.update_many({"user_id": {"$in": list(user_ids)}}, {"$set": {"is_blocked_bot": True}})
+
 def get_top_referrers(limit=10):
     if users_collection is not None: return list(users_collection.find().sort("referral_purchases", -1).limit(limit))
     return []
@@ -202,6 +334,11 @@ def get_all_tokens():
             
     return tokens
 
+def get_token_prices():
+    """Returns {symbol: (name, price)} without history or market simulation."""
+    if tokens_collection is None: return {}
+    return {t['symbol']: (t.get('name', t['symbol']), t['price']) for t in tokens_collection.find({}, {"_id": 0, "symbol": 1, "name": 1, "price": 1})}
+
 def get_token_details(symbol):
     """Fetches single token with history."""
     if tokens_collection is None: return None
@@ -211,6 +348,41 @@ def update_token_price(symbol, new_price):
     if tokens_collection is not None:
         tokens_collection.update_one({"symbol": symbol}, {"$set": {"price": float(new_price)}, "$push": {"history": float(new_price)}})
 
+def get_roi_leaderboard(limit=10):
+    """
+    Token ROI ranking computed inside Mongo (no per-user Python loop).
+    Prefilter `wallet.holdings > {}` uses the wallet.holdings index to skip
+    users that never traded; prices are joined from tokens via $lookup.
+    """
+    if users_collection is None or tokens_collection is None: return []
+    pipeline = [
+        {"$match": {"wallet.holdings": {"$gt": {}}}},
+        {"$project": {
+            "_id": 0, "user_id": 1,
+            "h": {"$objectToArray": "$wallet.holdings"},
+            "inv": {"$objectToArray": {"$ifNull": ["$wallet.invested_amt", {}]}}
+        }},
+        {"$unwind": "$h"},
+        {"$match": {"h.v": {"$gt": 0}}},
+        {"$lookup": {"from": tokens_collection.name, "localField": "h.k", "foreignField": "symbol", "as": "t"}},
+        {"$group": {
+            "_id": "$user_id",
+            "current": {"$sum": {"$multiply": ["$h.v", {"$ifNull": [{"$arrayElemAt": ["$t.price", 0]}, 0]}]}},
+            "invested": {"$sum": {"$sum": {"$map": {
+                "input": {"$filter": {"input": "$inv", "as": "i", "cond": {"$eq": ["$$i.k", "$h.k"]}}},
+                "as": "i", "in": "$$i.v"
+            }}}}
+        }},
+        {"$match": {"invested": {"$gt": 0}}},
+        {"$project": {
+            "_id": 0, "uid": "$_id",
+            "roi": {"$multiply": [{"$divide": [{"$subtract": ["$current", "$invested"]}, "$invested"]}, 100]}
+        }},
+        {"$sort": {"roi": -1, "uid": 1}},
+        {"$limit": limit}
+    ]
+    return list(users_collection.aggregate(pipeline))
+
 # ==========================================
 # WALLET FUNCTIONS
 # ==========================================
@@ -219,41 +391,191 @@ def get_user_wallet(user_id):
     u = get_user_data(user_id)
     return u.get("wallet", {"balance": 0.0, "holdings": {}, "invested_amt": {}})
 
-def update_wallet_balance(user_id, amount):
-    if users_collection is not None:
-        users_collection.update_one({"user_id": user_id}, {"$inc": {"wallet.balance": float(amount)}})
+def update_wallet_balance(user_id, amount, entry_type="admin_adjust", ref=None):
+    """Credits/debits the fiat balance and records it in the ledger. Returns the new wallet."""
+    return _apply_wallet_change(
+        {"user_id": user_id}, {"wallet.balance": float(amount)},
+        entry_type, float(amount), None, ref
+    )
+
+def withdraw_funds(user_id, amount, ref=None):
+    """Guarded debit: applies only while the balance covers `amount`. Returns the new wallet, or None."""
+    return _apply_wallet_change(
+        {"user_id": user_id, "wallet.balance": {"$gte": float(amount)}}, {"wallet.balance": -float(amount)},
+        "withdrawal", -float(amount), None, ref
+    )
 
 def update_token_holding(user_id, symbol, quantity, cost=0):
-    if users_collection is not None:
-        users_collection.update_one(
-            {"user_id": user_id},
-            {"$inc": {f"wallet.holdings.{symbol}": quantity, f"wallet.invested_amt.{symbol}": cost}}
-        )
+    return _apply_wallet_change(
+        {"user_id": user_id}, {f"wallet.holdings.{symbol}": quantity, f"wallet.invested_amt.{symbol}": cost},
+        "admin_adjust", 0.0, {symbol: quantity}, None
+    )
 
 def trade_token(user_id, symbol, quantity, price, is_buy=True):
-    if users_collection is None: return
+    """
+    Guarded trade in ONE round trip: the balance / holding check is part of the
+    filter, so the check and the $inc are atomic and parallel taps can't overdraw.
+    Returns the post-trade wallet, or None if funds / tokens were insufficient.
+    """
+    if users_collection is None: return None
     cost = float(quantity * price)
     
     if is_buy:
-        users_collection.update_one(
-            {"user_id": user_id},
-            {"$inc": {"wallet.balance": -cost, f"wallet.holdings.{symbol}": quantity, f"wallet.invested_amt.{symbol}": cost}}
-        )
+        flt = {"user_id": user_id, "wallet.balance": {"$gte": cost}}
+        inc = {"wallet.balance": -cost, f"wallet.holdings.{symbol}": quantity, f"wallet.invested_amt.{symbol}": cost}
     else:
-        users_collection.update_one(
-            {"user_id": user_id},
-            {"$inc": {"wallet.balance": cost, f"wallet.holdings.{symbol}": -quantity}}
+        flt = {"user_id": user_id, f"wallet.holdings.{symbol}": {"$gte": quantity}}
+        inc = {"wallet.balance": cost, f"wallet.holdings.{symbol}": -quantity}
+    
+    return _apply_wallet_change(
+        flt, inc, "buy" if is_buy else "sell",
+        -cost if is_buy else cost, {symbol: quantity if is_buy else -quantity}, symbol
+    )
+
+# ==========================================
+# LEDGER (Append-only, double-entry)
+# ==========================================
+# Every balance / holding change appends one entry keyed (user_id, seq).
+# Single changes bump wallet.ledger_seq in the SAME atomic update; bulk
+# changes reserve their seqs afterwards with one $inc per user. Every
+# LEDGER_SNAPSHOT_EVERY entries the post-update wallet is stored as a
+# snapshot, so any balance rebuilds from the latest snapshot + a short tail.
+# Entry types: deposit, withdrawal, refund, buy, sell, admin_adjust,
+# order_reserve, order_release, order_fill.
+# Each entry stores its legs as [account, unit, amount]: the user's "wallet"
+# against the "house" (money / tokens entering or leaving the user) or
+# "escrow" (held for resting orders). Unit is LEDGER_CASH or a token symbol,
+# and every unit's legs sum to zero.
+
+LEDGER_CASH = "INR"
+LEDGER_CONTRA = {"order_reserve": "escrow", "order_release": "escrow"}   # all other types settle against "house"
+
+def _ledger_legs(entry_type, bal, hold):
+    """Wallet legs for the deltas plus the opposite legs on the entry type's contra account."""
+    contra = LEDGER_CONTRA.get(entry_type, "house")
+    legs = []
+    if bal: legs += [["wallet", LEDGER_CASH, round(bal, 2)], [contra, LEDGER_CASH, -round(bal, 2)]]
+    for sym, q in (hold or {}).items(): legs += [["wallet", sym, q], [contra, sym, -q]]
+    return legs
+
+def ledger_wallet_delta(entry):
+    """(balance delta, {symbol: qty delta}) from an entry's wallet legs (older entries store them as bal / hold)."""
+    if "legs" not in entry: return entry.get("bal", 0), entry.get("hold", {})
+    bal, hold = 0.0, {}
+    for account, unit, amount in entry["legs"]:
+        if account != "wallet": continue
+        if unit == LEDGER_CASH: bal += amount
+        else: hold[unit] = hold.get(unit, 0) + amount
+    return bal, hold
+
+def _apply_wallet_change(flt, inc, entry_type, bal_delta, hold_delta, ref, extra=None):
+    """Guarded $inc (+ any `extra` update operators) + ledger entry. Returns the post-update wallet, or None if the guard failed."""
+    if users_collection is None: return None
+    doc = users_collection.find_one_and_update(
+        flt, {"$inc": {**inc, "wallet.ledger_seq": 1}, **(extra or {})},
+        projection={"_id": 0, "user_id": 1, "wallet": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not doc: return None
+    _append_ledger(doc["user_id"], doc["wallet"], [(entry_type, bal_delta, hold_delta, ref)])
+    return doc["wallet"]
+
+def _append_ledger(user_id, wallet, entries):
+    """
+    `entries` = [(type, balance_delta, {symbol: qty_delta} | None, ref[, legs])] already
+    applied to `wallet`, whose ledger_seq is the seq of the LAST entry. `legs` is only
+    given when the entry moves more than wallet <-> contra (order fills).
+    """
+    if ledger_collection is None or not entries: return
+    last = wallet.get("ledger_seq", 0)
+    first = last - len(entries) + 1
+    now = time.time()
+    docs = []
+    for i, (entry_type, bal, hold, ref, *legs) in enumerate(entries):
+        d = {"user_id": user_id, "seq": first + i, "type": entry_type, "legs": legs[0] if legs else _ledger_legs(entry_type, bal, hold), "ts": now}
+        if ref is not None: d["ref"] = ref
+        docs.append(d)
+    ledger_collection.insert_many(docs, ordered=False)
+
+    if first == 1:
+        # Opening snapshot: whatever the wallet held before the ledger existed
+        base_bal = wallet.get("balance", 0.0) - sum(e[1] for e in entries)
+        base_hold = dict(wallet.get("holdings", {}))
+        for e in entries:
+            for sym, q in (e[2] or {}).items(): base_hold[sym] = base_hold.get(sym, 0) - q
+        _save_ledger_snapshot(user_id, 0, base_bal, base_hold)
+    if last // LEDGER_SNAPSHOT_EVERY > (first - 1) // LEDGER_SNAPSHOT_EVERY:
+        _save_ledger_snapshot(user_id, last, wallet.get("balance", 0.0), wallet.get("holdings", {}))
+
+def _append_ledger_bulk(entries_by_user):
+    """
+    Ledger entries for a bulk_write of wallet changes. Each user's seqs are reserved
+    in one atomic $inc of their entry count, so concurrent changes can't take the same seqs.
+    """
+    if not entries_by_user or users_collection is None: return
+    for uid, entries in entries_by_user.items():
+        doc = users_collection.find_one_and_update(
+            {"user_id": uid}, {"$inc": {"wallet.ledger_seq": len(entries)}},
+            projection={"_id": 0, "wallet": 1}, return_document=ReturnDocument.AFTER
         )
+        if doc: _append_ledger(uid, doc["wallet"], entries)
+
+def _save_ledger_snapshot(user_id, seq, balance, holdings):
+    if ledger_snapshots_collection is not None:
+        ledger_snapshots_collection.update_one(
+            {"user_id": user_id, "seq": seq},
+            {"$set": {"balance": round(balance, 2), "holdings": holdings, "ts": time.time()}},
+            upsert=True
+        )
+
+def get_ledger_entries(user_id, after_seq=0, limit=50):
+    """Range scan on (user_id, seq)."""
+    if ledger_collection is None: return []
+    return list(ledger_collection.find({"user_id": user_id, "seq": {"$gt": after_seq}}, {"_id": 0}).sort("seq", 1).limit(limit))
+
+def rebuild_wallet_from_ledger(user_id):
+    """Latest snapshot + tail replay. Returns {"seq", "balance", "holdings", "replayed"} or None."""
+    if ledger_collection is None or ledger_snapshots_collection is None: return None
+    snap = ledger_snapshots_collection.find_one({"user_id": user_id}, {"_id": 0}, sort=[("seq", -1)])
+    if not snap: return None
+    balance, holdings, seq = snap["balance"], dict(snap.get("holdings", {})), snap["seq"]
+    replayed = 0
+    for e in ledger_collection.find({"user_id": user_id, "seq": {"$gt": seq}}, {"_id": 0}).sort("seq", 1):
+        bal, hold = ledger_wallet_delta(e)
+        balance += bal
+        for sym, q in hold.items(): holdings[sym] = holdings.get(sym, 0) + q
+        seq = e["seq"]
+        replayed += 1
+    return {"seq": seq, "balance": round(balance, 2), "holdings": holdings, "replayed": replayed}
+
+def ledger_imbalances(user_id):
+    """Seqs of the user's double-entry ledger entries whose legs don't sum to zero per unit."""
+    if ledger_collection is None: return []
+    bad = []
+    for e in ledger_collection.find({"user_id": user_id, "legs": {"$exists": True}}, {"_id": 0, "seq": 1, "legs": 1}):
+        totals = {}
+        for _, unit, amount in e["legs"]: totals[unit] = totals.get(unit, 0) + amount
+        if any(abs(t) > 0.005 for t in totals.values()): bad.append(e["seq"])
+    return bad
 
 # ==========================================
 # TRANSACTION HISTORY
 # ==========================================
 
-def create_transaction(user_id, tx_type, amount, method, details):
+def normalize_utr(utr):
+    """UTRs are compared as upper-case alphanumerics (users paste spaces, dashes, etc.)."""
+    return "".join(ch for ch in str(utr) if ch.isalnum()).upper()
+
+def create_transaction(user_id, tx_type, amount, method, details, utr=None):
+    """Returns the tx_id, or None if `utr` was already claimed by another transaction."""
     if transactions_collection is None: return "ERROR"
     tx_id = str(uuid.uuid4())[:8]
     tx_data = {"tx_id": tx_id, "user_id": user_id, "type": tx_type, "amount": float(amount), "method": method, "details": details, "status": "pending", "timestamp": time.time()}
-    transactions_collection.insert_one(tx_data)
+    if utr: tx_data["utr"] = normalize_utr(utr)
+    try:
+        transactions_collection.insert_one(tx_data)
+    except DuplicateKeyError:
+        return None
     return tx_id
 
 def get_user_transactions(user_id, limit=5):
@@ -266,4 +588,407 @@ def get_transaction(tx_id):
 def update_transaction_status(tx_id, status):
     transactions_collection.update_one({"tx_id": tx_id}, {"$set": {"status": status}})
 
+# ==========================================
+# SHOP PURCHASES
+# ==========================================
+
+def create_purchase(user_id, item_key, amount, utr):
+    """Returns the purchase_id, or None if the UTR was already claimed."""
+    if purchases_collection is None: return "ERROR"
+    purchase_id = str(uuid.uuid4())[:8]
+    try:
+        purchases_collection.insert_one({
+            "purchase_id": purchase_id, "user_id": user_id, "item": item_key, "amount": float(amount),
+            "utr": normalize_utr(utr), "status": "pending", "timestamp": time.time()
+        })
+    except DuplicateKeyError:
+        return None
+    return purchase_id
+
+def resolve_purchase(purchase_id, status):
+    """Closes one pending purchase (manual admin approve/reject). Returns it, or None if it was already settled."""
+    if purchases_collection is None: return None
+    return purchases_collection.find_one_and_update(
+        {"purchase_id": purchase_id, "status": "pending"},
+        {"$set": {"status": status, "resolved_at": time.time()}}, projection={"_id": 0}
+    )
+
+# ==========================================
+# RECONCILIATION (Bulk UTR matching)
+# ==========================================
+
+def get_pending_utr_claims():
+    """Streams pending deposits and purchases that carry a UTR, tagged "dep" / "shop"."""
+    if transactions_collection is not None:
+        for t in transactions_collection.find({"status": "pending", "type": "deposit", "utr": {"$type": "string"}},
+                                              {"_id": 0, "tx_id": 1, "user_id": 1, "amount": 1, "utr": 1}):
+            yield "dep", t
+    if purchases_collection is not None:
+        for p in purchases_collection.find({"status": "pending", "utr": {"$type": "string"}},
+                                           {"_id": 0, "purchase_id": 1, "user_id": 1, "item": 1, "amount": 1, "utr": 1}):
+            yield "shop", p
+
+def _claim_batch(collection, id_field, docs, flt, fields, batch_field, per_doc=None):
+    """
+    Applies `fields` (plus `per_doc(doc)`, if given) to every doc still matching
+    `flt` in one bulk_write. Returns the docs this call actually flipped (others lost a race).
+    """
+    batch = uuid.uuid4().hex
+    res = collection.bulk_write([
+        UpdateOne({id_field: d[id_field], **flt}, {"$set": {**fields, **(per_doc(d) if per_doc else {}), batch_field: batch}}) for d in docs
+    ], ordered=False)
+    if res.modified_count != len(docs):
+        won = {d[id_field] for d in collection.find({batch_field: batch}, {id_field: 1})}
+        docs = [d for d in docs if d[id_field] in won]
+    return docs
+
+def approve_deposits_bulk(txs):
+    """Completes pending deposits and credits the wallets (+ ledger) in bulk. Returns the approved txs."""
+    if not txs or transactions_collection is None: return []
+    txs = _claim_batch(transactions_collection, "tx_id", txs, {"status": "pending"},
+                       {"status": "completed", "completed_at": time.time()}, "recon_batch")
+    if not txs: return []
+    ops, entries = [], {}
+    for t in txs:
+        ops.append(UpdateOne({"user_id": t["user_id"]}, {"$inc": {"wallet.balance": float(t["amount"])}}))
+        entries.setdefault(t["user_id"], []).append(("deposit", float(t["amount"]), None, t["tx_id"]))
+    users_collection.bulk_write(ops, ordered=False)
+    _append_ledger_bulk(entries)
+    return txs
+
+def approve_purchases_bulk(purchases, fields_for):
+    """
+    Completes pending purchases and grants access in one users bulk_write.
+    `fields_for(item_key)` returns the $set for that item. Referrers are credited too.
+    """
+    if not purchases or purchases_collection is None: return []
+    purchases = _claim_batch(purchases_collection, "purchase_id", purchases, {"status": "pending"},
+                             {"status": "completed", "completed_at": time.time()}, "recon_batch")
+    if not purchases: return []
+    refs = {u["user_id"]: u.get("referred_by") for u in users_collection.find(
+        {"user_id": {"$in": list({p["user_id"] for p in purchases})}}, {"_id": 0, "user_id": 1, "referred_by": 1})}
+    ops = []
+    for p in purchases:
+        fields = fields_for(p["item"])
+        if fields: ops.append(UpdateOne({"user_id": p["user_id"]}, {"$set": fields}))
+        if refs.get(p["user_id"]): ops.append(UpdateOne({"user_id": refs[p["user_id"]]}, {"$inc": {"referral_purchases": 1}}))
+    if ops: users_collection.bulk_write(ops, ordered=True)  # ordered: same-user grants apply in purchase order
+    return purchases
+
+# ==========================================
+# ADMIN APPROVAL QUEUE
+# ==========================================
+# Queue kinds: "dep" (deposits), "wd" (withdrawals), "shop" (purchases).
+
+def _queue_source(kind):
+    if kind == "shop": return purchases_collection, "purchase_id", {"status": "pending"}
+    return transactions_collection, "tx_id", {"status": "pending", "type": "deposit" if kind == "dep" else "withdraw"}
+
+def get_pending_page(kind, after_id=None, limit=8):
+    """Keyset page of pending items ordered by _id (no skip(), so deep pages stay cheap)."""
+    coll, _, flt = _queue_source(kind)
+    if coll is None: return []
+    if after_id: flt["_id"] = {"$gt": ObjectId(after_id)}
+    return list(coll.find(flt).sort("_id", 1).limit(limit))
+
+def count_pending(kind):
+    coll, _, flt = _queue_source(kind)
+    return coll.count_documents(flt) if coll is not None else 0
+
+def settle_queue_bulk(kind, ids, approve, fields_for=None):
+    """
+    Approves/rejects pending queue items in bulk. Returns the docs actually settled.
+    Money moves (deposit credit, withdrawal refund) go through one users bulk_write + ledger.
+    """
+    coll, id_field, flt = _queue_source(kind)
+    if coll is None or not ids: return []
+    docs = list(coll.find({**flt, id_field: {"$in": list(ids)}}, {"_id": 0}))
+    if not docs: return []
+    if kind == "dep" and approve: return approve_deposits_bulk(docs)
+    if kind == "shop" and approve: return approve_purchases_bulk(docs, fields_for)
+
+    status = "completed" if approve else "rejected"
+    docs = _claim_batch(coll, id_field, docs, flt, {"status": status, "resolved_at": time.time()}, "queue_batch")
+    if not docs: return []
+    if kind == "wd" and not approve:
+        # Refund the escrowed withdrawal
+        entries = {}
+        for t in docs: entries.setdefault(t["user_id"], []).append(("refund", float(t["amount"]), None, t["tx_id"]))
+        users_collection.bulk_write([
+            UpdateOne({"user_id": t["user_id"]}, {"$inc": {"wallet.balance": float(t["amount"])}}) for t in docs
+        ], ordered=False)
+        _append_ledger_bulk(entries)
+    elif kind == "shop":
+        users_collection.update_many({"user_id": {"$in": [p["user_id"] for p in docs]}}, {"$set": {"payment_pending_target": False}})
+    return docs
+
+def flag_utr_claims(flags):
+    """`flags` = [(kind, id, flag, detail)]. Marks claims for manual review without changing status."""
+    ops = {"dep": [], "shop": []}
+    for kind, doc_id, flag, detail in flags:
+        id_field = "tx_id" if kind == "dep" else "purchase_id"
+        ops[kind].append(UpdateOne({id_field: doc_id}, {"$set": {"recon_flag": flag, "recon_detail": detail}}))
+    if ops["dep"] and transactions_collection is not None: transactions_collection.bulk_write(ops["dep"], ordered=False)
+    if ops["shop"] and purchases_collection is not None: purchases_collection.bulk_write(ops["shop"], ordered=False)
+
+# ==========================================
+# LIMIT / STOP ORDERS
+# ==========================================
+# Funds (buys) or tokens (sells) are escrowed when the order is placed, so a
+# fill can never fail for lack of balance and settles with plain $incs.
+# Orders fill at the tick price that crossed them; a buy gets back the part of
+# its escrow the fill did not use. A Stop Buy that gapped above its trigger
+# fills at the trigger, the most its escrow covers.
+# Cancelling flips the order to "cancelled" with released=False, then returns
+# the escrow; the wallet remembers its last ORDER_RELEASE_MEMORY released
+# order_ids, so release_stale_cancels can retry a release cut short by a crash
+# without ever paying twice.
+
+ORDER_KINDS = {
+    "lbuy":  {"name": "Limit Buy",  "side": "buy",  "fires": "le"},  # price <= trigger
+    "lsell": {"name": "Limit Sell", "side": "sell", "fires": "ge"},  # price >= trigger
+    "ssell": {"name": "Stop Loss",  "side": "sell", "fires": "le"},
+    "sbuy":  {"name": "Stop Buy",   "side": "buy",  "fires": "ge"},
+}
+
+def create_order(user_id, symbol, kind, quantity, trigger):
+    """Escrows funds/tokens (guarded) and stores the order. Returns (order, wallet) or (None, None)."""
+    if users_collection is None or orders_collection is None: return None, None
+    side = ORDER_KINDS[kind]["side"]
+    amount = float(quantity * trigger)
+    order_id = str(uuid.uuid4())[:8]
+    if side == "buy":
+        flt = {"user_id": user_id, "wallet.balance": {"$gte": amount}}
+        wallet = _apply_wallet_change(flt, {"wallet.balance": -amount}, "order_reserve", -amount, None, order_id)
+    else:
+        flt = {"user_id": user_id, f"wallet.holdings.{symbol}": {"$gte": quantity}}
+        wallet = _apply_wallet_change(flt, {f"wallet.holdings.{symbol}": -quantity}, "order_reserve", 0.0, {symbol: -quantity}, order_id)
+    if not wallet: return None, None
+
+    order = {
+        "order_id": order_id, "user_id": user_id, "symbol": symbol,
+        "kind": kind, "side": side, "quantity": quantity, "trigger": float(trigger),
+        "status": "open", "timestamp": time.time()
+    }
+    orders_collection.insert_one(order)
+    order.pop("_id", None)
+    return order, wallet
+
+def cancel_order(user_id, order_id):
+    """Cancels an open order and releases its escrow. Returns (order, wallet) or (None, None)."""
+    if orders_collection is None: return None, None
+    order = orders_collection.find_one_and_update(
+        {"order_id": order_id, "user_id": user_id, "status": "open"},
+        {"$set": {"status": "cancelled", "released": False, "cancelled_at": time.time()}}, projection={"_id": 0}
+    )
+    if not order: return None, None
+    return order, _release_escrow(order)
+
+def _release_escrow(order):
+    """Returns a cancelled order's escrow exactly once. Returns the post-update wallet (None if already released)."""
+    uid, order_id = order["user_id"], order["order_id"]
+    flt = {"user_id": uid, "wallet.released_orders": {"$ne": order_id}}
+    remember = {"$push": {"wallet.released_orders": {"$each": [order_id], "$slice": -ORDER_RELEASE_MEMORY}}}
+    if order["side"] == "buy":
+        amount = float(order["quantity"] * order["trigger"])
+        wallet = _apply_wallet_change(flt, {"wallet.balance": amount}, "order_release", amount, None, order_id, remember)
+    else:
+        sym, qty = order["symbol"], order["quantity"]
+        wallet = _apply_wallet_change(flt, {f"wallet.holdings.{sym}": qty}, "order_release", 0.0, {sym: qty}, order_id, remember)
+    orders_collection.update_one({"order_id": order_id}, {"$set": {"released": True}})
+    return wallet
+
+def release_stale_cancels():
+    """Retries escrow releases that a cancel left unfinished. Returns [(user_id, wallet)] of wallets that changed."""
+    if orders_collection is None: return []
+    stale = orders_collection.find(
+        {"status": "cancelled", "released": False, "cancelled_at": {"$lt": time.time() - ORDER_RELEASE_RETRY_AFTER}}, {"_id": 0}
+    )
+    changed = []
+    for order in stale:
+        wallet = _release_escrow(order)
+        if wallet: changed.append((order["user_id"], wallet))
+    return changed
+
+def get_open_orders(user_id=None):
+    if orders_collection is None: return []
+    flt = {"status": "open"}
+    if user_id is not None: flt["user_id"] = user_id
+    return list(orders_collection.find(flt, {"_id": 0}).sort("timestamp", 1))
+
+def settle_orders(orders):
+    """
+    Fills triggered orders in two bulk_writes (orders, then wallets) at each
+    order's "fill_price" (the crossing tick; the trigger if unset). Each order
+    update is guarded on status=open; only orders that actually flipped are
+    credited. Returns the list of filled orders, fill_price set.
+    """
+    if not orders or orders_collection is None: return []
+    for o in orders:
+        price = float(o.get("fill_price", o["trigger"]))
+        o["fill_price"] = min(price, o["trigger"]) if o["side"] == "buy" else price
+    orders = _claim_batch(orders_collection, "order_id", orders, {"status": "open"},
+                          {"status": "filled", "filled_at": time.time()}, "fill_batch",
+                          per_doc=lambda o: {"fill_price": o["fill_price"]})
+    if not orders: return []
+
+    ops, entries = [], {}
+    for o in orders:
+        sym, qty = o["symbol"], o["quantity"]
+        amount = round(float(qty * o["fill_price"]), 2)
+        if o["side"] == "buy":
+            escrowed = round(float(qty * o["trigger"]), 2)
+            refund = round(escrowed - amount, 2)   # escrow the fill did not use
+            inc = {f"wallet.holdings.{sym}": qty, f"wallet.invested_amt.{sym}": amount}
+            if refund: inc["wallet.balance"] = refund
+            legs = [["escrow", LEDGER_CASH, -escrowed], ["house", LEDGER_CASH, amount], ["wallet", LEDGER_CASH, refund],
+                    ["house", sym, -qty], ["wallet", sym, qty]]
+            entry = ("order_fill", refund, {sym: qty}, o["order_id"], legs)
+        else:
+            inc = {"wallet.balance": amount}
+            legs = [["house", LEDGER_CASH, -amount], ["wallet", LEDGER_CASH, amount], ["escrow", sym, -qty], ["house", sym, qty]]
+            entry = ("order_fill", amount, None, o["order_id"], legs)
+        ops.append(UpdateOne({"user_id": o["user_id"]}, {"$inc": inc}))
+        entries.setdefault(o["user_id"], []).append(entry)
+    users_collection.bulk_write(ops, ordered=False)
+    _append_ledger_bulk(entries)
+    return orders
+
+# ==========================================
+# VALUATION SNAPSHOTS
+# ==========================================
+
+def save_valuation_snapshots(rows):
+    if valuations_collection is not None and rows:
+        valuations_collection.insert_many(rows, ordered=False)
+
+def get_valuation_history(user_id, limit=30):
+    if valuations_collection is None: return []
+    return list(valuations_collection.find({"user_id": user_id}, {"_id": 0, "ts": 1, "nw": 1, "inv": 1}).sort("ts", -1).limit(limit))
+
+# ==========================================
+# MEDIA REGISTRY (Telegram file_id cache)
+# ==========================================
+
+def get_media_file_id(key):
+    if media_collection is None: return None
+    doc = media_collection.find_one({"key": key}, {"_id": 0, "file_id": 1})
+    return doc["file_id"] if doc else None
+
+def save_media_file_id(key, file_id):
+    if media_collection is not None:
+        media_collection.update_one({"key": key}, {"$set": {"file_id": file_id, "timestamp": time.time()}}, upsert=True)
+
+def delete_media_file_id(key):
+    if media_collection is not None:
+        media_collection.delete_one({"key": key})
+
+# ==========================================
+# DRAW ARCHIVE (backtest.py)
+# ==========================================
+
+def archive_draws(platform, game_type, history):
+    """Stores API history items ({'p', 'r', 'o'}); already-archived periods are left as-is."""
+    if draws_collection is None or not history: return
+    ops = [
+        UpdateOne({"platform": platform, "game_type": game_type, "p": str(h["p"])}, {"$setOnInsert": {"r": int(h["r"])}}, upsert=True)
+        for h in history if "r" in h
+    ]
+    if ops: draws_collection.bulk_write(ops, ordered=False)
+
+def iter_draws(platform, game_type):
+    """Yields (period, number) in period order."""
+    if draws_collection is None: return
+    cursor = draws_collection.find({"platform": platform, "game_type": game_type}, {"_id": 0, "p": 1, "r": 1}).sort("p", 1)
+    for d in cursor.batch_size(5000):
+        yield d["p"], d["r"]
+
+# ==========================================
+# ENGINE MODELS (markov_engine.py)
+# ==========================================
+
+def load_engine_model(key):
+    if models_collection is None: return None
+    return models_collection.find_one({"_id": key})
+
+def save_engine_model(key, doc):
+    if models_collection is None: return
+    models_collection.replace_one({"_id": key}, {**doc, "updated_at": time.time()}, upsert=True)
+
+# ==========================================
+# GAME SESSIONS (target / sureshot)
+# ==========================================
+# One document per session: {session_id, user_id, kind, state, version, ...}.
+# A step is ONE guarded find_one_and_update on (session_id, version, active):
+# the caller computes it from the copy it last saw, and if another tap got
+# there first the guard fails and nothing is applied. A partial unique index
+# keeps one active session per (user_id, kind). Sessions that still live in
+# the old users.<kind>_session field are moved over once at startup
+# (migrate_legacy_sessions).
+SESSION_ACTIVE = "active"
+SESSION_KINDS = ("target", "sureshot")
+
+def start_session(user_id, kind, fields):
+    """Closes any active session of this kind and opens a new one (returned)."""
+    if sessions_collection is None: return None
+    now = time.time()
+    sessions_collection.update_many(
+        {"user_id": user_id, "kind": kind, "state": SESSION_ACTIVE},
+        {"$set": {"state": "abandoned", "updated_at": now}, "$inc": {"version": 1}}
+    )
+    return _open_session(user_id, kind, fields)
+
+def _open_session(user_id, kind, fields):
+    """Inserts an active session; if one is already active (a racing start) that one is returned."""
+    now = time.time()
+    session = {
+        **fields, "session_id": uuid.uuid4().hex[:12], "user_id": user_id, "kind": kind,
+        "state": SESSION_ACTIVE, "version": 0, "created_at": now, "updated_at": now
+    }
+    try:
+        sessions_collection.insert_one(session)
+    except DuplicateKeyError:
+        return get_active_session(user_id, kind)
+    session.pop("_id", None)
+    return session
+
+def get_active_session(user_id, kind):
+    if sessions_collection is None: return None
+    return sessions_collection.find_one({"user_id": user_id, "kind": kind, "state": SESSION_ACTIVE}, {"_id": 0})
+
+def migrate_legacy_sessions():
+    """Moves active sessions still stored in users.<kind>_session into the sessions collection. Returns how many moved."""
+    if users_collection is None or sessions_collection is None: return 0
+    moved = 0
+    for kind in SESSION_KINDS:
+        field = f"{kind}_session"
+        for u in users_collection.find({field: {"$type": "object"}}, {"_id": 0, "user_id": 1}):
+            # Claim the old blob atomically so two instances cannot both migrate it
+            user = users_collection.find_one_and_update(
+                {"user_id": u["user_id"], field: {"$type": "object"}}, {"$unset": {field: ""}}, projection={field: 1}
+            )
+            legacy = (user or {}).get(field)
+            if not legacy or legacy.get("is_active") is False: continue
+            legacy.pop("is_active", None)
+            # Never replaces a session started since: _open_session keeps the active one
+            _open_session(u["user_id"], kind, legacy)
+            moved += 1
+    return moved
+
+def advance_session(session, set_fields=None, inc=None, push=None, state=None):
+    """
+    Applies one step to `session` (the copy last seen) if nobody changed it since.
+    Returns the updated session, or None if the guard failed (stale copy / ended).
+    """
+    if sessions_collection is None: return None
+    update = {
+        "$set": {**(set_fields or {}), "updated_at": time.time(), **({"state": state} if state else {})},
+        "$inc": {**(inc or {}), "version": 1},
+    }
+    if push: update["$push"] = push
+    return sessions_collection.find_one_and_update(
+        {"session_id": session["session_id"], "version": session["version"], "state": SESSION_ACTIVE},
+        update, projection={"_id": 0}, return_document=ReturnDocument.AFTER
+    )
+
 init_tokens()
\ No newline at end of file
@@ -0,0 +1,108 @@
+from array import array
+from config import DRAW_BUFFER_SIZE
+
+# --- COMPACT DRAW HISTORY (one ring per feed) ---
+# Draw i of a feed lives in slot period % capacity: period in array('q'),
+# number in array('B') and Big/Small as one bit. About 9 bytes per draw
+# instead of a dict of three objects, and finding a period is one modulo
+# plus one compare instead of scanning a list.
+BIG, SMALL = "Big", "Small"
+EMPTY = -1
+
+class DrawBuffer:
+    __slots__ = ("capacity", "head", "_periods", "_numbers", "_bits")
+
+    def __init__(self, capacity=DRAW_BUFFER_SIZE):
+        self.capacity = capacity
+        self.head = None                       # newest period stored
+        self._periods = array("q", [EMPTY]) * capacity
+        self._numbers = array("B", bytes(capacity))
+        self._bits = bytearray((capacity + 7) // 8)
+
+    def add(self, period, number):
+        p = int(period)
+        if self.head is not None:
+            if self.head - p >= self.capacity: return  # older than the whole ring
+            # Slots of periods skipped since the head no longer hold valid draws
+            for q in range(self.head + 1, min(p, self.head + 1 + self.capacity)):
+                self._periods[q % self.capacity] = EMPTY
+        slot = p % self.capacity
+        self._periods[slot] = p
+        self._numbers[slot] = number
+        if number > 4: self._bits[slot >> 3] |= 1 << (slot & 7)
+        else: self._bits[slot >> 3] &= ~(1 << (slot & 7)) & 0xFF
+        if self.head is None or p > self.head: self.head = p
+
+    def extend(self, history):
+        """Stores API history items ({'p', 'r', ...}); known periods are overwritten in place."""
+        for h in history:
+            try: self.add(h['p'], int(h['r']))
+            except (KeyError, TypeError, ValueError): continue
+
+    # --- O(1) LOOKUPS ---
+    def _slot(self, period):
+        try: p = int(period)
+        except (TypeError, ValueError): return None
+        if self.head is None or p > self.head or self.head - p >= self.capacity: return None
+        slot = p % self.capacity
+        return slot if self._periods[slot] == p else None
+
+    def number(self, period):
+        slot = self._slot(period)
+        return None if slot is None else self._numbers[slot]
+
+    def outcome(self, period):
+        slot = self._slot(period)
+        if slot is None: return None
+        return BIG if self._bits[slot >> 3] >> (slot & 7) & 1 else SMALL
+
+    def view(self, count):
+        """The last `count` periods (newest last), without copying."""
+        if self.head is None: return DrawView(self, 0, 0)
+        count = min(count, self.capacity)
+        return DrawView(self, self.head - count + 1, count)
+
+class DrawView:
+    """
+    A window of consecutive periods over a DrawBuffer. Slicing returns another
+    view; iterating yields only the draws present (missed periods are skipped).
+    """
+    __slots__ = ("buffer", "start", "count")
+
+    def __init__(self, buffer, start, count):
+        self.buffer, self.start, self.count = buffer, start, count
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice): raise TypeError("DrawView supports slicing only")
+        first, stop, step = index.indices(self.count)
+        if step != 1: raise ValueError("DrawView slices must be contiguous")
+        return DrawView(self.buffer, self.start + first, max(0, stop - first))
+
+    def _slots(self):
+        b = self.buffer
+        for p in range(self.start, self.start + self.count):
+            slot = p % b.capacity
+            if b._periods[slot] == p: yield p, slot
+
+    def __iter__(self):
+        """(period, number, outcome) per stored draw, oldest first."""
+        b = self.buffer
+        for p, slot in self._slots():
+            yield p, b._numbers[slot], BIG if b._bits[slot >> 3] >> (slot & 7) & 1 else SMALL
+
+    def outcomes(self):
+        b = self.buffer
+        for _, slot in self._slots():
+            yield BIG if b._bits[slot >> 3] >> (slot & 7) & 1 else SMALL
+
+    def as_history(self):
+        """The API's list-of-dicts shape, for code that still expects it."""
+        return [{'p': str(p), 'r': r, 'o': o} for p, r, o in self]
+
+_buffers = {}
+
+def feed_buffer(platform, game_type):
+    buf = _buffers.get((platform, game_type))
+    if buf is None:
+        buf = _buffers[(platform, game_type)] = DrawBuffer()
+    return buf
@@ -0,0 +1,114 @@
+import time
+from config import ENGINE_LATENCY_BUCKETS, DEFAULT_ENGINE
+from database import get_user_data, update_user_fields
+from prediction_engine import (
+    get_v5_logic, generate_v1_prediction, generate_v2_prediction, generate_v3_prediction,
+    generate_v4_prediction, generate_v6_prediction
+)
+
+# --- PREDICTION ENGINE REGISTRY ---
+# Every engine declares what it reads and who its answer belongs to:
+#   history   draws of history it needs (None = all the API returned, 0 = none)
+#   user      needs the user's state (current prediction / level / last outcome)
+#   period    needs the upcoming period number
+#   scope     "period": same answer for every user of a feed in a period, so it
+#             is computed once and shared; "user": computed per request
+# Dispatch is one dict lookup; each engine counts its calls, shared answers and
+# a latency histogram (ENGINE_LATENCY_BUCKETS, seconds; the last bucket is "more").
+
+class Engine:
+    __slots__ = ("key", "label", "func", "history", "user", "period", "scope", "calls", "shared", "total_time", "buckets")
+
+    def __init__(self, key, label, func, history=None, user=False, period=False, scope="user"):
+        self.key, self.label, self.func = key, label, func
+        self.history, self.user, self.period, self.scope = history, user, period, scope
+        self.calls = self.shared = 0
+        self.total_time = 0.0
+        self.buckets = [0] * (len(ENGINE_LATENCY_BUCKETS) + 1)
+
+    def record(self, seconds):
+        self.calls += 1
+        self.total_time += seconds
+        for i, limit in enumerate(ENGINE_LATENCY_BUCKETS):
+            if seconds <= limit:
+                self.buckets[i] += 1
+                return
+        self.buckets[-1] += 1
+
+# Engine functions take one request dict:
+# {"period", "game_type", "platform", "history", "state", "outcome"}
+def _v1(r): return generate_v1_prediction(r["history"], None, None, feed=(r["platform"], r["game_type"]))
+def _v2(r): return generate_v2_prediction(None, r["state"].get("current_prediction", "Small"), r["outcome"], r["state"].get("current_level", 1))
+def _v3(r): return generate_v3_prediction()
+def _v4(r):
+    s = r["state"]
+    return generate_v4_prediction([x['o'] for x in r["history"]], s.get("current_prediction", "Small"), r["outcome"], s.get("current_level", 1))
+def _v5(r):
+    pred, pattern, _ = get_v5_logic(r["period"], r["game_type"], r["history"], platform=r["platform"])
+    return pred, pattern
+def _v6(r): return generate_v6_prediction(r["history"], r["platform"], r["game_type"])
+
+ENGINES = {e.key: e for e in (
+    Engine("V1", "Pattern Matcher", _v1, history=None, scope="period"),
+    Engine("V2", "Streak/Switch (Balanced)", _v2, history=0, user=True),
+    Engine("V3", "Random AI (Unpredictable)", _v3, history=0),
+    Engine("V4", "Trend Follower (Safe)", _v4, history=3, user=True),
+    Engine("V5", "Argon2i Hash (Safe)", _v5, history=None, period=True, scope="period"),
+    Engine("V6", "Markov Model (Adaptive)", _v6, history=None, scope="period"),
+)}
+
+_shared = {}   # (engine, platform, game_type) -> (period, (pred, name))
+
+def next_period(history):
+    """The period after the newest draw in an API history, or None."""
+    try: return str(int(history[-1]['p']) + 1)
+    except (IndexError, KeyError, TypeError, ValueError): return None
+
+def run_engine(mode, period=None, game_type="30s", platform="Tiranga", history=None, user_data=None, outcome=None):
+    """(prediction, pattern name) from the engine `mode` (unknown modes use DEFAULT_ENGINE)."""
+    engine = ENGINES.get(mode) or ENGINES[DEFAULT_ENGINE]
+    history = history or []
+    if period is None: period = next_period(history)
+
+    key = (engine.key, platform, game_type)
+    if engine.scope == "period" and period is not None:
+        hit = _shared.get(key)
+        if hit and hit[0] == period:
+            engine.shared += 1
+            return hit[1]
+
+    request = {
+        "period": period, "game_type": game_type, "platform": platform,
+        "history": history if engine.history is None else (history[-engine.history:] if engine.history else []),
+        "state": (user_data or {}) if engine.user else None,
+        "outcome": outcome,
+    }
+    start = time.perf_counter()
+    result = engine.func(request)
+    engine.record(time.perf_counter() - start)
+
+    if engine.scope == "period" and period is not None:
+        _shared[key] = (period, result)
+    return result
+
+def process_prediction_request(user_id, outcome, api_history=[], period=None, game_type="30s", platform="Tiranga"):
+    """
+    Decides which engine to use based on user settings and stores the pick.
+    Without an explicit period the one after the newest draw is used.
+    """
+    state = get_user_data(user_id)
+    mode = state.get("prediction_mode", DEFAULT_ENGINE)
+    new_pred, p_name = run_engine(mode, period, game_type, platform, api_history, state, outcome)
+    update_user_fields(user_id, {"current_prediction": new_pred, "current_pattern_name": p_name})
+    return new_pred, p_name
+
+def engine_stats():
+    """Per engine: calls, shared answers, mean latency (ms) and histogram counts."""
+    return {
+        key: {
+            "calls": e.calls, "shared": e.shared,
+            "mean_ms": (e.total_time / e.calls * 1000) if e.calls else 0.0,
+            "buckets": list(e.buckets),
+        }
+        for key, e in ENGINES.items()
+    }
@@ -1,18 +1,41 @@
+import io
+import math
+import time
 import asyncio
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from config import ADMIN_ID, ADMIN_BROADCAST_MSG, ADMIN_GIFT_WAIT
+from telegram.helpers import escape_markdown
+from config import ADMIN_ID, ADMIN_BROADCAST_MSG, ADMIN_GIFT_WAIT, QUEUE_PAGE_SIZE, ENGINE_LATENCY_BUCKETS
 from database import (
     get_total_users, 
     get_active_subs_count, 
-    get_all_user_ids, 
     get_top_referrers,
     set_maintenance_mode,
     get_settings, 
     update_user_field, 
-    create_gift_code
+    create_gift_code,
+    create_broadcast,
+    get_broadcast,
+    update_broadcast,
+    count_audience,
+    get_pending_page,
+    count_pending,
+    settle_queue_bulk,
+    get_custom_patterns,
+    save_custom_pattern,
+    delete_custom_pattern
 )
+from reconciliation import run_reconciliation, send_notifications, format_report
+from handlers_shop import access_fields, access_message
+from portfolio_engine import apply_cash
+from bulk_sender import send_bulk
+from message_state import stats as edit_stats
+from broadcast_engine import start_broadcast, stop_broadcast, format_progress, progress_markup, parse_variants
+from segments import SEGMENTS, compile_audience, describe
+from pattern_automaton import parse_pattern
+from prediction_engine import builtin_patterns, reload_patterns, get_pattern_automaton
+from engine_registry import engine_stats
 
 # Setup Logger
 logger = logging.getLogger(__name__)
@@ -48,6 +71,7 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("🛠 Maintenance", callback_data="adm_maint_toggle"), InlineKeyboardButton("🎁 Gen Code", callback_data="adm_gift_menu")],
         [InlineKeyboardButton("📢 Broadcast", callback_data="adm_broadcast"), InlineKeyboardButton("📊 Ref Stats", callback_data="adm_ref_stats")],
         [InlineKeyboardButton("🚫 Ban", callback_data="adm_ban_help"), InlineKeyboardButton("✅ Unban", callback_data="adm_unban_help")],
+        [InlineKeyboardButton("📥 Pending Queue", callback_data="adq_tab_dep")],
         [InlineKeyboardButton("❌ Cancel", callback_data="adm_close")]
     ])
 
@@ -118,12 +142,28 @@ async def admin_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="adm_back")]])
         )
 
-    # --- 4. BROADCAST ---
+    # --- 4. BROADCAST (pick segments, then type the message) ---
     elif data == "adm_broadcast":
+        context.user_data["bc_segments"] = []
+        await _render_segment_picker(query, context)
+        
+    elif data.startswith("adm_seg_t_"):
+        key = data[len("adm_seg_t_"):]
+        keys = context.user_data.setdefault("bc_segments", [])
+        if key in keys: keys.remove(key)
+        elif key in SEGMENTS: keys.append(key)
+        await _render_segment_picker(query, context)
+        
+    elif data == "adm_seg_go":
+        keys = context.user_data.get("bc_segments", [])
+        context.user_data["bc_ref_time"] = int(time.time())
         await query.edit_message_text(
-            "📢 **BROADCAST MODE**\n\n"
-            "Reply with the message to send to ALL users.\n"
-            "Type /cancel to stop."
+            f"📢 **BROADCAST MODE**\n\n"
+            f"🎯 Audience: {describe(keys)}\n\n"
+            f"Reply with the message to send.\n"
+            f"Optional per-language versions: put a line `[HI]` (or `[EN]`) before each translation.\n"
+            f"Type /cancel to stop.",
+            parse_mode="Markdown"
         )
         return ADMIN_BROADCAST_MSG
         
@@ -161,25 +201,267 @@ async def admin_send_broadcast(update: Update, context: ContextTypes.DEFAULT_TYP
     if update.effective_user.id != ADMIN_ID: return ConversationHandler.END
     
     msg_text = update.message.text
-    final_msg = f"📢 **ANNOUNCEMENT**\n━━━━━━━━━━━━━━\n{msg_text}"
-    
-    status = await update.message.reply_text("⏳ **Sending...**")
-    count, blocked = 0, 0
+    variants = {lang: f"📢 **ANNOUNCEMENT**\n━━━━━━━━━━━━━━\n{body}" for lang, body in parse_variants(msg_text).items()}
+    keys = context.user_data.pop("bc_segments", [])
+    ref_time = context.user_data.pop("bc_ref_time", None)
     
-    for user in get_all_user_ids():
-        try:
-            await context.bot.send_message(user['user_id'], final_msg, parse_mode="Markdown")
-            count += 1
-            await asyncio.sleep(0.05)
-        except: blocked += 1
-            
-    await status.edit_text(f"✅ **Sent:** {count}  ❌ **Blocked:** {blocked}")
+    # Runs in the background (rate-limited, resumable); this message shows live progress
+    b = create_broadcast(variants, update.effective_user.id, update.effective_chat.id,
+                         segments=keys, audience=compile_audience(keys, ref_time), ref_time=ref_time)
+    if not b:
+        await update.message.reply_text("❌ **Database unavailable.**")
+        return ConversationHandler.END
+    status = await update.message.reply_text(format_progress(b), reply_markup=progress_markup(b), parse_mode="Markdown")
+    b["progress_message_id"] = status.message_id
+    update_broadcast(b["broadcast_id"], {"progress_message_id": status.message_id})
+    start_broadcast(context.application, b)
     return ConversationHandler.END
 
+async def _render_segment_picker(query, context):
+    """Segment toggles with live audience counts (count_documents on indexed fields)."""
+    keys = context.user_data.get("bc_segments", [])
+    counts = await asyncio.to_thread(lambda: {k: count_audience(compile_audience([k])) for k in SEGMENTS})
+    total = await asyncio.to_thread(count_audience, compile_audience(keys))
+    
+    rows, row = [], []
+    for k, (label, _) in SEGMENTS.items():
+        row.append(InlineKeyboardButton(f"{'✅ ' if k in keys else ''}{label} ({counts[k]})", callback_data=f"adm_seg_t_{k}"))
+        if len(row) == 2:
+            rows.append(row)
+            row = []
+    if row: rows.append(row)
+    rows.append([InlineKeyboardButton(f"➡️ Continue ({total} users)", callback_data="adm_seg_go")])
+    rows.append([InlineKeyboardButton("⬅️ Back", callback_data="adm_back")])
+    
+    await query.edit_message_text(
+        f"📢 **BROADCAST — SELECT AUDIENCE**\n━━━━━━━━━━━━━━\n"
+        f"🎯 {describe(keys)}\n👥 Recipients: `{total}`\n\n"
+        f"_Selected segments are combined (AND). None = all users._",
+        reply_markup=InlineKeyboardMarkup(rows), parse_mode="Markdown"
+    )
+
+async def patterns_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    V1 pattern set. /patterns lists it, /patterns add BBSS>B [weight] [name]
+    adds (or replaces) one, /patterns del BBSS removes one.
+    """
+    if update.effective_user.id != ADMIN_ID: return
+    args = context.args
+    if args and args[0] in ("add", "del") and len(args) >= 2:
+        parsed = parse_pattern(args[1])
+        if not parsed:
+            await update.message.reply_text("❌ Pattern must be B/S letters, optionally `>B` / `>S` (e.g. `BBSS>B`).", parse_mode="Markdown")
+            return
+        seq, nxt = parsed
+        if args[0] == "add":
+            try: weight = float(args[2]) if len(args) > 2 else 1.0
+            except ValueError: weight = None
+            if weight is None or not math.isfinite(weight) or weight <= 0:
+                await update.message.reply_text("❌ Weight must be a positive number (e.g. `2`).", parse_mode="Markdown")
+                return
+            save_custom_pattern(seq, nxt, weight, " ".join(args[3:]) or None)
+            reload_patterns()
+            await update.message.reply_text(f"✅ Pattern `{seq}` ➡️ {nxt} (weight {weight:g}) saved.", parse_mode="Markdown")
+        else:
+            ok = delete_custom_pattern(seq)
+            reload_patterns()
+            await update.message.reply_text(f"🗑 Pattern `{seq}` removed." if ok else "❌ No such custom pattern.", parse_mode="Markdown")
+        return
+
+    custom = get_custom_patterns()
+    ac = get_pattern_automaton()
+    msg = f"🧩 **V1 PATTERNS** ({ac.size} compiled, {len(ac.trans)} states)\n━━━━━━━━━━━━━━\n"
+    msg += "**Built-in:** " + ", ".join(f"`{seq}`" for seq, _, _, _ in builtin_patterns()) + "\n"
+    msg += "**Custom:**\n" + ("".join(f"• `{p['seq']}` ➡️ {p['next']} ×{p.get('weight', 1.0):g} {escape_markdown(p.get('name') or '')}\n" for p in custom) or "None\n")
+    msg += "\nUsage: `/patterns add BBSS>B 2 name` · `/patterns del BBSS`"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def engines_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Prediction engine metrics: calls, shared per-period answers, latency histogram."""
+    if update.effective_user.id != ADMIN_ID: return
+    limits = [f"≤{t * 1000:g}ms" for t in ENGINE_LATENCY_BUCKETS] + ["more"]
+    msg = "⚙️ **ENGINES**\n━━━━━━━━━━━━━━\n"
+    for key, s in engine_stats().items():
+        msg += f"`{key}` 📞 {s['calls']}  🔗 {s['shared']}  ~{s['mean_ms']:.2f}ms\n"
+        if s['calls']:
+            msg += "   " + "  ".join(f"{l}: {n}" for l, n in zip(limits, s['buckets']) if n) + "\n"
+    msg += "━━━━━━━━━━━━━━\n📞 computed · 🔗 served from the per-period share"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def outbox_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Outbound scheduler metrics: queue depth per priority class, throughput, 429s."""
+    if update.effective_user.id != ADMIN_ID: return
+    limiter = context.bot.rate_limiter
+    if limiter is None or not hasattr(limiter, "snapshot"):
+        await update.message.reply_text("ℹ️ No outbound scheduler configured.")
+        return
+    snap = limiter.snapshot()
+    msg = "📮 **OUTBOUND QUEUE**\n━━━━━━━━━━━━━━\n"
+    for name, s in snap["classes"].items():
+        msg += f"`{name:<13}` ⏳ {s['queued']:>4}  ✅ {s['sent']:>6}  🔁 {s['retries']}  ~{s['wait_ms']:.0f}ms\n"
+    msg += (
+        f"━━━━━━━━━━━━━━\n"
+        f"🌐 Waiting for global token: `{snap['waiting']}`\n"
+        f"🧊 Flood hold: `{snap['held_for']:.1f}s`  (429s so far: `{snap['flood_waits']}`)\n"
+        f"💬 Chats tracked: `{snap['chats_tracked']}`\n"
+        f"✏️ Edits: `{edit_stats['edits']}`  skipped: `{edit_stats['skipped']}`  coalesced: `{edit_stats['coalesced']}`"
+    )
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def broadcast_stop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if q.from_user.id != ADMIN_ID:
+        await q.answer("🚫 Access Denied.", show_alert=True)
+        return
+    bid = q.data[len("bc_stop_"):]
+    if stop_broadcast(bid):
+        await q.answer("⏹ Stopping after the current batch...")
+        return
+    # Not running in this process (e.g. left "running" by a crash before resume)
+    b = get_broadcast(bid)
+    if b and b["status"] == "running": update_broadcast(bid, {"status": "stopped"})
+    await q.answer("⏹ Stopped.", show_alert=True)
+
 async def cancel_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("❌ Cancelled.")
     return ConversationHandler.END
 
+# --- PAYMENT RECONCILIATION ---
+async def reconcile_statement_upload(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Admin sends a bank/UPI statement CSV -> pending deposits & purchases are matched by UTR + amount."""
+    if update.effective_user.id != ADMIN_ID: return
+    
+    status = await update.message.reply_text("⏳ **Reconciling statement...**", parse_mode="Markdown")
+    try:
+        tg_file = await update.message.document.get_file()
+        data = await tg_file.download_as_bytearray()
+        lines = io.TextIOWrapper(io.BytesIO(data), encoding="utf-8-sig", errors="replace", newline="")
+        report = await asyncio.to_thread(run_reconciliation, lines)
+    except Exception as e:
+        logger.error(f"Reconciliation failed: {e}")
+        await status.edit_text(f"❌ **Reconciliation failed:** `{e}`", parse_mode="Markdown")
+        return
+    
+    # The portfolio cache is only touched from the event loop
+    for uid, amount in report["cash"]: apply_cash(uid, amount)
+    sent = await send_notifications(context.bot, report["messages"])
+    await status.edit_text(format_report(report, sent), parse_mode="Markdown")
+
+# --- PENDING APPROVAL QUEUE ---
+# Callback data: adq_tab_<kind> | adq_next | adq_prev | adq_t_<id> (toggle) |
+#                adq_<ok|no>_<sel|page> | adq_close
+QUEUE_TABS = {"dep": "📥 Deposits", "wd": "📤 Withdrawals", "shop": "🛍 Purchases"}
+
+def _queue_item_id(kind, doc):
+    return doc["purchase_id"] if kind == "shop" else doc["tx_id"]
+
+def _queue_item_label(kind, doc):
+    if kind == "shop": return f"₹{doc['amount']:g} · {doc['item']} · {doc['user_id']}"
+    if kind == "dep": return f"₹{doc['amount']:g} · {doc['user_id']} · {doc.get('utr') or doc.get('details', '')}"
+    return f"₹{doc['amount']:g} · {doc['user_id']} · {doc.get('method', '')}"
+
+def _queue_notification(kind, approve, doc):
+    """Same texts as the one-by-one approval handlers."""
+    amt = doc["amount"]
+    if kind == "dep":
+        return (f"✅ **Deposit Approved!**\nAdded: ₹{amt}", None) if approve else (f"❌ **Deposit Rejected.**\nAmount: ₹{amt}", None)
+    if kind == "wd":
+        return (f"✅ **Withdrawal Sent!**\nAmount: ₹{amt}", None) if approve else (f"❌ **Withdrawal Rejected.**\nRefunded: ₹{amt}", None)
+    if approve: return access_message(doc["item"])
+    return "❌ **Payment Rejected.**\nInvalid Transaction ID or Payment not received.", None
+
+async def _render_queue(q, context, note=""):
+    st = context.user_data["adq"]
+    kind = st["kind"]
+    # Keyset pagination: the page starts after the last _id of the previous page
+    after = st["cursors"][-1] if st["cursors"] else None
+    page = await asyncio.to_thread(get_pending_page, kind, after, QUEUE_PAGE_SIZE + 1)
+    has_next = len(page) > QUEUE_PAGE_SIZE
+    page = page[:QUEUE_PAGE_SIZE]
+    st["page"] = {_queue_item_id(kind, d): d for d in page}
+    st["last_id"] = str(page[-1]["_id"]) if page else None
+    st["selected"] &= set(st["page"])
+    total = await asyncio.to_thread(count_pending, kind)
+
+    kb = [[InlineKeyboardButton(("• " if k == kind else "") + label, callback_data=f"adq_tab_{k}") for k, label in QUEUE_TABS.items()]]
+    for item_id, d in st["page"].items():
+        mark = "☑️" if item_id in st["selected"] else "⬜"
+        kb.append([InlineKeyboardButton(f"{mark} {_queue_item_label(kind, d)}"[:60], callback_data=f"adq_t_{item_id}")])
+    nav = []
+    if st["cursors"]: nav.append(InlineKeyboardButton("⬅️ Prev", callback_data="adq_prev"))
+    if has_next: nav.append(InlineKeyboardButton("Next ➡️", callback_data="adq_next"))
+    if nav: kb.append(nav)
+    if page:
+        n = len(st["selected"])
+        kb.append([InlineKeyboardButton(f"✅ Approve ({n})", callback_data="adq_ok_sel"), InlineKeyboardButton(f"❌ Reject ({n})", callback_data="adq_no_sel")])
+        kb.append([InlineKeyboardButton("✅ Approve Page", callback_data="adq_ok_page"), InlineKeyboardButton("❌ Reject Page", callback_data="adq_no_page")])
+    kb.append([InlineKeyboardButton("🔙 Back", callback_data="adm_back")])
+
+    msg = (
+        f"📋 **PENDING QUEUE — {QUEUE_TABS[kind]}**\n━━━━━━━━━━━━━━\n"
+        f"⏳ Pending: `{total}`  📄 Page: `{len(st['cursors']) + 1}`\n"
+        f"{'Nothing pending.' if not page else 'Tap items to select, or act on the whole page.'}\n"
+    )
+    if note: msg += f"\n{note}"
+    await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+
+async def admin_queue_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    if q.from_user.id != ADMIN_ID:
+        await q.answer("🚫 Access Denied.", show_alert=True)
+        return
+    data = q.data
+    st = context.user_data.get("adq")
+
+    if data.startswith("adq_tab_") or st is None:
+        kind = data[len("adq_tab_"):] if data.startswith("adq_tab_") else "dep"
+        st = context.user_data["adq"] = {"kind": kind, "cursors": [], "selected": set(), "page": {}}
+        await q.answer()
+        return await _render_queue(q, context)
+
+    if data == "adq_next":
+        if st["last_id"]: st["cursors"].append(st["last_id"])
+        st["selected"].clear()
+        await q.answer()
+        return await _render_queue(q, context)
+    if data == "adq_prev":
+        if st["cursors"]: st["cursors"].pop()
+        st["selected"].clear()
+        await q.answer()
+        return await _render_queue(q, context)
+    if data.startswith("adq_t_"):
+        item_id = data[len("adq_t_"):]
+        st["selected"] ^= {item_id}
+        await q.answer()
+        return await _render_queue(q, context)
+
+    # adq_<ok|no>_<sel|page>
+    _, decision, scope = data.split("_")
+    ids = list(st["page"]) if scope == "page" else list(st["selected"])
+    if not ids:
+        await q.answer("Select items first.", show_alert=True)
+        return
+    await q.answer("⏳ Processing...")
+    approve = decision == "ok"
+    kind = st["kind"]
+    
+    settled = await asyncio.to_thread(settle_queue_bulk, kind, ids, approve, access_fields)
+    for d in settled:
+        if (kind == "dep" and approve) or (kind == "wd" and not approve): apply_cash(d["user_id"], d["amount"])
+    st["selected"].clear()
+    verb = "Approved" if approve else "Rejected"
+    await _render_queue(q, context, f"{'✅' if approve else '❌'} {verb} {len(settled)}/{len(ids)} ({len(ids) - len(settled)} already processed)")
+
+    messages = [(d["user_id"], *_queue_notification(kind, approve, d)) for d in settled]
+    sent, failed = await send_bulk(context.bot, messages)
+    logger.info(f"Queue {kind} {verb.lower()} {len(settled)}: notified {sent}, failed {failed}")
+
+async def pending_queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    counts = {k: count_pending(k) for k in QUEUE_TABS}
+    kb = InlineKeyboardMarkup([[InlineKeyboardButton(f"{label} ({counts[k]})", callback_data=f"adq_tab_{k}")] for k, label in QUEUE_TABS.items()])
+    await update.message.reply_text("📋 **PENDING QUEUE**\nSelect a list:", reply_markup=kb, parse_mode="Markdown")
+
 # Legacy handlers to prevent import errors in main.py
 async def gift_generation(update: Update, context: ContextTypes.DEFAULT_TYPE):
     return ConversationHandler.END 
@@ -1,10 +1,13 @@
 import asyncio
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from database import get_user_data, update_user_field, increment_user_field, is_subscription_active
+from database import get_user_data, update_user_field, update_user_fields, increment_user_field, is_subscription_active
 from api_helper import get_game_data
-from prediction_engine import get_v5_logic, get_bet_unit
-from config import SELECTING_PLATFORM, SELECTING_GAME_TYPE, WAITING_FOR_FEEDBACK, MAX_LEVEL, LANGUAGES
+from prediction_engine import get_bet_unit, get_number_for_outcome
+from engine_registry import run_engine
+from message_state import edit_if_changed
+from draw_buffer import feed_buffer
+from config import SELECTING_PLATFORM, SELECTING_GAME_TYPE, WAITING_FOR_FEEDBACK, MAX_LEVEL, LANGUAGES, DEFAULT_ENGINE
 
 # --- HELPERS ---
 
@@ -112,7 +115,7 @@ async def show_prediction(update: Update, context: ContextTypes.DEFAULT_TYPE):
     Visually Rich Prediction Screen.
     """
     if update.callback_query:
-        msg_func = update.callback_query.edit_message_text
+        msg_func = lambda text, **kw: edit_if_changed(update.callback_query, text, **kw)
         uid = update.callback_query.from_user.id
     else:
         msg_func = update.message.reply_text
@@ -130,21 +133,20 @@ async def show_prediction(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg_func(f"⚠️ **API Error ({platform}).**\nCould not fetch latest period.", reply_markup=kb)
         return ConversationHandler.END
 
-    # 2. V5+ Logic (Pass Platform for Salt)
-    pred, pat, v5d = get_v5_logic(period, gtype, hist, platform=platform)
+    # 2. User's Engine (V5+ by default; per-period engines are shared across users)
+    pred, pat = run_engine(ud.get("prediction_mode", DEFAULT_ENGINE), period, gtype, platform, hist, ud,
+                           outcome=context.user_data.pop("last_outcome", None))
     
     # 3. Save State (CRITICAL FOR ANTI-CHEAT)
-    update_user_field(uid, "current_prediction", pred)
-    update_user_field(uid, "current_period", period)
+    update_user_fields(uid, {"current_prediction": pred, "current_period": period, "current_pattern_name": pat})
     
     # 4. Generate Visuals
     
     # A. Trend Strip (Last 6 results)
     trend_viz = ""
     if hist:
-        recent = hist[-6:] 
-        for h in recent:
-            trend_viz += "🔴" if h['o'] == "Big" else "🟢"
+        for o in feed_buffer(platform, gtype).view(6).outcomes():
+            trend_viz += "🔴" if o == "Big" else "🟢"
     else: trend_viz = "Scanning..."
 
     # B. Betting Info
@@ -156,6 +158,9 @@ async def show_prediction(update: Update, context: ContextTypes.DEFAULT_TYPE):
     risk_pct = lvl / MAX_LEVEL
     risk_bar = draw_bar(risk_pct, length=8, style="risk")
 
+    # D. Exact Number (Number Shot owners)
+    number_line = f"🎯 **Number:** {get_number_for_outcome(pred, platform, gtype)}\n" if ud.get("has_number_shot") else ""
+
     # 5. Build Message
     msg = (
         f"🎮 **{platform.upper()} {gtype}**\n"
@@ -164,6 +169,7 @@ async def show_prediction(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📊 **Trend:** {trend_viz}\n"
         f"━━━━━━━━━━━━━━\n"
         f"🔮 **PICK:** {color} **{pred.upper()}**\n"
+        f"{number_line}"
         f"🧠 **Logic:** `{pat}`\n"
         f"💰 **Bet:** Level {lvl} (x{bet_amount})\n"
         f"🔥 **Risk:**\n{risk_bar}\n"
@@ -196,20 +202,19 @@ async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     gtype = context.user_data.get("game_type", "30s")
     platform = context.user_data.get("platform", "Tiranga")
 
-    # Fetch History to verify result exists
-    _, history = get_game_data(gtype, platform=platform)
+    # Fetch History to verify result exists (refreshes the feed's draw buffer)
+    get_game_data(gtype, platform=platform)
     
-    # Find the period we just bet on
-    result_item = next((item for item in history if str(item['p']) == str(bet_period)), None)
+    # Find the period we just bet on (O(1) in the feed's draw buffer)
+    real_outcome = feed_buffer(platform, gtype).outcome(bet_period)
     
     # 🚫 BLOCKING: If result not found yet
-    if not result_item:
+    if not real_outcome:
         txt = get_text(uid, "result_wait") 
         await q.answer(txt, show_alert=True)
         return WAITING_FOR_FEEDBACK 
 
     # Verify Outcome
-    real_outcome = result_item['o'] 
     is_win = (real_outcome == bet_prediction)
     
     current_lvl = ud.get("current_level", 1)
@@ -224,6 +229,7 @@ async def handle_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         status_msg = get_text(uid, "loss_msg").format(result=real_outcome)
         
     update_user_field(uid, "current_level", new_lvl)
+    context.user_data["last_outcome"] = "win" if is_win else "loss"
     
     await q.edit_message_text(f"{status_msg}\n\n🔄 **Analyzing Next Period...**")
     await asyncio.sleep(2) 
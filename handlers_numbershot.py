@@ -0,0 +1,71 @@
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+from database import get_user_data
+from api_helper import get_game_data
+from number_shot import feed_stats
+from handlers_game import draw_bar
+from message_state import edit_if_changed
+from config import NUMBER_SHOT_KEY, NUMBER_SHOT_PRICE, NUMBER_SHOT_TOP_K
+
+# --- NUMBER SHOT (owners of NUMBER_SHOT_KEY) ---
+
+async def numbershot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/numbershot and the 'ns_menu' button: game picker, or the shop link for non-owners."""
+    q = update.callback_query
+    uid = q.from_user.id if q else update.effective_user.id
+    if q: await q.answer()
+
+    if not get_user_data(uid).get("has_number_shot"):
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton(f"🛒 Buy Number Shot ({NUMBER_SHOT_PRICE})", callback_data=f"buy_{NUMBER_SHOT_KEY}")]])
+        text = "🔒 **Number Shot Locked.**\nBuy it once to get exact-number picks."
+    else:
+        kb = InlineKeyboardMarkup([
+            [InlineKeyboardButton("🎲 Tiranga 30s", callback_data="ns_go_Tiranga_30s"), InlineKeyboardButton("🎲 Tiranga 1m", callback_data="ns_go_Tiranga_1m")],
+            [InlineKeyboardButton("🎲 TrustWin 30s", callback_data="ns_go_TrustWin_30s"), InlineKeyboardButton("🎲 TrustWin 1m", callback_data="ns_go_TrustWin_1m")]
+        ])
+        text = (
+            "🎲 **NUMBER SHOT**\n"
+            "━━━━━━━━━━━━━━\n"
+            "🔢 Exact-number picks from live frequency, gap and follow-up stats.\n\n"
+            "👇 Select Game:"
+        )
+    if q: await edit_if_changed(q, text, reply_markup=kb, parse_mode="Markdown")
+    else: await update.message.reply_text(text, reply_markup=kb, parse_mode="Markdown")
+
+async def numbershot_show(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """'ns_go_<platform>_<game>': top numbers for the upcoming period."""
+    q = update.callback_query
+    if not get_user_data(q.from_user.id).get("has_number_shot"):
+        await q.answer("🔒 Number Shot not owned.", show_alert=True)
+        return
+    await q.answer("Scanning...")
+    _, _, platform, gtype = q.data.split("_", 3)
+
+    period, hist = get_game_data(gtype, platform=platform)
+    retry = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Retry", callback_data=q.data)]])
+    if not period:
+        await edit_if_changed(q, f"⚠️ **API Error ({platform}).**\nCould not fetch latest period.", reply_markup=retry, parse_mode="Markdown")
+        return
+
+    stats = feed_stats(platform, gtype)   # fed by get_game_data
+    if not stats.ready():
+        await edit_if_changed(q, f"📡 **Collecting results...**\nSeen {stats.seen} draws so far, try again shortly.", reply_markup=retry, parse_mode="Markdown")
+        return
+
+    lines = []
+    for rank, (number, prob) in enumerate(stats.top(NUMBER_SHOT_TOP_K), 1):
+        color = "🔴" if number > 4 else "🟢"
+        lines.append(f"{rank}. {color} **{number}**  {draw_bar(prob, length=8)}  _(gap {stats.gap(number)})_")
+    msg = (
+        f"🎲 **NUMBER SHOT — {platform.upper()} {gtype}**\n"
+        f"━━━━━━━━━━━━━━\n"
+        f"🕒 Period: `{period}`\n\n"
+        + "\n".join(lines) +
+        f"\n━━━━━━━━━━━━━━\n"
+        f"📊 Based on {stats.seen} draws."
+    )
+    kb = InlineKeyboardMarkup([
+        [InlineKeyboardButton("🔄 Next Period", callback_data=q.data)],
+        [InlineKeyboardButton("⬅️ Back", callback_data="ns_menu")]
+    ])
+    await edit_if_changed(q, msg, reply_markup=kb, parse_mode="Markdown")
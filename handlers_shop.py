@@ -1,10 +1,19 @@
+import re
+import time
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from database import get_user_data, update_user_field, increment_user_field, get_remaining_time_str, is_subscription_active
+from database import (
+    get_user_data, update_user_field, update_user_fields, increment_user_field, get_remaining_time_str,
+    is_subscription_active, create_purchase, resolve_purchase, get_active_session
+)
 from config import PREDICTION_PLANS, TARGET_PACKS, NUMBER_SHOT_PRICE, NUMBER_SHOT_KEY, PAYMENT_IMAGE_URL, ADMIN_ID
 from datetime import datetime
-from target_engine import start_target_session, process_target_outcome
+from target_engine import start_target_session, process_target_outcome, session_at, tap_version
+from media_registry import media_key
+from navigation import show_screen
+from outbound_scheduler import PRIORITY_ADMIN
+from message_state import edit_if_changed
 from config import SELECTING_PLAN, WAITING_FOR_PAYMENT_PROOF, WAITING_FOR_UTR, TARGET_START_MENU, TARGET_SELECT_GAME, TARGET_GAME_LOOP
 
 logger = logging.getLogger(__name__)
@@ -14,7 +23,7 @@ async def packs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = [
         [InlineKeyboardButton("💎 VIP Subscriptions (1/7 Day)", callback_data="buy_plans_list")],
         [InlineKeyboardButton("🎯 Target Strategies", callback_data="shop_target")],
-        [InlineKeyboardButton(f"🎲 Number Shot (₹{NUMBER_SHOT_PRICE})", callback_data=f"buy_{NUMBER_SHOT_KEY}")],
+        [InlineKeyboardButton(f"🎲 Number Shot ({NUMBER_SHOT_PRICE})", callback_data=f"buy_{NUMBER_SHOT_KEY}")],
         [InlineKeyboardButton("🔙 Back to Menu", callback_data="back_home")]
     ]
     msg = (
@@ -25,7 +34,7 @@ async def packs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "🎲 **Number Shot:** High-risk AI for exact number prediction.\n"
     )
     if update.callback_query: 
-        await update.callback_query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+        await show_screen(update.callback_query, msg, InlineKeyboardMarkup(kb))
     else: 
         await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
 
@@ -42,7 +51,7 @@ async def shop_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for key, pack in TARGET_PACKS.items():
             buttons.append([InlineKeyboardButton(f"{pack['name']} (₹{pack['price']})", callback_data=f"buy_{key}")])
         buttons.append([InlineKeyboardButton("🔙 Back", callback_data="shop_main")])
-        await q.edit_message_text("🎯 **CHOOSE TARGET GOAL**", reply_markup=InlineKeyboardMarkup(buttons))
+        await show_screen(q, "🎯 **CHOOSE TARGET GOAL**", InlineKeyboardMarkup(buttons), parse_mode=None)
         return SELECTING_PLAN
 
 # --- BUYING FLOW ---
@@ -93,7 +102,7 @@ async def start_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for k, p in PREDICTION_PLANS.items():
             kb.append([InlineKeyboardButton(f"{p['name']} - {p['price']}", callback_data=f"buy_{k}")])
         kb.append([InlineKeyboardButton("🔙 Back", callback_data="shop_main")])
-        await q.edit_message_text("💎 **SELECT VIP PLAN:**", reply_markup=InlineKeyboardMarkup(kb))
+        await show_screen(q, "💎 **SELECT VIP PLAN:**", InlineKeyboardMarkup(kb), parse_mode=None)
         return SELECTING_PLAN
 
     # 4. Item Selected -> GENERATE INVOICE
@@ -119,9 +128,6 @@ async def start_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"1. Scan QR to Pay\n2. Click 'Paid'\n3. Send UTR Number"
     )
     
-    try: await q.message.delete()
-    except: pass
-    
     # PAY BUTTONS
     kb_invoice = InlineKeyboardMarkup([
         [InlineKeyboardButton("✅ I Have Paid", callback_data="sent")],
@@ -129,17 +135,17 @@ async def start_buy(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ])
 
     try:
-        await context.bot.send_photo(chat_id=uid, photo=PAYMENT_IMAGE_URL, caption=caption, reply_markup=kb_invoice)
+        await show_screen(q, caption, kb_invoice, parse_mode=None, photo=(media_key(PAYMENT_IMAGE_URL), PAYMENT_IMAGE_URL))
     except Exception as e:
         logger.error(f"Failed to send Payment Photo: {e}")
-        await context.bot.send_message(chat_id=uid, text=f"⚠️ *Image Load Failed*\n\n{caption}\n\n(Pay to Admin UPI manually)", reply_markup=kb_invoice, parse_mode="Markdown")
+        await show_screen(q, f"⚠️ *Image Load Failed*\n\n{caption}\n\n(Pay to Admin UPI manually)", kb_invoice)
         
     return WAITING_FOR_PAYMENT_PROOF
 
 async def confirm_sent(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    await q.edit_message_caption("🔢 **Please Type & Send the UTR Number now:**")
+    await show_screen(q, "🔢 **Please Type & Send the UTR Number now:**", parse_mode=None)
     return WAITING_FOR_UTR
 
 async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -147,16 +153,25 @@ async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     item = context.user_data.get("buying_item", "Unknown")
     
+    # One claim per UTR (unique index); bulk reconciliation matches on it later
+    purchase_id = create_purchase(uid, item, item_price(item), utr)
+    if purchase_id is None:
+        await update.message.reply_text("⚠️ **This UTR was already submitted.**\nSend the UTR of your own payment.", parse_mode="Markdown")
+        try:
+            await context.bot.send_message(ADMIN_ID, f"⚠️ **DUPLICATE UTR**\n👤 ID: `{uid}`\n🛍 Item: `{item}`\n🔢 UTR: `{utr}`", parse_mode="Markdown", rate_limit_args=PRIORITY_ADMIN)
+        except Exception as e:
+            logger.error(f"Failed to send to admin: {e}")
+        return WAITING_FOR_UTR
+    
     # SET PENDING FLAGS (To block further purchases)
     if item in TARGET_PACKS:
         update_user_field(uid, "payment_pending_target", True)
     
     # Notify Admin
-    # Structure: adm_ok_USERID_ITEMKEY
-    # We join item key with underscore just in case, but usually key is simple string
+    # Structure: adm_ok_PURCHASEID / adm_no_PURCHASEID (user and item are read from the purchase)
     kb = InlineKeyboardMarkup([[
-        InlineKeyboardButton("Approve", callback_data=f"adm_ok_{uid}_{item}"),
-        InlineKeyboardButton("Reject", callback_data=f"adm_no_{uid}")
+        InlineKeyboardButton("Approve", callback_data=f"adm_ok_{purchase_id}"),
+        InlineKeyboardButton("Reject", callback_data=f"adm_no_{purchase_id}")
     ]])
     
     try:
@@ -164,7 +179,8 @@ async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
             ADMIN_ID, 
             f"💳 **PAYMENT VERIFICATION**\n━━━━━━━━━━━━━━\n👤 ID: `{uid}`\n🛍 Item: `{item}`\n🔢 UTR: `{utr}`\n━━━━━━━━━━━━━━", 
             reply_markup=kb, 
-            parse_mode="Markdown"
+            parse_mode="Markdown",
+            rate_limit_args=PRIORITY_ADMIN
         )
     except Exception as e:
         logger.error(f"Failed to send to admin: {e}")
@@ -178,21 +194,20 @@ async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
 # --- ADMIN APPROVAL LOGIC ---
 async def admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
-    # Expected format: adm_ok_123456_7_day or adm_no_123456
-    parts = q.data.split("_")
-    action = parts[1] # "ok" or "no"
-    uid = int(parts[2])
+    # Expected format: adm_ok_<purchase_id> or adm_no_<purchase_id>
+    _, action, purchase_id = q.data.split("_", 2)
+    
+    # Guarded on status=pending: settled from the queue / reconciliation / another tap -> nothing happens twice
+    purchase = resolve_purchase(purchase_id, "completed" if action == "ok" else "rejected")
+    if purchase is None:
+        await q.answer("❌ Already processed.", show_alert=True)
+        return
+    uid = purchase["user_id"]
     
     if action == "ok":
-        # Item key might contain underscores (e.g. 7_day), so join from index 3 onwards
-        item_key = "_".join(parts[3:])
-        
+        item_key = purchase["item"]
         await grant_access(uid, item_key, context)
         
-        # Clear Pending Flags
-        if item_key in TARGET_PACKS:
-            update_user_field(uid, "payment_pending_target", False)
-        
         # Referral
         ref = get_user_data(uid).get("referred_by")
         if ref: increment_user_field(ref, "referral_purchases", 1)
@@ -204,37 +219,56 @@ async def admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
         update_user_field(uid, "payment_pending_target", False)
         
         try:
-            await context.bot.send_message(uid, "❌ **Payment Rejected.**\nInvalid Transaction ID or Payment not received.")
+            await context.bot.send_message(uid, "❌ **Payment Rejected.**\nInvalid Transaction ID or Payment not received.", rate_limit_args=PRIORITY_ADMIN)
         except: pass
         await q.edit_message_text(f"🚫 **Rejected User {uid}.**")
 
 async def grant_access(user_id, item_key, context):
     try:
-        if item_key in PREDICTION_PLANS:
-            plan = PREDICTION_PLANS[item_key]
-            expiry = __import__("time").time() + plan["duration_seconds"]
-            update_user_field(user_id, "prediction_status", "ACTIVE")
-            update_user_field(user_id, "expiry_timestamp", int(expiry))
-            
-            await context.bot.send_message(user_id, f"🎉 **PREMIUM ACTIVATED!**\n💎 Plan: {plan['name']}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🚀 Start", callback_data="back_home")]]))
-            
-        elif item_key == NUMBER_SHOT_KEY:
-            update_user_field(user_id, "has_number_shot", True)
-            await context.bot.send_message(user_id, "🎲 **NUMBER SHOT UNLOCKED!**")
-
-        elif item_key in TARGET_PACKS:
-            update_user_field(user_id, "target_access", item_key)
-            pack = TARGET_PACKS[item_key]
-            await context.bot.send_message(user_id, f"🎯 **TARGET SESSION READY**\nPack: {pack['name']}\nType /target to begin.")
+        fields = access_fields(item_key)
+        if not fields: return
+        update_user_fields(user_id, fields)
+        text, kb = access_message(item_key)
+        await context.bot.send_message(user_id, text, reply_markup=kb, rate_limit_args=PRIORITY_ADMIN)
     except Exception as e:
         logger.error(f"Error granting access: {e}")
 
+# --- ITEM HELPERS (shared by manual approval and bulk reconciliation) ---
+def item_price(item_key):
+    """Numeric price of a shop item ("300₹" -> 300.0); 0.0 if unknown."""
+    if item_key in PREDICTION_PLANS: price = PREDICTION_PLANS[item_key]["price"]
+    elif item_key in TARGET_PACKS: price = TARGET_PACKS[item_key]["price"]
+    elif item_key == NUMBER_SHOT_KEY: price = NUMBER_SHOT_PRICE
+    else: return 0.0
+    return float(re.sub(r"[^\d.]", "", price) or 0)
+
+def access_fields(item_key):
+    """The user fields ($set) that a paid `item_key` unlocks."""
+    if item_key in PREDICTION_PLANS:
+        expiry = time.time() + PREDICTION_PLANS[item_key]["duration_seconds"]
+        return {"prediction_status": "ACTIVE", "expiry_timestamp": int(expiry)}
+    if item_key == NUMBER_SHOT_KEY:
+        return {"has_number_shot": True}
+    if item_key in TARGET_PACKS:
+        return {"target_access": item_key, "payment_pending_target": False}
+    return {}
+
+def access_message(item_key):
+    """(text, reply_markup) sent to the user once `item_key` is unlocked."""
+    if item_key in PREDICTION_PLANS:
+        return (f"🎉 **PREMIUM ACTIVATED!**\n💎 Plan: {PREDICTION_PLANS[item_key]['name']}",
+                InlineKeyboardMarkup([[InlineKeyboardButton("🚀 Start", callback_data="back_home")]]))
+    if item_key == NUMBER_SHOT_KEY:
+        return "🎲 **NUMBER SHOT UNLOCKED!**\nType /numbershot to begin.", None
+    pack = TARGET_PACKS[item_key]
+    return f"🎯 **TARGET SESSION READY**\nPack: {pack['name']}\nType /target to begin.", None
+
 # --- TARGET COMMANDS ---
 async def target_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     user_data = get_user_data(user_id)
     
-    if user_data.get("target_session"):
+    if get_active_session(user_id, "target"):
         await update.message.reply_text("⚠️ **Active Session Found.**", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("▶️ Resume", callback_data="target_resume")]]))
         return TARGET_START_MENU 
 
@@ -259,6 +293,7 @@ async def start_target_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not session:
         await q.edit_message_text("❌ **API Error.**")
         return ConversationHandler.END
+    context.user_data["target_session"] = session
         
     await display_target(q, session)
     return TARGET_GAME_LOOP
@@ -266,10 +301,11 @@ async def start_target_game(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def target_resume(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
-    sess = get_user_data(q.from_user.id).get("target_session")
+    sess = get_active_session(q.from_user.id, "target")
     if not sess:
         await q.edit_message_text("⌛ Session Expired.")
         return ConversationHandler.END
+    context.user_data["target_session"] = sess
     await display_target(q, sess)
     return TARGET_GAME_LOOP
 
@@ -299,15 +335,28 @@ async def display_target(update_obj, sess):
         f"🔮 PICK: {color} **{sess['current_prediction']}**\n"
         f"💸 BET: {bet}\n"
     )
-    kb = InlineKeyboardMarkup([[InlineKeyboardButton("✅ WIN", callback_data="tgt_win"), InlineKeyboardButton("❌ LOSS", callback_data="tgt_loss")]])
-    await update_obj.edit_message_text(msg, reply_markup=kb, parse_mode="Markdown")
+    v = sess['version']
+    kb = InlineKeyboardMarkup([[InlineKeyboardButton("✅ WIN", callback_data=f"tgt_win_{v}"), InlineKeyboardButton("❌ LOSS", callback_data=f"tgt_loss_{v}")]])
+    await edit_if_changed(update_obj, msg, reply_markup=kb, parse_mode="Markdown")
 
 async def target_loop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
+    # Only the screen of the current version counts; a double tap carries an old one
+    sess = session_at(q.from_user.id, "target", tap_version(q.data), context.user_data.get("target_session"))
+    if not sess:
+        await q.answer("⚠️ Already counted.")
+        sess = get_active_session(q.from_user.id, "target")
+        context.user_data["target_session"] = sess
+        if not sess:
+            await q.edit_message_text("⏹ **Ended.**")
+            return ConversationHandler.END
+        await display_target(q, sess)
+        return TARGET_GAME_LOOP
     await q.answer()
-    out = q.data.replace("tgt_", "")
+    out = q.data.split("_")[1]
     
-    sess, stat = process_target_outcome(q.from_user.id, out)
+    sess, stat = process_target_outcome(q.from_user.id, out, sess)
+    context.user_data["target_session"] = sess
     
     if stat == "TargetReached":
         await q.edit_message_text(f"🎉 **TARGET HIT!**\nBalance: {sess['current_balance']}")
@@ -1,7 +1,9 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
-from target_engine import start_sureshot_session, process_sureshot_loop
+from target_engine import start_sureshot_session, process_sureshot_loop, session_at, tap_version
+from database import get_active_session
 from config import SURESHOT_MENU, SURESHOT_LOOP
+from message_state import edit_if_changed
 
 async def sureshot_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = [
@@ -28,6 +30,7 @@ async def sureshot_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not session:
         await q.edit_message_text("❌ **API Error.** Please try again.")
         return ConversationHandler.END
+    context.user_data["sureshot_session"] = session
         
     await show_sureshot_ui(q, session)
     return SURESHOT_LOOP
@@ -35,20 +38,34 @@ async def sureshot_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def sureshot_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Refreshes the scanner (Called when user clicks 'Scan Again')."""
     q = update.callback_query
+    session = session_at(q.from_user.id, "sureshot", tap_version(q.data), context.user_data.get("sureshot_session"))
+    if not session:
+        await q.answer("⏳ Already updated.")
+        return await _redraw(q, context)
     await q.answer("Scanning...")
     
     # Process with NO outcome (Just checking for new signal)
-    session, status = process_sureshot_loop(q.from_user.id, outcome=None)
+    session, status = process_sureshot_loop(q.from_user.id, outcome=None, session=session)
+    context.user_data["sureshot_session"] = session
+    if status == "Ended":
+        await q.edit_message_text("⌛ **Session Expired.**\nType /sureshot to start again.")
+        return ConversationHandler.END
     await show_sureshot_ui(q, session)
     return SURESHOT_LOOP
 
 async def sureshot_outcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handles Win/Loss buttons."""
     q = update.callback_query
+    # Only the screen of the current version counts; a double tap carries an old one
+    session = session_at(q.from_user.id, "sureshot", tap_version(q.data), context.user_data.get("sureshot_session"))
+    if not session:
+        await q.answer("⚠️ Already counted.")
+        return await _redraw(q, context)
     await q.answer()
     outcome = "win" if "win" in q.data else "loss"
     
-    session, status = process_sureshot_loop(q.from_user.id, outcome=outcome)
+    session, status = process_sureshot_loop(q.from_user.id, outcome=outcome, session=session)
+    context.user_data["sureshot_session"] = session
     
     if status == "Completed":
         await q.edit_message_text("🏆 **LADDER COMPLETED!** 🏆\n\n✅ Turned 100 ➡️ 1000!\n🎉 Take a break.")
@@ -56,15 +73,29 @@ async def sureshot_outcome(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif status == "Failed":
         await q.edit_message_text("💀 **LADDER BROKEN.**\n\nLevel Failed. Try again.")
         return ConversationHandler.END
+    elif status == "Ended":
+        await q.edit_message_text("⌛ **Session Expired.**\nType /sureshot to start again.")
+        return ConversationHandler.END
         
     await show_sureshot_ui(q, session)
     return SURESHOT_LOOP
 
+async def _redraw(q, context):
+    """A button from an older screen: shows the session as it is now instead of applying the tap."""
+    session = get_active_session(q.from_user.id, "sureshot")
+    context.user_data["sureshot_session"] = session
+    if not session:
+        await q.edit_message_text("⌛ **Session Expired.**\nType /sureshot to start again.")
+        return ConversationHandler.END
+    await show_sureshot_ui(q, session)
+    return SURESHOT_LOOP
+
 async def show_sureshot_ui(update_obj, session):
     """Dynamic UI: Shows 'Scanning' or 'Bet Now'."""
     lvl = session['current_level']
     amt = session['current_bet_amount']
     period = session['current_period']
+    v = session['version']
     
     # VISUALS
     progress = "🧗 " + ("✅" * (lvl-1)) + "⬜" * (6-lvl)
@@ -80,7 +111,7 @@ async def show_sureshot_ui(update_obj, session):
             f"🤖 Logic: V5 ≠ Trend (Mismatch)\n\n"
             f"💤 _Bot is sleeping until 100% confirmation._"
         )
-        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Scan Next Period", callback_data="ss_refresh")]])
+        kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔄 Scan Next Period", callback_data=f"ss_refresh_{v}")]])
     else:
         # SIGNAL MODE
         pred = session['current_prediction']
@@ -98,8 +129,8 @@ async def show_sureshot_ui(update_obj, session):
             f"✅ Trend Analysis: **{pred}**\n"
         )
         kb = InlineKeyboardMarkup([
-            [InlineKeyboardButton("✅ WON", callback_data="ss_win"), InlineKeyboardButton("❌ LOST", callback_data="ss_loss")],
-            [InlineKeyboardButton("⏭ Skip", callback_data="ss_refresh")]
+            [InlineKeyboardButton("✅ WON", callback_data=f"ss_win_{v}"), InlineKeyboardButton("❌ LOST", callback_data=f"ss_loss_{v}")],
+            [InlineKeyboardButton("⏭ Skip", callback_data=f"ss_refresh_{v}")]
         ])
 
-    await update_obj.edit_message_text(msg, reply_markup=kb, parse_mode="Markdown")
\ No newline at end of file
+    await edit_if_changed(update_obj, msg, reply_markup=kb, parse_mode="Markdown")
\ No newline at end of file
@@ -1,7 +1,8 @@
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes, ConversationHandler
 from database import get_user_data, update_user_field, is_subscription_active, increment_user_field, get_top_referrers
-from config import REGISTER_LINK, ADMIN_ID
+from config import REGISTER_LINK, ADMIN_ID, DEFAULT_ENGINE
+from engine_registry import ENGINES
 
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Universal cancel command."""
@@ -53,14 +54,11 @@ async def switch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("🔒 **Premium Required.**\nPlease buy a plan to use advanced engines.")
         return
         
-    curr = user_data.get("prediction_mode", "V2")
+    curr = user_data.get("prediction_mode", DEFAULT_ENGINE)
     
     kb = InlineKeyboardMarkup([
-        [InlineKeyboardButton(f"{'✅ ' if curr=='V1' else ''}V1: Pattern Matcher", callback_data="set_mode_V1")],
-        [InlineKeyboardButton(f"{'✅ ' if curr=='V2' else ''}V2: Streak/Switch (Balanced)", callback_data="set_mode_V2")],
-        [InlineKeyboardButton(f"{'✅ ' if curr=='V3' else ''}V3: Random AI (Unpredictable)", callback_data="set_mode_V3")],
-        [InlineKeyboardButton(f"{'✅ ' if curr=='V4' else ''}V4: Trend Follower (Safe)", callback_data="set_mode_V4")],
-        [InlineKeyboardButton(f"{'✅ ' if curr=='V5' else ''}V5: Argon2i Hash (Safe)", callback_data="set_mode_V5")]
+        [InlineKeyboardButton(f"{'✅ ' if curr==key else ''}{key}: {e.label}", callback_data=f"set_mode_{key}")]
+        for key, e in ENGINES.items()
     ])
     await update.message.reply_text(
         f"⚙️ **PREDICTION ENGINE SETTINGS**\n\n"
@@ -68,13 +66,17 @@ async def switch_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📝 **Description:**\n"
         f"🔹 **V1:** Follows AABB, ABAB patterns.\n"
         f"🔹 **V2:** Standard level-based switching.\n"
-        f"🔹 **V5:** Uses server hash salt analysis (Most Advanced).\n\n"
+        f"🔹 **V5:** Uses server hash salt analysis (Most Advanced).\n"
+        f"🔹 **V6:** Learns which side follows the last 1-8 results.\n\n"
         f"👇 Select Engine:",
         reply_markup=kb, parse_mode="Markdown"
     )
 
 async def set_mode(update: Update, context: ContextTypes.DEFAULT_TYPE):
     mode = update.callback_query.data.split("_")[-1]
+    if mode not in ENGINES:
+        await update.callback_query.answer("❌ Unknown engine.", show_alert=True)
+        return
     update_user_field(update.callback_query.from_user.id, "prediction_mode", mode)
     await update.callback_query.answer(f"Switched to {mode}")
     await update.callback_query.edit_message_text(f"✅ **Engine: {mode}**")
@@ -1,17 +1,26 @@
-import matplotlib
-matplotlib.use('Agg') # Safe mode for servers
-import matplotlib.pyplot as plt
-import io
+import time
+import asyncio
+import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
 from telegram.ext import ContextTypes, ConversationHandler
 from database import (
     get_user_wallet, get_all_tokens, update_wallet_balance, 
     trade_token, create_transaction, get_user_transactions, 
     update_transaction_status, get_transaction, get_user_data,
-    update_token_price, users_collection, get_all_user_ids,
-    update_token_holding, get_token_details
+    update_token_price, get_token_details, get_roi_leaderboard,
+    ORDER_KINDS, create_order, cancel_order, get_open_orders,
+    get_ledger_entries, rebuild_wallet_from_ledger, release_stale_cancels,
+    withdraw_funds, ledger_imbalances, ledger_wallet_delta
 )
-from config import ADMIN_ID, PAYMENT_IMAGE_URL
+from config import ADMIN_ID, PAYMENT_IMAGE_URL, CHART_BACKEND, ROI_CACHE_TTL
+from chart_renderer import render_chart
+from portfolio_engine import get_valuation, get_holding, get_price, load_wallet, sync_prices, on_price_tick, apply_cash
+from media_registry import media_key
+from order_book import add_order, remove_order, process_ticks
+from outbound_scheduler import PRIORITY_ADMIN
+from navigation import show_screen
+
+logger = logging.getLogger(__name__)
 
 # --- CONVERSATION STATES ---
 # Deposit/Withdraw
@@ -19,49 +28,28 @@ DEP_AMOUNT, DEP_METHOD, DEP_UTR = range(10, 13)
 WD_AMOUNT, WD_METHOD, WD_DETAILS = range(20, 23)
 # Trading (New)
 TRADE_AMOUNT = 30
+ORDER_INPUT = 31
+
+# ROI leaderboard cache (admin)
+_roi_cache = {"ts": 0, "rows": []}
 
 # --- CHART GENERATOR ---
-def generate_chart_image(symbol, history):
-    """Generates a price chart image buffer."""
-    try:
-        fig, ax = plt.subplots(figsize=(6, 3), dpi=100)
-        # Color: Green if up, Red if down
-        color = '#00ff00' if len(history) > 1 and history[-1] >= history[0] else '#ff0000'
-        
-        ax.plot(history, marker='o', linestyle='-', color=color, linewidth=2, markersize=4)
-        ax.set_title(f"{symbol} Price History")
-        ax.set_ylabel("Price (INR)")
-        ax.grid(True, linestyle='--', alpha=0.3)
-        
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight')
-        buf.seek(0)
-        plt.close(fig) 
-        return buf
-    except Exception as e:
-        print(f"Chart Error: {e}")
-        return None
+def generate_chart_image(symbol, history, style="line"):
+    """Generates a price chart image buffer ('line' or 'candle')."""
+    return render_chart(symbol, history, style)
 
 # ==========================================
 # 1. MAIN WALLET MENU
 # ==========================================
 async def wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
-    wallet = get_user_wallet(uid)
-    bal = wallet['balance']
-    
-    tokens = get_all_tokens()
-    assets_val = 0
-    holdings = wallet.get('holdings', {})
+    val = get_valuation(uid) # Incrementally maintained (no token scan)
+    bal = val['balance']
+    assets_val = val['assets']
     holdings_txt = ""
     
-    for t in tokens:
-        sym = t['symbol']
-        qty = holdings.get(sym, 0)
-        if qty > 0:
-            val = qty * t['price']
-            assets_val += val
-            holdings_txt += f"🔹 **{t['name']}:** {qty} (≈₹{int(val)})\n"
+    for sym, name, qty, value in val['positions']:
+        holdings_txt += f"🔹 **{name}:** {qty} (≈₹{int(value)})\n"
 
     # Pending Transactions
     txs = get_user_transactions(uid, limit=3)
@@ -76,7 +64,7 @@ async def wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"━━━━━━━━━━━━━━\n"
         f"💵 Fiat Balance: **₹{bal:.2f}**\n"
         f"💎 Asset Value: **₹{assets_val:.2f}**\n"
-        f"📊 **Net Worth: ₹{bal + assets_val:.2f}**\n"
+        f"📊 **Net Worth: ₹{val['net_worth']:.2f}**\n"
         f"━━━━━━━━━━━━━━\n"
         f"**⏳ PENDING:**\n{pending_txt if pending_txt else 'No pending transactions.'}\n"
         f"━━━━━━━━━━━━━━\n"
@@ -85,16 +73,12 @@ async def wallet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     kb = [
         [InlineKeyboardButton("➕ Deposit", callback_data="start_deposit"), InlineKeyboardButton("➖ Withdraw", callback_data="start_withdraw")],
-        [InlineKeyboardButton("📈 Invest / Trade", callback_data="wallet_tokens")],
+        [InlineKeyboardButton("📈 Invest / Trade", callback_data="wallet_tokens"), InlineKeyboardButton("📋 My Orders", callback_data="wallet_orders")],
         [InlineKeyboardButton("🔙 Back", callback_data="back_home")]
     ]
     
     if update.callback_query:
-        if update.callback_query.message.photo:
-            await update.callback_query.message.delete()
-            await context.bot.send_message(uid, msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
-        else:
-            await update.callback_query.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+        await show_screen(update.callback_query, msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
     else:
         await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
     return ConversationHandler.END
@@ -106,6 +90,8 @@ async def tokens_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer()
     tokens = get_all_tokens()
+    moved = sync_prices(tokens) # Revalue holders of moved symbols only
+    await process_ticks(context.bot, moved)
     
     msg = "📈 **TOKEN MARKET**\nSelect a token to view Chart & Buy:\n━━━━━━━━━━━━━━\n"
     kb = []
@@ -115,11 +101,7 @@ async def tokens_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     kb.append([InlineKeyboardButton("🔙 Back", callback_data="wallet_main")])
     
-    if q.message.photo:
-        await q.message.delete()
-        await context.bot.send_message(q.from_user.id, msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
-    else:
-        await q.edit_message_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+    await show_screen(q, msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
     return ConversationHandler.END
 
 async def view_token_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -127,19 +109,20 @@ async def view_token_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
     await q.answer("Loading Chart...")
     
-    sym = q.data.split("_")[2]
+    parts = q.data.split("_")
+    sym = parts[2]
+    style = "candle" if len(parts) > 3 and parts[3] == "candle" else "line"
     token = get_token_details(sym)
     
     if not token:
         await q.message.reply_text("❌ Token not found.")
         return
+    on_price_tick(sym, token['price'])
 
     # Generate Chart
     history = token.get("history", [token['price']])
     if len(history) < 2: history = [token['price']] * 5 
     
-    chart_buf = generate_chart_image(sym, history)
-    
     caption = (
         f"📊 **{token['name']} ({sym})**\n"
         f"━━━━━━━━━━━━━━\n"
@@ -151,16 +134,18 @@ async def view_token_chart(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # NEW TRADING BUTTONS (Start Conversation)
     kb = [
         [InlineKeyboardButton("🟢 BUY", callback_data=f"ask_buy_{sym}"), InlineKeyboardButton("🔴 SELL", callback_data=f"ask_sell_{sym}")],
+        [InlineKeyboardButton("📥 Limit Buy", callback_data=f"ord_new_lbuy_{sym}"), InlineKeyboardButton("📤 Limit Sell", callback_data=f"ord_new_lsell_{sym}")],
+        [InlineKeyboardButton("🛑 Stop Loss", callback_data=f"ord_new_ssell_{sym}"), InlineKeyboardButton("🚀 Stop Buy", callback_data=f"ord_new_sbuy_{sym}")],
+        [InlineKeyboardButton("📈 Line" if style == "candle" else "🕯 Candles", callback_data=f"view_chart_{sym}" if style == "candle" else f"view_chart_{sym}_candle")],
         [InlineKeyboardButton("🔙 Back to Market", callback_data="wallet_tokens")]
     ]
     
-    # Cleanup previous message to prevent flickers/errors
-    await q.message.delete()
-    
-    if chart_buf:
-        await context.bot.send_photo(q.from_user.id, photo=chart_buf, caption=caption, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
-    else:
-        await context.bot.send_message(q.from_user.id, caption + "\n(Chart unavailable)", reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+    # Same symbol + history => same image: render & upload only on first view.
+    # Swapped into the current message in place (no delete + re-send flicker).
+    chart = (media_key("chart", CHART_BACKEND, style, sym, history), lambda: generate_chart_image(sym, history, style))
+    sent = await show_screen(q, caption, InlineKeyboardMarkup(kb), photo=chart)
+    if not sent:
+        await show_screen(q, caption + "\n(Chart unavailable)", InlineKeyboardMarkup(kb))
     return ConversationHandler.END
 
 # ==========================================
@@ -179,13 +164,14 @@ async def ask_trade_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data['trade_action'] = action
     context.user_data['trade_symbol'] = sym
     
-    token = get_token_details(sym)
-    price = token['price']
+    price = get_price(sym) # In-memory price snapshot
     uid = q.from_user.id
-    wallet = get_user_wallet(uid)
+    if price is None:
+        await q.message.reply_text("❌ Token not found.")
+        return ConversationHandler.END
     
     if action == "buy":
-        bal = wallet['balance']
+        bal = get_valuation(uid)['balance']
         max_can_buy = int(bal // price)
         msg = (
             f"🟢 **BUY {sym}**\n"
@@ -195,7 +181,7 @@ async def ask_trade_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🔢 **Type the amount to BUY:**"
         )
     else: # Sell
-        holdings = wallet.get('holdings', {}).get(sym, 0)
+        holdings = get_holding(uid, sym)
         msg = (
             f"🔴 **SELL {sym}**\n"
             f"💰 Price: ₹{price}\n"
@@ -203,13 +189,7 @@ async def ask_trade_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
             f"🔢 **Type the amount to SELL:**"
         )
 
-    # Use edit_message_caption if coming from photo, else edit text
-    if q.message.photo:
-        await q.message.delete()
-        await context.bot.send_message(uid, msg, parse_mode="Markdown")
-    else:
-        await q.edit_message_text(msg, parse_mode="Markdown")
-        
+    await show_screen(q, msg)
     return TRADE_AMOUNT
 
 async def execute_trade(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -226,31 +206,149 @@ async def execute_trade(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     action = context.user_data.get('trade_action')
     sym = context.user_data.get('trade_symbol')
-    token = get_token_details(sym)
-    price = token['price']
-    wallet = get_user_wallet(uid)
+    price = get_price(sym) # In-memory price snapshot
+    if price is None:
+        await update.message.reply_text("❌ Token not found.")
+        return ConversationHandler.END
     
     if action == "buy":
         cost = qty * price
-        if wallet['balance'] >= cost:
-            trade_token(uid, sym, qty, price, is_buy=True)
+        wallet = trade_token(uid, sym, qty, price, is_buy=True) # 1 guarded round trip
+        if wallet:
+            load_wallet(uid, wallet)
             await update.message.reply_text(f"✅ **BOUGHT!**\n\n➕ {qty} {sym}\n➖ ₹{cost:.2f}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📉 View Chart", callback_data=f"view_chart_{sym}")]]))
         else:
-            await update.message.reply_text(f"❌ **Insufficient Funds.**\nCost: ₹{cost}\nBalance: ₹{wallet['balance']}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=f"view_chart_{sym}")]]))
+            await update.message.reply_text(f"❌ **Insufficient Funds.**\nCost: ₹{cost}\nBalance: ₹{get_valuation(uid)['balance']}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=f"view_chart_{sym}")]]))
             return ConversationHandler.END
 
     elif action == "sell":
-        owned = wallet.get('holdings', {}).get(sym, 0)
-        if owned >= qty:
-            earnings = qty * price
-            trade_token(uid, sym, qty, price, is_buy=False)
+        earnings = qty * price
+        wallet = trade_token(uid, sym, qty, price, is_buy=False) # 1 guarded round trip
+        if wallet:
+            load_wallet(uid, wallet)
             await update.message.reply_text(f"✅ **SOLD!**\n\n➖ {qty} {sym}\n➕ ₹{earnings:.2f}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📉 View Chart", callback_data=f"view_chart_{sym}")]]))
         else:
-            await update.message.reply_text(f"❌ **Insufficient Tokens.**\nYou have: {owned}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=f"view_chart_{sym}")]]))
+            await update.message.reply_text(f"❌ **Insufficient Tokens.**\nYou have: {get_holding(uid, sym)}", reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=f"view_chart_{sym}")]]))
             return ConversationHandler.END
 
     return ConversationHandler.END
 
+# ==========================================
+# 4. LIMIT / STOP ORDERS
+# ==========================================
+
+ORDER_HINTS = {
+    "lbuy": "Buys when price falls to your price (below current).",
+    "lsell": "Sells when price rises to your price (above current).",
+    "ssell": "Sells when price falls to your price (below current).",
+    "sbuy": "Buys when price rises to your price (above current).",
+}
+
+async def ask_order(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Asks for quantity + trigger price of a resting order."""
+    q = update.callback_query
+    await q.answer()
+    
+    _, _, kind, sym = q.data.split("_")
+    context.user_data['order_kind'] = kind
+    context.user_data['order_symbol'] = sym
+    uid = q.from_user.id
+    
+    msg = (
+        f"📌 **{ORDER_KINDS[kind]['name'].upper()} {sym}**\n"
+        f"💰 Price now: ₹{get_price(sym)}\n"
+        f"ℹ️ {ORDER_HINTS[kind]}\n\n"
+        f"🔢 **Type quantity and price:**\n`5 9.50`"
+    )
+    await show_screen(q, msg)
+    return ORDER_INPUT
+
+async def place_order_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    uid = update.effective_user.id
+    kind = context.user_data.get('order_kind')
+    sym = context.user_data.get('order_symbol')
+    
+    try:
+        qty_txt, price_txt = update.message.text.split()
+        qty, trigger = int(qty_txt), round(float(price_txt), 2)
+        if qty <= 0 or trigger <= 0: raise ValueError
+    except:
+        await update.message.reply_text("❌ Invalid format. Type quantity and price, e.g. `5 9.50`", parse_mode="Markdown")
+        return ORDER_INPUT
+
+    price = get_price(sym)
+    back_kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data=f"view_chart_{sym}")]])
+    if price is None:
+        await update.message.reply_text("❌ Token not found.")
+        return ConversationHandler.END
+    
+    # Trigger must be on the correct side of the market, else it would fire instantly
+    below = ORDER_KINDS[kind]['fires'] == "le"
+    if (below and trigger >= price) or (not below and trigger <= price):
+        await update.message.reply_text(f"❌ Price must be {'below' if below else 'above'} ₹{price}.", reply_markup=back_kb)
+        return ConversationHandler.END
+
+    order, wallet = create_order(uid, sym, kind, qty, trigger)
+    if not order:
+        reason = f"Balance: ₹{get_valuation(uid)['balance']:.2f}" if ORDER_KINDS[kind]['side'] == "buy" else f"You have: {get_holding(uid, sym)}"
+        await update.message.reply_text(f"❌ **Insufficient {'Funds' if ORDER_KINDS[kind]['side'] == 'buy' else 'Tokens'}.**\n{reason}", reply_markup=back_kb)
+        return ConversationHandler.END
+
+    load_wallet(uid, wallet)
+    add_order(order)
+    await update.message.reply_text(
+        f"📌 **ORDER PLACED**\n"
+        f"{ORDER_KINDS[kind]['name']}: {qty} {sym} @ ₹{trigger}\n"
+        f"🔒 Reserved: {f'₹{qty * trigger:.2f}' if order['side'] == 'buy' else f'{qty} {sym}'}\n"
+        f"🆔 `{order['order_id']}`",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("📋 My Orders", callback_data="wallet_orders")]]),
+        parse_mode="Markdown"
+    )
+    return ConversationHandler.END
+
+async def orders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lists the user's open orders with cancel buttons."""
+    uid = update.effective_user.id
+    orders = get_open_orders(uid)
+    
+    msg = "📋 **OPEN ORDERS**\n━━━━━━━━━━━━━━\n"
+    kb = []
+    for o in orders:
+        msg += f"• {ORDER_KINDS[o['kind']]['name']}: {o['quantity']} {o['symbol']} @ ₹{o['trigger']} (`{o['order_id']}`)\n"
+        kb.append([InlineKeyboardButton(f"❌ Cancel {o['symbol']} @ ₹{o['trigger']}", callback_data=f"ord_cancel_{o['order_id']}")])
+    if not orders: msg += "No open orders."
+    kb.append([InlineKeyboardButton("🔙 Back", callback_data="wallet_main")])
+    
+    if update.callback_query:
+        await update.callback_query.answer()
+        await show_screen(update.callback_query, msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+    else:
+        await update.message.reply_text(msg, reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+
+async def cancel_order_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    q = update.callback_query
+    uid = q.from_user.id
+    order_id = q.data.replace("ord_cancel_", "")
+    
+    order, wallet = cancel_order(uid, order_id)
+    if not order:
+        await q.answer("❌ Already filled or cancelled.", show_alert=True)
+    else:
+        remove_order(order_id)
+        if wallet: load_wallet(uid, wallet)
+        await q.answer("✅ Order cancelled. Funds released.")
+    await orders_command(update, context)
+
+async def market_tick_job(context: ContextTypes.DEFAULT_TYPE):
+    """JobQueue: moves the market on a schedule, fills crossed orders and retries unfinished cancels."""
+    try:
+        moved = sync_prices(get_all_tokens())
+        await process_ticks(context.bot, moved)
+        for uid, wallet in await asyncio.to_thread(release_stale_cancels):
+            load_wallet(uid, wallet)
+    except Exception as e:
+        logger.error(f"Market Tick Error: {e}")
+
 # --- DEPOSIT FLOW ---
 async def start_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -261,11 +359,7 @@ async def start_deposit(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton("₹500", callback_data="dep_amt_500"), InlineKeyboardButton("₹1000", callback_data="dep_amt_1000")],
         [InlineKeyboardButton("₹5000", callback_data="dep_amt_5000"), InlineKeyboardButton("🔙 Cancel", callback_data="wallet_main")]
     ]
-    if q.message.photo: 
-        await q.message.delete()
-        await context.bot.send_message(q.from_user.id, "➕ **DEPOSIT FUNDS**\nSelect Amount:", reply_markup=InlineKeyboardMarkup(kb))
-    else: 
-        await q.edit_message_text("➕ **DEPOSIT FUNDS**\nSelect Amount:", reply_markup=InlineKeyboardMarkup(kb))
+    await show_screen(q, "➕ **DEPOSIT FUNDS**\nSelect Amount:", InlineKeyboardMarkup(kb), parse_mode=None)
     return DEP_AMOUNT
 
 async def select_deposit_amount(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -278,7 +372,7 @@ async def select_deposit_amount(update: Update, context: ContextTypes.DEFAULT_TY
     context.user_data['dep_amount'] = amt
     
     kb = [[InlineKeyboardButton("📲 UPI", callback_data="dep_method_upi")]]
-    await q.edit_message_text(f"💳 **Amount: ₹{amt}**\nSelect Payment Method:", reply_markup=InlineKeyboardMarkup(kb))
+    await show_screen(q, f"💳 **Amount: ₹{amt}**\nSelect Payment Method:", InlineKeyboardMarkup(kb), parse_mode=None)
     return DEP_METHOD
 
 async def show_qr_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -299,17 +393,10 @@ async def show_qr_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     kb = [[InlineKeyboardButton("✅ I Have Paid", callback_data="dep_paid")]]
     
-    await q.message.delete()
     try:
-        await context.bot.send_photo(
-            chat_id=q.from_user.id,
-            photo=PAYMENT_IMAGE_URL,
-            caption=caption,
-            reply_markup=InlineKeyboardMarkup(kb),
-            parse_mode="Markdown"
-        )
+        await show_screen(q, caption, InlineKeyboardMarkup(kb), photo=(media_key(PAYMENT_IMAGE_URL), PAYMENT_IMAGE_URL))
     except:
-        await context.bot.send_message(q.from_user.id, f"⚠️ **QR Error**\n\n{caption}", reply_markup=InlineKeyboardMarkup(kb), parse_mode="Markdown")
+        await show_screen(q, f"⚠️ **QR Error**\n\n{caption}", InlineKeyboardMarkup(kb))
         
     return DEP_UTR
 
@@ -319,13 +406,7 @@ async def ask_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     msg = "🔢 **ENTER UTR NUMBER:**\n\nPlease type and send the 12-digit UTR number now."
     
-    # Safe edit check
-    if q.message.photo:
-        await q.message.delete()
-        await context.bot.send_message(q.from_user.id, msg, parse_mode="Markdown")
-    else:
-        await q.edit_message_text(msg, parse_mode="Markdown")
-        
+    await show_screen(q, msg)
     return DEP_UTR
 
 async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -333,7 +414,10 @@ async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
     uid = update.effective_user.id
     amt = context.user_data.get('dep_amount')
     
-    tx_id = create_transaction(uid, "deposit", amt, "UPI", utr)
+    tx_id = create_transaction(uid, "deposit", amt, "UPI", utr, utr=utr)
+    if tx_id is None:
+        await update.message.reply_text("⚠️ **This UTR was already submitted.**\nSend the UTR of your own payment.", parse_mode="Markdown")
+        return DEP_UTR
     
     kb_admin = InlineKeyboardMarkup([
         [InlineKeyboardButton("✅ Accept", callback_data=f"adm_dep_ok_{tx_id}"), 
@@ -343,7 +427,8 @@ async def receive_utr(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ADMIN_ID,
         f"📥 **NEW DEPOSIT**\n👤 User: `{uid}`\n💰 Amount: ₹{amt}\n🔢 UTR: `{utr}`\n🆔 TxID: `{tx_id}`",
         reply_markup=kb_admin,
-        parse_mode="Markdown"
+        parse_mode="Markdown",
+        rate_limit_args=PRIORITY_ADMIN
     )
     
     await update.message.reply_text(
@@ -364,8 +449,7 @@ async def start_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if bal < 100:
         msg = "❌ **Minimum withdrawal is ₹100.**"
         kb = InlineKeyboardMarkup([[InlineKeyboardButton("🔙 Back", callback_data="wallet_main")]])
-        if q.message.photo: await q.message.delete(); await context.bot.send_message(uid, msg, reply_markup=kb)
-        else: await q.edit_message_text(msg, reply_markup=kb)
+        await show_screen(q, msg, kb, parse_mode=None)
         return ConversationHandler.END
         
     amt_25 = int(bal * 0.25)
@@ -378,11 +462,7 @@ async def start_withdraw(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [InlineKeyboardButton(f"100% (₹{amt_100})", callback_data=f"wd_amt_{amt_100}")],
         [InlineKeyboardButton("🔙 Cancel", callback_data="wallet_main")]
     ]
-    if q.message.photo: 
-        await q.message.delete()
-        await context.bot.send_message(uid, f"📤 **WITHDRAWAL**\nBalance: ₹{bal}\nSelect Amount:", reply_markup=InlineKeyboardMarkup(kb))
-    else:
-        await q.edit_message_text(f"📤 **WITHDRAWAL**\nBalance: ₹{bal}\nSelect Amount:", reply_markup=InlineKeyboardMarkup(kb))
+    await show_screen(q, f"📤 **WITHDRAWAL**\nBalance: ₹{bal}\nSelect Amount:", InlineKeyboardMarkup(kb), parse_mode=None)
     return WD_AMOUNT
 
 async def select_withdraw_method(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -398,7 +478,7 @@ async def select_withdraw_method(update: Update, context: ContextTypes.DEFAULT_T
         [InlineKeyboardButton("UPI", callback_data="wd_method_UPI"), InlineKeyboardButton("BANK", callback_data="wd_method_BANK")],
         [InlineKeyboardButton("USDT (TRC20)", callback_data="wd_method_USDT")]
     ]
-    await q.edit_message_text(f"💸 **Withdraw: ₹{amt}**\nSelect Receiving Method:", reply_markup=InlineKeyboardMarkup(kb))
+    await show_screen(q, f"💸 **Withdraw: ₹{amt}**\nSelect Receiving Method:", InlineKeyboardMarkup(kb), parse_mode=None)
     return WD_METHOD
 
 async def ask_withdraw_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -408,7 +488,7 @@ async def ask_withdraw_details(update: Update, context: ContextTypes.DEFAULT_TYP
     method = q.data.split("_")[2]
     context.user_data['wd_method'] = method
     
-    await q.edit_message_text(f"📝 **Selected: {method}**\n\nEnter Payment Details now:")
+    await show_screen(q, f"📝 **Selected: {method}**\n\nEnter Payment Details now:", parse_mode=None)
     return WD_DETAILS
 
 async def process_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -417,13 +497,13 @@ async def process_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE)
     amt = context.user_data['wd_amount']
     method = context.user_data['wd_method']
     
-    wallet = get_user_wallet(uid)
-    if wallet['balance'] < amt:
+    # The balance check is part of the debit's filter, so parallel requests can't overdraw
+    tx_id = create_transaction(uid, "withdraw", amt, method, details)
+    if not withdraw_funds(uid, amt, tx_id):
+        update_transaction_status(tx_id, "failed")
         await update.message.reply_text("❌ **Insufficient Balance.**")
         return ConversationHandler.END
-        
-    update_wallet_balance(uid, -amt)
-    tx_id = create_transaction(uid, "withdraw", amt, method, details)
+    apply_cash(uid, -amt)
     
     kb_admin = InlineKeyboardMarkup([
         [InlineKeyboardButton("✅ Approve", callback_data=f"adm_wd_ok_{tx_id}"), 
@@ -433,7 +513,8 @@ async def process_withdrawal(update: Update, context: ContextTypes.DEFAULT_TYPE)
         ADMIN_ID,
         f"📤 **WITHDRAW REQUEST**\n👤 User: `{uid}`\n💰 Amount: ₹{amt}\n🏦 Method: `{method}`\n📝 Details: `{details}`\n🆔 TxID: `{tx_id}`",
         reply_markup=kb_admin,
-        parse_mode="Markdown"
+        parse_mode="Markdown",
+        rate_limit_args=PRIORITY_ADMIN
     )
     
     await update.message.reply_text(
@@ -463,24 +544,26 @@ async def admin_payment_handler(update: Update, context: ContextTypes.DEFAULT_TY
     
     if action == "dep": 
         if decision == "ok":
-            update_wallet_balance(uid, amt)
+            update_wallet_balance(uid, amt, "deposit", tx_id)
+            apply_cash(uid, amt)
             update_transaction_status(tx_id, "completed")
-            await context.bot.send_message(uid, f"✅ **Deposit Approved!**\nAdded: ₹{amt}")
+            await context.bot.send_message(uid, f"✅ **Deposit Approved!**\nAdded: ₹{amt}", rate_limit_args=PRIORITY_ADMIN)
             await q.edit_message_text(f"✅ Approved Deposit ₹{amt} for {uid}")
         else:
             update_transaction_status(tx_id, "rejected")
-            await context.bot.send_message(uid, f"❌ **Deposit Rejected.**\nAmount: ₹{amt}")
+            await context.bot.send_message(uid, f"❌ **Deposit Rejected.**\nAmount: ₹{amt}", rate_limit_args=PRIORITY_ADMIN)
             await q.edit_message_text(f"❌ Rejected Deposit for {uid}")
             
     elif action == "wd":
         if decision == "ok":
             update_transaction_status(tx_id, "completed")
-            await context.bot.send_message(uid, f"✅ **Withdrawal Sent!**\nAmount: ₹{amt}")
+            await context.bot.send_message(uid, f"✅ **Withdrawal Sent!**\nAmount: ₹{amt}", rate_limit_args=PRIORITY_ADMIN)
             await q.edit_message_text(f"✅ Marked Withdraw ₹{amt} as SENT.")
         else:
-            update_wallet_balance(uid, amt) # Refund
+            update_wallet_balance(uid, amt, "refund", tx_id)
+            apply_cash(uid, amt)
             update_transaction_status(tx_id, "rejected")
-            await context.bot.send_message(uid, f"❌ **Withdrawal Rejected.**\nRefunded: ₹{amt}")
+            await context.bot.send_message(uid, f"❌ **Withdrawal Rejected.**\nRefunded: ₹{amt}", rate_limit_args=PRIORITY_ADMIN)
             await q.edit_message_text(f"❌ Rejected Withdraw. Refunded {uid}.")
 
 # ==========================================
@@ -493,40 +576,70 @@ async def token_rig_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         sym = context.args[0].upper()
         price = float(context.args[1])
         update_token_price(sym, price)
+        on_price_tick(sym, price)
+        await process_ticks(context.bot, {sym: price})
         await update.message.reply_text(f"✅ **Rigged:** {sym} set to ₹{price}")
     except:
         await update.message.reply_text("❌ Usage: `/token_rig SYMBOL PRICE`")
 
-async def token_roi_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+async def wallet_adjust_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
+    try:
+        uid = int(context.args[0])
+        amt = float(context.args[1])
+    except:
+        await update.message.reply_text("❌ Usage: `/wallet_adjust USER_ID AMOUNT`", parse_mode="Markdown")
+        return
+    wallet = update_wallet_balance(uid, amt, "admin_adjust", f"admin:{ADMIN_ID}")
+    if not wallet:
+        await update.message.reply_text("❌ User not found.")
+        return
+    apply_cash(uid, amt)
+    await update.message.reply_text(f"✅ **Adjusted** `{uid}` by ₹{amt:+.2f}\nNew Balance: ₹{wallet['balance']:.2f}", parse_mode="Markdown")
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Replays the ledger (latest snapshot + tail), compares it with the live wallet and checks every entry's legs net to zero."""
     if update.effective_user.id != ADMIN_ID: return
-    await update.message.reply_text("⏳ **Calculating ROI...**")
+    try: uid = int(context.args[0])
+    except:
+        await update.message.reply_text("❌ Usage: `/audit USER_ID`", parse_mode="Markdown")
+        return
     
-    tokens = get_all_tokens()
-    price_map = {t['symbol']: t['price'] for t in tokens}
-    roi_data = []
+    rebuilt = await asyncio.to_thread(rebuild_wallet_from_ledger, uid)
+    if not rebuilt:
+        await update.message.reply_text("📒 No ledger history for this user.")
+        return
+    unbalanced = await asyncio.to_thread(ledger_imbalances, uid)
+    wallet = get_user_wallet(uid)
+    live_hold = {s: q for s, q in wallet.get("holdings", {}).items() if q}
+    led_hold = {s: q for s, q in rebuilt["holdings"].items() if q}
+    ok = abs(wallet.get("balance", 0) - rebuilt["balance"]) < 0.01 and live_hold == led_hold and not unbalanced
+    
+    msg = (f"📒 **LEDGER AUDIT** `{uid}`\n━━━━━━━━━━━━━━\n"
+           f"Seq: {rebuilt['seq']} (replayed {rebuilt['replayed']})\n"
+           f"Ledger Balance: ₹{rebuilt['balance']:.2f}\n"
+           f"Live Balance: ₹{wallet.get('balance', 0):.2f}\n"
+           f"Unbalanced Entries: {len(unbalanced)}" + (f" (#{', #'.join(map(str, unbalanced[:5]))})" if unbalanced else "") + "\n"
+           f"{'✅ Balanced' if ok else '⚠️ MISMATCH'}\n\n**Recent:**\n")
+    for e in get_ledger_entries(uid, max(0, rebuilt["seq"] - 5), 5):
+        bal, hold = ledger_wallet_delta(e)
+        hold = " ".join(f"{q:+g} {s}" for s, q in hold.items())
+        msg += f"`#{e['seq']} {e['type']}` ₹{bal:+.2f} {hold}\n"
+    await update.message.reply_text(msg, parse_mode="Markdown")
+
+async def token_roi_list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_ID: return
     
-    all_users = users_collection.find()
+    # Aggregation runs server-side; cached briefly & kept off the event loop
+    now = time.time()
+    if now - _roi_cache["ts"] > ROI_CACHE_TTL:
+        _roi_cache["rows"] = await asyncio.to_thread(get_roi_leaderboard, 10)
+        _roi_cache["ts"] = now
     
-    for u in all_users:
-        wallet = u.get('wallet', {})
-        holdings = wallet.get('holdings', {})
-        invested = wallet.get('invested_amt', {})
-        total_current_val = 0
-        total_invested_val = 0
-        
-        for sym, qty in holdings.items():
-            if qty > 0:
-                curr_p = price_map.get(sym, 0)
-                total_current_val += qty * curr_p
-                total_invested_val += invested.get(sym, 0)
-                
-        if total_invested_val > 0:
-            roi_pct = ((total_current_val - total_invested_val) / total_invested_val) * 100
-            roi_data.append({"uid": u['user_id'], "roi": roi_pct})
-            
-    roi_data.sort(key=lambda x: x['roi'], reverse=True)
     msg = "🏆 **TOKEN ROI LEADERBOARD**\n━━━━━━━━━━━━━━\n"
-    for i, d in enumerate(roi_data[:10]):
+    for i, d in enumerate(_roi_cache["rows"]):
         msg += f"{i+1}. User `{d['uid']}`: **{d['roi']:.1f}%**\n"
+    if not _roi_cache["rows"]: msg += "No data found.\n"
+    msg += f"\n_Updated {int(now - _roi_cache['ts'])}s ago_"
         
     await update.message.reply_text(msg, parse_mode="Markdown")
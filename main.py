@@ -1,6 +1,7 @@
 import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, filters, ConversationHandler
+import time
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler, filters, ConversationHandler
 
 # Import Config & DB
 from config import (
@@ -8,11 +9,12 @@ from config import (
     SELECTING_PLAN, WAITING_FOR_PAYMENT_PROOF, WAITING_FOR_UTR, 
     TARGET_START_MENU, TARGET_SELECT_GAME, TARGET_GAME_LOOP, 
     SURESHOT_MENU, SURESHOT_LOOP, ADMIN_BROADCAST_MSG, 
-    ADMIN_GIFT_WAIT, LANGUAGES, SELECTING_PLATFORM
+    ADMIN_GIFT_WAIT, LANGUAGES, SELECTING_PLATFORM, VALUATION_SNAPSHOT_INTERVAL,
+    MARKET_TICK_INTERVAL, ACTIVITY_TOUCH_INTERVAL, V5_TABLE_REFRESH, MARKOV_PERSIST_INTERVAL, DRAW_ARCHIVE_INTERVAL
 )
 from database import (
     get_user_data, update_user_field, is_subscription_active, 
-    get_settings, redeem_gift_code
+    get_settings, redeem_gift_code, touch_last_active
 )
 
 # Import Handlers
@@ -20,10 +22,13 @@ from handlers_users import stats_command, switch_command, set_mode, reset_comman
 from handlers_game import select_platform, select_game_type, start_game_flow, handle_feedback
 from handlers_shop import packs_command, shop_callback, start_buy, confirm_sent, receive_utr, admin_action, target_command, target_resume, start_target_game, target_loop
 from handlers_sureshot import sureshot_command, sureshot_start, sureshot_refresh, sureshot_outcome
+from handlers_numbershot import numbershot_command, numbershot_show
 from handlers_admin import (
     admin_command, admin_callback, admin_broadcast_entry, 
     admin_send_broadcast, cancel_broadcast, admin_referral_stats_command, 
-    ban_user_command, unban_user_command, gift_generation
+    ban_user_command, unban_user_command, gift_generation, reconcile_statement_upload,
+    admin_queue_callback, pending_queue_command, broadcast_stop_callback, outbox_command,
+    patterns_command, engines_command
 )
 
 # NEW WALLET HANDLERS
@@ -34,12 +39,32 @@ from handlers_wallet import (
     start_deposit, select_deposit_amount, show_qr_code, ask_utr, receive_utr as receive_dep_utr,
     start_withdraw, select_withdraw_method, ask_withdraw_details, process_withdrawal,
     DEP_AMOUNT, DEP_METHOD, DEP_UTR, WD_AMOUNT, WD_METHOD, WD_DETAILS, TRADE_AMOUNT,
-    token_rig_command, token_roi_list_command
+    token_rig_command, token_roi_list_command, wallet_adjust_command, audit_command,
+    ask_order, place_order_input, orders_command, cancel_order_callback, market_tick_job, ORDER_INPUT
 )
+from portfolio_engine import valuation_snapshot_job
+from broadcast_engine import resume_broadcasts_job
+from outbound_scheduler import PriorityRateLimiter
+from v5_table import refresh_job as v5_table_job
+from markov_engine import persist_job as markov_persist_job, warm_job as markov_warm_job
+from navigation import show_screen
+from prediction_engine import archive_job as draw_archive_job
+from target_engine import migrate_sessions_job
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# --- ACTIVITY TRACKING (feeds the "inactive" broadcast segment) ---
+_last_touch = {}  # user_id -> last time last_active was written
+
+async def track_activity(update: Update, context):
+    user = update.effective_user
+    if not user: return
+    now = time.time()
+    if now - _last_touch.get(user.id, 0) < ACTIVITY_TOUCH_INTERVAL: return
+    _last_touch[user.id] = now
+    touch_last_active(user.id, now)
+
 # --- LANGUAGE & STARTUP ---
 async def set_language(update: Update, context):
     q = update.callback_query
@@ -55,6 +80,8 @@ async def start_command(update: Update, context, edit_mode=False):
     if ud.get("is_banned"):
         await update.message.reply_text("🚫 **Access Denied.**\nYou are banned.")
         return ConversationHandler.END
+    if ud.get("is_blocked_bot"):
+        update_user_field(uid, "is_blocked_bot", False)  # reachable again -> back in broadcasts
 
     if get_settings().get("maintenance_mode") and uid != ADMIN_ID: 
         await update.message.reply_text("🛠 **Maintenance Mode**\nBot is currently under update.")
@@ -88,7 +115,7 @@ async def start_command(update: Update, context, edit_mode=False):
     ])
     
     if update.callback_query:
-        await update.callback_query.edit_message_text(msg, reply_markup=kb, parse_mode="Markdown")
+        await show_screen(update.callback_query, msg, kb)
     else:
         await update.message.reply_text(msg, reply_markup=kb, parse_mode="Markdown")
         
@@ -112,7 +139,21 @@ async def cc_command(update: Update, context):
     await update.message.reply_text(f"💬 **Support:**\nContact @{ADMIN_ID} (Admin)")
 
 def main():
-    app = Application.builder().token(BOT_TOKEN).build()
+    # All outbound API calls pass through one priority scheduler (rate limits + 429 retries)
+    app = Application.builder().token(BOT_TOKEN).rate_limiter(PriorityRateLimiter()).build()
+
+    # 0. BACKGROUND JOBS
+    app.job_queue.run_repeating(valuation_snapshot_job, interval=VALUATION_SNAPSHOT_INTERVAL, first=VALUATION_SNAPSHOT_INTERVAL)
+    app.job_queue.run_repeating(market_tick_job, interval=MARKET_TICK_INTERVAL, first=MARKET_TICK_INTERVAL)
+    app.job_queue.run_once(resume_broadcasts_job, 5)
+    app.job_queue.run_once(migrate_sessions_job, 1)
+    app.job_queue.run_repeating(v5_table_job, interval=V5_TABLE_REFRESH, first=30)
+    app.job_queue.run_once(markov_warm_job, 2)
+    app.job_queue.run_repeating(draw_archive_job, interval=DRAW_ARCHIVE_INTERVAL, first=DRAW_ARCHIVE_INTERVAL)
+    app.job_queue.run_repeating(markov_persist_job, interval=MARKOV_PERSIST_INTERVAL, first=MARKOV_PERSIST_INTERVAL)
+    
+    # Runs before every other handler (group -1) and never blocks them
+    app.add_handler(TypeHandler(Update, track_activity), group=-1)
     
     # 1. COMMANDS
     app.add_handler(CommandHandler("start", start_command))
@@ -120,16 +161,27 @@ def main():
     app.add_handler(CommandHandler("redeem", redeem_command))
     app.add_handler(CommandHandler("ban", ban_user_command))
     app.add_handler(CommandHandler("unban", unban_user_command))
+    app.add_handler(MessageHandler(filters.Document.FileExtension("csv") & filters.User(ADMIN_ID), reconcile_statement_upload))
+    app.add_handler(CommandHandler("pending", pending_queue_command))
+    app.add_handler(CommandHandler("outbox", outbox_command))
+    app.add_handler(CommandHandler("patterns", patterns_command))
+    app.add_handler(CommandHandler("engines", engines_command))
+    app.add_handler(CallbackQueryHandler(admin_queue_callback, pattern="^adq_"))
+    app.add_handler(CallbackQueryHandler(broadcast_stop_callback, pattern="^bc_stop_"))
     app.add_handler(CommandHandler("stats", stats_command)) 
     app.add_handler(CommandHandler("packs", packs_command))
     app.add_handler(CommandHandler("invite", invite_command))
     app.add_handler(CommandHandler("reset", reset_command))
     app.add_handler(CommandHandler("sureshot", sureshot_command))
+    app.add_handler(CommandHandler("numbershot", numbershot_command))
     
     # Wallet Commands
     app.add_handler(CommandHandler("wallet", wallet_command))
+    app.add_handler(CommandHandler("orders", orders_command))
     app.add_handler(CommandHandler("token_rig", token_rig_command))
     app.add_handler(CommandHandler("token_roi_list", token_roi_list_command))
+    app.add_handler(CommandHandler("wallet_adjust", wallet_adjust_command))
+    app.add_handler(CommandHandler("audit", audit_command))
     
     # 2. GLOBAL HANDLERS
     app.add_handler(CallbackQueryHandler(set_language, pattern="^lang_"))
@@ -157,6 +209,17 @@ def main():
     )
     app.add_handler(trade_conv)
 
+    # Limit / Stop Order Conversation
+    order_conv = ConversationHandler(
+        entry_points=[CallbackQueryHandler(ask_order, pattern="^ord_new_")],
+        states={
+            ORDER_INPUT: [MessageHandler(filters.TEXT & ~filters.COMMAND, place_order_input)]
+        },
+        fallbacks=[CallbackQueryHandler(view_token_chart, pattern="^view_chart_"), CallbackQueryHandler(wallet_command, pattern="^wallet_main$")],
+        per_user=True
+    )
+    app.add_handler(order_conv)
+
     # Deposit Conversation
     dep_conv = ConversationHandler(
         entry_points=[CallbackQueryHandler(start_deposit, pattern="^start_deposit$")],
@@ -258,12 +321,16 @@ def main():
     # 4. OTHER CALLBACKS (Must be last)
     app.add_handler(CallbackQueryHandler(stats_command, pattern="^my_stats")) 
     app.add_handler(CallbackQueryHandler(set_mode, pattern="^set_mode_"))
+    app.add_handler(CallbackQueryHandler(numbershot_command, pattern="^ns_menu$"))
+    app.add_handler(CallbackQueryHandler(numbershot_show, pattern="^ns_go_"))
     
     # Wallet Standalone Callbacks
     # CHANGE 4: Updated these regex patterns to match the new names in handlers_wallet.py
     app.add_handler(CallbackQueryHandler(wallet_command, pattern="^wallet_main$"))
     app.add_handler(CallbackQueryHandler(tokens_command, pattern="^wallet_tokens$"))
     app.add_handler(CallbackQueryHandler(view_token_chart, pattern="^view_chart_"))
+    app.add_handler(CallbackQueryHandler(orders_command, pattern="^wallet_orders$"))
+    app.add_handler(CallbackQueryHandler(cancel_order_callback, pattern="^ord_cancel_"))
     
     print("--------------------------------------------------")
     print(f"✅ Bot Online (Flexible Buy + Fixes)")
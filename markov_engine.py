@@ -0,0 +1,198 @@
+import asyncio
+import logging
+import numpy as np
+from config import MARKOV_ORDER, MARKOV_NUMBER_ORDER, MARKOV_MIN_COUNT, MARKOV_ALPHA
+from database import load_engine_model, save_engine_model, iter_draws
+
+logger = logging.getLogger(__name__)
+
+# --- V6: ORDER-k MARKOV MODEL (one per feed) ---
+# For every k = 0..MARKOV_ORDER the model counts which side (Small/Big) followed
+# each k-draw context, and for k = 0..MARKOV_NUMBER_ORDER which number (0-9)
+# followed each k-number context. A new draw adds one count per order (O(k)).
+# A pick backs off from the longest context that has at least MARKOV_MIN_COUNT
+# observations and reads the add-alpha smoothed probability straight from the
+# counts. Models are loaded (saved counts, else one bincount per order over the
+# draw archive) off the event loop by warm_job at startup; a feed asked for
+# before its model is ready gets None and is warmed on the next persist_job.
+# Counts are saved periodically (persist_job).
+FEEDS = (("Tiranga", "30s"), ("Tiranga", "1m"), ("TrustWin", "30s"), ("TrustWin", "1m"))
+_models = {}    # (platform, game_type) -> MarkovModel
+_wanted = set(FEEDS)   # feeds to warm
+
+class MarkovModel:
+    def __init__(self, order=MARKOV_ORDER, number_order=MARKOV_NUMBER_ORDER):
+        self.order, self.number_order = order, number_order
+        self.sides = [np.zeros(2 << k, dtype=np.int64) for k in range(order + 1)]       # [ctx * 2 + side]
+        self.numbers = [np.zeros(10 ** (k + 1), dtype=np.int64) for k in range(number_order + 1)]  # [ctx * 10 + n]
+        self.side_ctx = 0      # last `order` sides as bits, newest lowest
+        self.number_ctx = 0    # last `number_order` numbers as base-10 digits, newest lowest
+        self.ctx_len = 0       # draws behind the current contexts (reset when draws are missed)
+        self.seen = 0
+        self.last_period = None
+        self.dirty = False
+
+    # --- UPDATES ---
+    def push(self, period, number):
+        side = 1 if number > 4 else 0
+        for k in range(min(self.ctx_len, self.order) + 1):
+            self.sides[k][(self.side_ctx & ((1 << k) - 1)) * 2 + side] += 1
+        for k in range(min(self.ctx_len, self.number_order) + 1):
+            self.numbers[k][(self.number_ctx % 10 ** k) * 10 + number] += 1
+        self.side_ctx = ((self.side_ctx << 1) | side) & ((1 << self.order) - 1)
+        self.number_ctx = (self.number_ctx * 10 + number) % 10 ** self.number_order
+        self.ctx_len += 1
+        self.seen += 1
+        self.last_period = period
+        self.dirty = True
+
+    def observe(self, history):
+        """
+        Counts the draws of an API history newer than the last one seen. After a
+        gap in the numbering the contexts restart, so no count spans missed draws.
+        """
+        if not history: return
+        last = _as_int(self.last_period)
+        first = _as_int(history[0]['p'])
+        if last is not None and first is not None and first > last + 1:
+            self.side_ctx = self.number_ctx = self.ctx_len = 0
+        for h in history:
+            p = _as_int(h['p'])
+            if p is not None and (last is None or p > last) and 'r' in h:
+                self.push(h['p'], int(h['r']))
+                last = p
+
+    def warm(self, periods, numbers):
+        """
+        Builds all counts from a whole series at once (oldest first), one
+        bincount per order. Contexts never span a gap in the period numbering.
+        """
+        last_period = periods[-1] if len(periods) else None
+        periods = np.asarray([int(p) for p in periods], dtype=np.int64)
+        numbers = np.asarray(numbers, dtype=np.int64)
+        n = len(numbers)
+        # run[i]: consecutive draws right before draw i
+        idx = np.arange(n)
+        starts = np.zeros(n, dtype=np.int64)
+        if n > 1: starts[1:] = np.where(np.diff(periods) != 1, idx[1:], 0)
+        run = idx - np.maximum.accumulate(starts)
+        sides = (numbers > 4).astype(np.int64)
+        for k in range(self.order + 1):
+            if n <= k: break
+            ctx = np.zeros(n - k, dtype=np.int64)
+            for j in range(1, k + 1):   # side j draws back sits at bit j-1
+                ctx |= sides[k - j:n - j] << (j - 1)
+            keys = (ctx * 2 + sides[k:])[run[k:] >= k]
+            self.sides[k] = np.bincount(keys, minlength=2 << k).astype(np.int64)
+        for k in range(self.number_order + 1):
+            if n <= k: break
+            ctx = np.zeros(n - k, dtype=np.int64)
+            for j in range(1, k + 1):
+                ctx += numbers[k - j:n - j] * 10 ** (j - 1)
+            keys = (ctx * 10 + numbers[k:])[run[k:] >= k]
+            self.numbers[k] = np.bincount(keys, minlength=10 ** (k + 1)).astype(np.int64)
+        self.ctx_len = int(run[-1]) + 1 if n else 0
+        self.side_ctx = self.number_ctx = 0
+        for x in numbers[n - min(self.ctx_len, max(self.order, self.number_order)):]:
+            self.side_ctx = ((self.side_ctx << 1) | int(x > 4)) & ((1 << self.order) - 1)
+            self.number_ctx = (self.number_ctx * 10 + int(x)) % 10 ** self.number_order
+        self.seen = n
+        self.last_period = last_period
+        self.dirty = n > 0
+
+    # --- PREDICTIONS (table lookups) ---
+    def predict(self):
+        """(side, order used, probability of that side), or (None, None, 0.5) while cold."""
+        for k in range(min(self.ctx_len, self.order), -1, -1):
+            base = (self.side_ctx & ((1 << k) - 1)) * 2
+            small, big = self.sides[k][base], self.sides[k][base + 1]
+            if small + big >= MARKOV_MIN_COUNT:
+                p_big = float((big + MARKOV_ALPHA) / (small + big + 2 * MARKOV_ALPHA))
+                return ("Big", k, p_big) if p_big >= 0.5 else ("Small", k, 1 - p_big)
+        return None, None, 0.5
+
+    def number_probs(self):
+        """P(next number = 0..9) from the longest number context with enough data."""
+        for k in range(min(self.ctx_len, self.number_order), -1, -1):
+            base = (self.number_ctx % 10 ** k) * 10
+            row = self.numbers[k][base:base + 10]
+            if row.sum() >= MARKOV_MIN_COUNT:
+                return (row + MARKOV_ALPHA) / (row.sum() + 10 * MARKOV_ALPHA)
+        return np.full(10, 0.1)
+
+    # --- PERSISTENCE ---
+    def to_doc(self):
+        return {
+            "order": self.order, "number_order": self.number_order,
+            "sides": np.concatenate(self.sides).tobytes(), "numbers": np.concatenate(self.numbers).tobytes(),
+            "side_ctx": self.side_ctx, "number_ctx": self.number_ctx, "ctx_len": self.ctx_len, "seen": self.seen, "last_period": self.last_period,
+        }
+
+    @classmethod
+    def from_doc(cls, doc):
+        m = cls(doc["order"], doc["number_order"])
+        flat = np.frombuffer(doc["sides"], dtype=np.int64)
+        for k, a in enumerate(m.sides):
+            start = (2 << k) - 2
+            m.sides[k] = flat[start:start + len(a)].copy()
+        flat, start = np.frombuffer(doc["numbers"], dtype=np.int64), 0
+        for k, a in enumerate(m.numbers):
+            m.numbers[k] = flat[start:start + len(a)].copy()
+            start += len(a)
+        m.side_ctx, m.number_ctx, m.ctx_len = doc["side_ctx"], doc["number_ctx"], doc["ctx_len"]
+        m.seen, m.last_period = doc["seen"], doc["last_period"]
+        return m
+
+def _as_int(period):
+    try: return int(period)
+    except (TypeError, ValueError): return None
+
+def _model_key(platform, game_type):
+    return f"markov:{platform}:{game_type}"
+
+def feed_model(platform, game_type):
+    """The feed's model, or None while it is not warmed yet (never blocks)."""
+    model = _models.get((platform, game_type))
+    if model is None: _wanted.add((platform, game_type))
+    return model
+
+def load_model(platform, game_type):
+    """Saved counts, else a model warmed from the draw archive (blocking: run in a thread)."""
+    doc = load_engine_model(_model_key(platform, game_type))
+    if doc and doc.get("order") == MARKOV_ORDER and doc.get("number_order") == MARKOV_NUMBER_ORDER:
+        model = MarkovModel.from_doc(doc)
+    else:
+        model = MarkovModel()
+        draws = list(iter_draws(platform, game_type))
+        if draws:
+            model.warm([p for p, _ in draws], np.fromiter((r for _, r in draws), dtype=np.int64, count=len(draws)))
+            logger.info(f"V6 model for {platform} {game_type} warmed from {len(draws)} archived draws")
+    return model
+
+async def warm_job(context):
+    """JobQueue callback: loads the models of wanted feeds in a thread; only the loop thread publishes them."""
+    for key in list(_wanted - set(_models)):
+        try:
+            model = await asyncio.to_thread(load_model, *key)
+        except Exception as e:
+            logger.error(f"V6 warm-up failed for {key}: {e}")
+            continue
+        # Draws observed meanwhile are picked up again from the next API history
+        _models.setdefault(key, model)
+        _wanted.discard(key)
+
+def save_docs(docs):
+    for key, doc in docs:
+        save_engine_model(key, doc)
+
+async def persist_job(context):
+    """JobQueue callback: saves models that learned new draws and warms feeds still waiting."""
+    # Snapshot the counts on the loop thread, where observe() runs, so the
+    # thread never reads arrays that are being updated
+    docs = []
+    for (platform, game_type), model in list(_models.items()):
+        if model.dirty:
+            model.dirty = False
+            docs.append((_model_key(platform, game_type), model.to_doc()))
+    if docs: await asyncio.to_thread(save_docs, docs)
+    await warm_job(context)
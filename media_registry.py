@@ -0,0 +1,93 @@
+import hashlib
+import logging
+from collections import OrderedDict
+from telegram.error import BadRequest
+from database import get_media_file_id, save_media_file_id, delete_media_file_id
+
+logger = logging.getLogger(__name__)
+
+# Telegram keeps every uploaded photo on its servers and hands back a file_id.
+# Re-sending that file_id costs no upload and no external fetch, so each
+# distinct image is uploaded exactly once (first send) and reused afterwards.
+MAX_MEMORY_ENTRIES = 512
+_file_ids = OrderedDict()
+
+def media_key(*parts) -> str:
+    """
+    Content hash used as the registry key.
+    - bytes: hashed as-is (rendered images).
+    - URL: query string dropped, so expiring CDN params (ex=/hm=) map to one key.
+    - anything else: hashed via repr (e.g. the symbol + history a chart is drawn from).
+    """
+    h = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, (bytes, bytearray)):
+            h.update(part)
+        elif isinstance(part, str) and part.startswith("http"):
+            h.update(part.split("?", 1)[0].encode("utf-8"))
+        else:
+            h.update(repr(part).encode("utf-8"))
+        h.update(b"\x00")
+    return h.hexdigest()
+
+def lookup_file_id(key):
+    """Memory first, then Mongo (result is promoted into memory)."""
+    file_id = _file_ids.get(key)
+    if file_id:
+        _file_ids.move_to_end(key)
+        return file_id
+    file_id = get_media_file_id(key)
+    if file_id: _remember_local(key, file_id)
+    return file_id
+
+def remember_file_id(key, file_id):
+    _remember_local(key, file_id)
+    save_media_file_id(key, file_id)
+
+def forget_file_id(key):
+    _file_ids.pop(key, None)
+    delete_media_file_id(key)
+
+def _remember_local(key, file_id):
+    _file_ids[key] = file_id
+    _file_ids.move_to_end(key)
+    while len(_file_ids) > MAX_MEMORY_ENTRIES:
+        _file_ids.popitem(last=False)
+
+# Only these errors mean the cached file_id itself is dead; anything else
+# (caption parse errors, chat not found, ...) must not evict the entry.
+STALE_FILE_ID_ERRORS = ("wrong file identifier", "wrong remote file", "wrong file_id", "invalid file_id", "file reference expired")
+
+def is_stale_file_id(error) -> bool:
+    msg = str(error).lower()
+    return any(s in msg for s in STALE_FILE_ID_ERRORS)
+
+def file_id_from_message(message):
+    if message and message.photo:
+        return message.photo[-1].file_id
+    return None
+
+async def send_cached_photo(bot, chat_id, key, source, **kwargs):
+    """
+    Sends a photo by its cached file_id; uploads `source` only on a cache miss.
+    `source` may be a URL, a file-like buffer, or a zero-arg callable that builds
+    one (so charts are only rendered when they were never uploaded before).
+    Returns the sent Message, or None if there was nothing to upload.
+    """
+    file_id = lookup_file_id(key)
+    if file_id:
+        try:
+            return await bot.send_photo(chat_id=chat_id, photo=file_id, **kwargs)
+        except BadRequest as e:
+            if not is_stale_file_id(e): raise
+            # file_id no longer valid (e.g. bot token changed) -> re-upload
+            logger.warning(f"Stale file_id for {key[:12]}: {e}")
+            forget_file_id(key)
+
+    if callable(source): source = source()
+    if source is None: return None
+
+    msg = await bot.send_photo(chat_id=chat_id, photo=source, **kwargs)
+    new_id = file_id_from_message(msg)
+    if new_id: remember_file_id(key, new_id)
+    return msg
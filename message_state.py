@@ -0,0 +1,93 @@
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from telegram import CallbackQuery
+from telegram.error import BadRequest
+from config import EDIT_COALESCE_WINDOW
+
+logger = logging.getLogger(__name__)
+
+# --- MESSAGE STATE REGISTRY ---
+# Remembers, per (chat_id, message_id), a hash of the last text + keyboard the
+# bot rendered and the edit_date Telegram reported for it. An edit that would
+# render the same thing again is skipped (no API call, no "message is not
+# modified" error). The hash is only trusted while the message a callback
+# carries still has our edit_date, so edits made elsewhere are never masked.
+MAX_TRACKED_MESSAGES = 5000
+_states = OrderedDict()
+stats = {"edits": 0, "skipped": 0, "coalesced": 0}
+
+class _State:
+    __slots__ = ("digest", "edit_date", "edited_at", "seq")
+
+    def __init__(self):
+        self.digest = None
+        self.edit_date = None
+        self.edited_at = 0.0
+        self.seq = 0
+
+def render_hash(text, reply_markup=None, parse_mode=None) -> str:
+    h = hashlib.sha1(text.encode("utf-8"))
+    h.update(b"\x00" + (reply_markup.to_json().encode("utf-8") if reply_markup else b""))
+    h.update(b"\x00" + (parse_mode or "").encode("utf-8"))
+    return h.hexdigest()
+
+def _message_of(target):
+    return target.message if isinstance(target, CallbackQuery) else target
+
+def _state_for(key):
+    st = _states.get(key)
+    if st is None:
+        st = _states[key] = _State()
+        while len(_states) > MAX_TRACKED_MESSAGES:
+            _states.popitem(last=False)
+    else:
+        _states.move_to_end(key)
+    return st
+
+async def edit_if_changed(target, text, reply_markup=None, parse_mode=None):
+    """
+    Edits a message's text unless it already shows exactly this render.
+    `target` is a CallbackQuery (its message is edited) or a Message.
+    Calls arriving within EDIT_COALESCE_WINDOW of the last edit wait out the
+    window and only the newest one is sent. Returns True if an edit was made.
+    """
+    message = _message_of(target)
+    if message is None:  # inline message: nothing to key on
+        await target.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        stats["edits"] += 1
+        return True
+
+    st = _state_for((message.chat_id, message.message_id))
+    st.seq += 1
+    my_seq = st.seq
+    wait = st.edited_at + EDIT_COALESCE_WINDOW - time.monotonic()
+    if wait > 0:
+        await asyncio.sleep(wait)
+        if st.seq != my_seq:  # a newer render for this message superseded us
+            stats["coalesced"] += 1
+            return False
+
+    digest = render_hash(text, reply_markup, parse_mode)
+    if st.digest == digest and message.edit_date == st.edit_date:
+        stats["skipped"] += 1
+        return False
+
+    st.edited_at = time.monotonic()
+    try:
+        if isinstance(target, CallbackQuery):
+            result = await target.edit_message_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+        else:
+            result = await target.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
+    except BadRequest as e:
+        if "not modified" not in str(e).lower(): raise
+        # Already showing this render (e.g. state was lost on restart)
+        st.digest, st.edit_date = digest, message.edit_date
+        stats["skipped"] += 1
+        return False
+    st.digest = digest
+    st.edit_date = getattr(result, "edit_date", None)
+    stats["edits"] += 1
+    return True
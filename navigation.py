@@ -0,0 +1,67 @@
+import logging
+from telegram import InputMediaPhoto
+from telegram.error import BadRequest
+from media_registry import lookup_file_id, remember_file_id, forget_file_id, file_id_from_message, send_cached_photo, is_stale_file_id
+from message_state import edit_if_changed
+
+logger = logging.getLogger(__name__)
+
+# --- SCREEN TRANSITIONS ---
+# Moving a callback's message to the next screen costs one API call whenever
+# Telegram can edit in place:
+#   text  -> text  : editMessageText
+#   photo -> photo : editMessageMedia (cached file_id, upload only on a miss)
+#   photo -> text  : a new text message, then the photo is deleted, so later
+#                    screens are plain text again (editMessageText works on them)
+#   text  -> photo : no such edit exists, so the photo is sent first and the
+#                    old message deleted afterwards (no blank gap in between)
+
+async def show_screen(q, text, reply_markup=None, parse_mode="Markdown", photo=None):
+    """
+    Shows `text` (+ keyboard) in place of the message `q` was pressed on.
+    `photo` is an optional (media_key, source) pair, as for send_cached_photo.
+    Returns the shown Message, or None if the photo could not be produced.
+    """
+    message = q.message
+    if photo is None:
+        if not message.photo:
+            await edit_if_changed(q, text, reply_markup=reply_markup, parse_mode=parse_mode)
+            return message
+        sent = await q.get_bot().send_message(message.chat_id, text, reply_markup=reply_markup, parse_mode=parse_mode)
+        await _delete(message)
+        return sent
+
+    key, source = photo
+    if message.photo:
+        return await _edit_photo(q, key, source, text, reply_markup, parse_mode)
+    sent = await send_cached_photo(q.get_bot(), message.chat_id, key, source, caption=text, reply_markup=reply_markup, parse_mode=parse_mode)
+    if sent: await _delete(message)
+    return sent
+
+async def _edit_photo(q, key, source, caption, reply_markup, parse_mode):
+    file_id = lookup_file_id(key)
+    while True:
+        media = file_id
+        if not media:
+            media = source() if callable(source) else source
+            if media is None: return None
+        try:
+            result = await q.edit_message_media(InputMediaPhoto(media, caption=caption, parse_mode=parse_mode), reply_markup=reply_markup)
+        except BadRequest as e:
+            if "not modified" in str(e).lower(): return q.message
+            if not file_id or not is_stale_file_id(e): raise
+            # file_id no longer valid (e.g. bot token changed) -> re-upload
+            logger.warning(f"Stale file_id for {key[:12]}: {e}")
+            forget_file_id(key)
+            file_id = None
+            continue
+        if not file_id:
+            new_id = file_id_from_message(result if result is not True else None)
+            if new_id: remember_file_id(key, new_id)
+        return result
+
+async def _delete(message):
+    try:
+        await message.delete()
+    except BadRequest as e:
+        logger.debug(f"Old screen not deleted: {e}")
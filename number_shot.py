@@ -0,0 +1,105 @@
+from config import NUMBER_SHOT_WINDOW, NUMBER_SHOT_WEIGHTS, NUMBER_SHOT_MIN_HISTORY, NUMBER_SHOT_ALPHA
+
+# --- NUMBER SHOT: EXACT-NUMBER STATS (one per feed) ---
+# Updated once per new draw, never by rescanning:
+#   counts       how often each number 0-9 came in the last NUMBER_SHOT_WINDOW draws (rolling)
+#   last_seen    draw index at which each number last came (gap = seen - last_seen)
+#   pairs        pairs[a * 10 + b]: how often b followed a; row_totals[a] = sum of row a
+# A pick blends the three signals for all ten numbers, so it is O(10) however
+# much history has been tracked.
+NUMBERS = range(10)
+
+class NumberStats:
+    __slots__ = ("window", "seen", "last", "last_period", "counts", "last_seen", "pairs", "row_totals", "_ring", "_pos")
+
+    def __init__(self, window=NUMBER_SHOT_WINDOW):
+        self.window = window
+        self._ring = bytearray(window)     # last `window` numbers
+        self.pairs = [0] * 100
+        self.row_totals = [0] * 10
+        self.reset()
+
+    def reset(self):
+        """Forgets the recent draws (window, gaps); pair counts are kept."""
+        self.seen = 0
+        self.last = None
+        self.last_period = None
+        self.counts = [0] * 10
+        self.last_seen = [None] * 10
+        self._pos = 0
+
+    def push(self, period, number):
+        if self.seen >= self.window: self.counts[self._ring[self._pos]] -= 1
+        self.counts[number] += 1
+        self._ring[self._pos] = number
+        self._pos = (self._pos + 1) % self.window
+        if self.last is not None:
+            self.pairs[self.last * 10 + number] += 1
+            self.row_totals[self.last] += 1
+        self.last_seen[number] = self.seen
+        self.last = number
+        self.seen += 1
+        self.last_period = period
+
+    def observe(self, history):
+        """
+        Ingests the draws of an API history ({'p', 'r'} items, oldest first) newer
+        than the last one seen. After a gap in the numbering the window and gaps
+        restart from this history. Returns True when now at the history's last draw.
+        """
+        if not history: return False
+        last = _as_int(self.last_period)
+        first = _as_int(history[0]['p'])
+        if last is not None and first is not None and first > last + 1:
+            self.reset()
+            last = None
+        for h in history:
+            p = _as_int(h['p'])
+            if (last is None or (p is not None and p > last)) and 'r' in h:
+                self.push(h['p'], int(h['r']))
+                last = p
+        return str(self.last_period) == str(history[-1]['p'])
+
+    # --- QUERIES (O(10)) ---
+    def gap(self, number):
+        seen_at = self.last_seen[number]
+        return self.seen - seen_at if seen_at is not None else self.seen + 1
+
+    def probabilities(self):
+        """P(next = 0..9): weighted blend of window frequency, pair transition and gap."""
+        w_freq, w_pair, w_gap = NUMBER_SHOT_WEIGHTS
+        a = NUMBER_SHOT_ALPHA
+        n = min(self.seen, self.window)
+        freq = [(self.counts[x] + a) / (n + 10 * a) for x in NUMBERS]
+        if self.last is None:
+            pair = [0.1] * 10
+        else:
+            row, total = self.last * 10, self.row_totals[self.last]
+            pair = [(self.pairs[row + x] + a) / (total + 10 * a) for x in NUMBERS]
+        gaps = [self.gap(x) for x in NUMBERS]
+        gap_total = sum(gaps)
+        gap = [g / gap_total for g in gaps] if gap_total else [0.1] * 10
+        return [w_freq * freq[x] + w_pair * pair[x] + w_gap * gap[x] for x in NUMBERS]
+
+    def top(self, k=3, outcome=None):
+        """The k likeliest numbers as (number, probability); outcome 'Big'/'Small' limits them to that side."""
+        probs = self.probabilities()
+        pool = [x for x in NUMBERS if outcome is None or (x > 4) == (outcome == "Big")]
+        total = sum(probs[x] for x in pool)
+        ranked = sorted(pool, key=lambda x: probs[x], reverse=True)[:k]
+        return [(x, probs[x] / total) for x in ranked]
+
+    def ready(self):
+        return self.seen >= NUMBER_SHOT_MIN_HISTORY
+
+def _as_int(period):
+    try: return int(period)
+    except (TypeError, ValueError): return None
+
+_stats = {}
+
+def feed_stats(platform, game_type):
+    stats = _stats.get((platform, game_type))
+    if stats is None:
+        stats = _stats[(platform, game_type)] = NumberStats()
+    return stats
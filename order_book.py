@@ -0,0 +1,83 @@
+import heapq
+import logging
+import itertools
+from collections import defaultdict
+from database import ORDER_KINDS, get_open_orders, settle_orders
+from portfolio_engine import apply_trade, apply_cash
+from outbound_scheduler import PRIORITY_PUSH
+
+logger = logging.getLogger(__name__)
+
+# --- PER-SYMBOL TRIGGER INDEX ---
+# "le" orders fire when price <= trigger (Limit Buy, Stop Loss)  -> max-heap on trigger
+# "ge" orders fire when price >= trigger (Limit Sell, Stop Buy)  -> min-heap on trigger
+# A tick only pops the orders that cross, O(k log n); cancelled orders are
+# dropped lazily when they surface at the top of a heap.
+_books = defaultdict(lambda: {"le": [], "ge": []})
+_open = {}                     # order_id -> order (open orders only)
+_seq = itertools.count()
+_loaded = False
+
+def _ensure_loaded():
+    global _loaded
+    if _loaded: return
+    _loaded = True
+    for o in get_open_orders():
+        add_order(o)
+    logger.info(f"📒 Order book loaded: {len(_open)} open orders")
+
+def add_order(order):
+    _ensure_loaded()
+    if order["order_id"] in _open: return
+    _open[order["order_id"]] = order
+    book = _books[order["symbol"]]
+    if ORDER_KINDS[order["kind"]]["fires"] == "le":
+        heapq.heappush(book["le"], (-order["trigger"], next(_seq), order["order_id"]))
+    else:
+        heapq.heappush(book["ge"], (order["trigger"], next(_seq), order["order_id"]))
+
+def remove_order(order_id):
+    _open.pop(order_id, None)
+
+def evaluate(symbol, price):
+    """Pops every open order on `symbol` whose trigger is crossed by `price`."""
+    _ensure_loaded()
+    book = _books.get(symbol)
+    if not book: return []
+    fired = []
+    le, ge = book["le"], book["ge"]
+    while le and -le[0][0] >= price:
+        order = _open.pop(heapq.heappop(le)[2], None)
+        if order: fired.append(order)
+    while ge and ge[0][0] <= price:
+        order = _open.pop(heapq.heappop(ge)[2], None)
+        if order: fired.append(order)
+    return fired
+
+async def process_ticks(bot, moved):
+    """Evaluates moved prices {symbol: price}, settles all fills in one batch and notifies owners."""
+    if not moved: return []
+    triggered = []
+    for sym, price in moved.items():
+        for o in evaluate(sym, price):
+            o["fill_price"] = price    # fills at the tick that crossed it
+            triggered.append(o)
+    if not triggered: return []
+
+    filled = settle_orders(triggered)
+    for o in filled:
+        amount = o["quantity"] * o["fill_price"]
+        if o["side"] == "buy": apply_trade(o["user_id"], o["symbol"], o["quantity"], o["quantity"] * o["trigger"] - amount, amount)
+        else: apply_cash(o["user_id"], amount)
+        try:
+            await bot.send_message(
+                o["user_id"],
+                f"✅ **ORDER FILLED**\n"
+                f"{ORDER_KINDS[o['kind']]['name']}: {o['quantity']} {o['symbol']} @ ₹{o['fill_price']:.2f}\n"
+                f"{'➖' if o['side'] == 'buy' else '➕'} ₹{amount:.2f}",
+                parse_mode="Markdown",
+                rate_limit_args=PRIORITY_PUSH
+            )
+        except Exception as e:
+            logger.warning(f"Fill notify failed for {o['user_id']}: {e}")
+    return filled
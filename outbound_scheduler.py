@@ -0,0 +1,156 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from config import OUTBOUND_RATE, OUTBOUND_PRIVATE_CHAT_RATE, OUTBOUND_GROUP_CHAT_RATE, OUTBOUND_MAX_RETRIES
+
+logger = logging.getLogger(__name__)
+
+# --- PRIORITY CLASSES (pass as rate_limit_args=...) ---
+PRIORITY_INTERACTIVE = 0   # replies / edits for the user who just tapped (default)
+PRIORITY_ADMIN = 1         # admin & payment notices
+PRIORITY_PUSH = 2          # unsolicited pushes (order fills, ...)
+PRIORITY_BROADCAST = 3     # mass broadcasts
+PRIORITY_NAMES = {0: "interactive", 1: "admin/payment", 2: "push", 3: "broadcast"}
+
+# Endpoints that count against Telegram's message limits. Everything else
+# (answerCallbackQuery, getFile, getUpdates, ...) bypasses the scheduler.
+LIMITED_ENDPOINTS = {
+    "sendMessage", "sendPhoto", "sendDocument", "sendMediaGroup", "copyMessage", "forwardMessage",
+    "editMessageText", "editMessageCaption", "editMessageMedia", "editMessageReplyMarkup",
+}
+CHAT_BURST = 3
+CHAT_IDLE_EVICT = 600  # seconds before an idle chat bucket is dropped
+
+class PriorityRateLimiter(BaseRateLimiter[int]):
+    """
+    Global outbound scheduler for the bot (Application.builder().rate_limiter(...)).
+
+    Every limited request first waits on its chat's bucket (~1 msg/s private,
+    ~20 msg/min groups), then queues for a global token. Global tokens are handed
+    out in priority order, so an interactive edit overtakes a queued broadcast
+    and waits at most one token interval. RetryAfter pauses all sends for the
+    requested time and the request is retried (up to OUTBOUND_MAX_RETRIES).
+    """
+
+    def __init__(self, rate=OUTBOUND_RATE, private_rate=OUTBOUND_PRIVATE_CHAT_RATE,
+                 group_rate=OUTBOUND_GROUP_CHAT_RATE, max_retries=OUTBOUND_MAX_RETRIES):
+        self.rate = float(rate)
+        self.private_rate = float(private_rate)
+        self.group_rate = float(group_rate)
+        self.max_retries = max_retries
+        self._tokens = self.rate
+        self._updated = time.monotonic()
+        self._held_until = 0.0
+        self._waiters = []                 # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._chats = {}                   # chat_id -> [tokens, updated]
+        self._wake = None
+        self._dispatcher = None
+        self.stats = {p: {"queued": 0, "sent": 0, "retries": 0, "wait_ms": 0.0} for p in PRIORITY_NAMES}
+        self.flood_waits = 0
+
+    async def initialize(self):
+        self._wake = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher:
+            self._dispatcher.cancel()
+            try: await self._dispatcher
+            except asyncio.CancelledError: pass
+        self._dispatcher = None
+        for _, _, fut in self._waiters:
+            if not fut.done(): fut.cancel()
+        self._waiters.clear()
+
+    # --- GLOBAL TOKENS (priority order) ---
+    async def _dispatch(self):
+        while True:
+            if not self._waiters:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            now = time.monotonic()
+            if now < self._held_until:
+                await asyncio.sleep(self._held_until - now)
+                self._updated = time.monotonic()
+                continue
+            self._tokens = min(self.rate, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                continue
+            _, _, fut = heapq.heappop(self._waiters)
+            if fut.done(): continue  # caller gave up (cancelled)
+            self._tokens -= 1
+            fut.set_result(None)
+
+    async def _acquire_global(self, priority):
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), fut))
+        self._wake.set()
+        await fut
+
+    # --- PER-CHAT TOKENS ---
+    async def _acquire_chat(self, chat_id):
+        rate = self.group_rate if chat_id < 0 else self.private_rate
+        while True:
+            now = time.monotonic()
+            bucket = self._chats.get(chat_id)
+            if bucket is None:
+                if len(self._chats) > 10000: self._evict(now)
+                bucket = self._chats[chat_id] = [float(CHAT_BURST), now]
+            bucket[0] = min(CHAT_BURST, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return
+            await asyncio.sleep((1 - bucket[0]) / rate)
+
+    def _evict(self, now):
+        for cid in [c for c, (_, ts) in self._chats.items() if now - ts > CHAT_IDLE_EVICT]:
+            del self._chats[cid]
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint not in LIMITED_ENDPOINTS or self._wake is None:
+            return await callback(*args, **kwargs)
+        priority = rate_limit_args if rate_limit_args in PRIORITY_NAMES else PRIORITY_INTERACTIVE
+        chat_id = data.get("chat_id")
+        st = self.stats[priority]
+
+        for attempt in range(self.max_retries + 1):
+            start = time.monotonic()
+            st["queued"] += 1
+            try:
+                if isinstance(chat_id, int): await self._acquire_chat(chat_id)
+                await self._acquire_global(priority)
+            finally:
+                st["queued"] -= 1
+            # Moving average of the time spent queued
+            st["wait_ms"] = st["wait_ms"] * 0.9 + (time.monotonic() - start) * 100
+            try:
+                result = await callback(*args, **kwargs)
+                st["sent"] += 1
+                return result
+            except RetryAfter as e:
+                wait = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+                self.flood_waits += 1
+                st["retries"] += 1
+                self._held_until = max(self._held_until, time.monotonic() + wait)
+                self._tokens = 0
+                logger.warning(f"429 on {endpoint} (chat {chat_id}): holding sends for {wait}s")
+                if attempt == self.max_retries: raise
+
+    def snapshot(self):
+        """Queue-depth / throughput metrics for /outbox."""
+        return {
+            "classes": {PRIORITY_NAMES[p]: dict(s) for p, s in self.stats.items()},
+            "waiting": len(self._waiters),
+            "held_for": max(0.0, self._held_until - time.monotonic()),
+            "flood_waits": self.flood_waits,
+            "chats_tracked": len(self._chats),
+        }
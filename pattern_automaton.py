@@ -0,0 +1,112 @@
+import re
+from collections import deque
+
+# --- V1 PATTERN AUTOMATON ---
+# All patterns (built-in ALL_PATTERNS + admin-defined) are compiled into one
+# Aho-Corasick automaton over the two-letter alphabet Small/Big. Feeding a draw
+# is one table step, and the patterns that end at the newest draw are read off
+# the output links, so the cost per draw does not grow with the pattern count.
+# A pattern "BBSS" predicts that it repeats (next = its first letter);
+# "BBSS>B" names the continuation explicitly. Weights decide between matches.
+PATTERN_RE = re.compile(r"^([BS]{1,16})(?:>([BS]))?$")
+OUTCOME = {"B": "Big", "S": "Small"}
+
+def parse_pattern(text):
+    """'BBSS' / 'BBSS>B' -> (seq, next outcome), or None if malformed."""
+    m = PATTERN_RE.match(text.strip().upper())
+    if not m: return None
+    seq, nxt = m.groups()
+    return seq, OUTCOME[nxt or seq[0]]
+
+class PatternAutomaton:
+    def __init__(self, patterns):
+        """patterns: iterable of (seq like 'BBSS', next 'Big'/'Small', weight, name)."""
+        self.trans = [[-1, -1]]     # state -> [on Small, on Big]
+        self.out = [[]]             # patterns ending exactly at this state
+        self.out_link = [-1]        # nearest proper suffix state with outputs
+        self.max_len = 0
+        self.size = 0
+        for seq, nxt, weight, name in patterns:
+            s = 0
+            for ch in seq:
+                c = 1 if ch == "B" else 0
+                if self.trans[s][c] == -1:
+                    self.trans[s][c] = len(self.trans)
+                    self.trans.append([-1, -1])
+                    self.out.append([])
+                    self.out_link.append(-1)
+                s = self.trans[s][c]
+            self.out[s].append((nxt, float(weight), name))
+            self.max_len = max(self.max_len, len(seq))
+            self.size += 1
+        self._link()
+
+    def _link(self):
+        # BFS: failure links, completed into a full transition table
+        fail = [0] * len(self.trans)
+        queue = deque()
+        for c in (0, 1):
+            t = self.trans[0][c]
+            if t == -1: self.trans[0][c] = 0
+            else: queue.append(t)
+        while queue:
+            s = queue.popleft()
+            f = fail[s]
+            self.out_link[s] = f if self.out[f] else self.out_link[f]
+            for c in (0, 1):
+                t = self.trans[s][c]
+                if t == -1:
+                    self.trans[s][c] = self.trans[f][c]
+                else:
+                    fail[t] = self.trans[f][c]
+                    queue.append(t)
+
+    def step(self, state, outcome):
+        return self.trans[state][outcome == "Big"]
+
+    def run(self, outcomes, state=0):
+        for o in outcomes: state = self.trans[state][o == "Big"]
+        return state
+
+    def matches(self, state):
+        """(next, weight, name) of every pattern ending at the newest draw."""
+        s = state if self.out[state] else self.out_link[state]
+        while s > 0:
+            yield from self.out[s]
+            s = self.out_link[s]
+
+    def predict(self, state):
+        """(next, name of the heaviest match, confidence = its side's weight share) or (None, None, 0)."""
+        votes = {"Big": 0.0, "Small": 0.0}
+        best = None
+        for m in self.matches(state):
+            votes[m[0]] += m[1]
+            if best is None or m[1] > best[1]: best = m
+        if best is None: return None, None, 0.0
+        side = best[0] if votes["Big"] == votes["Small"] else max(votes, key=votes.get)
+        total = votes["Big"] + votes["Small"]
+        return side, best[2], (votes[side] / total if total else 0.0)
+
+class FeedPatternState:
+    """The automaton state of one feed, advanced once per new draw."""
+    __slots__ = ("automaton", "state", "last_period")
+
+    def __init__(self, automaton):
+        self.automaton, self.state, self.last_period = automaton, 0, None
+
+    def observe(self, history):
+        """Steps through draws newer than the last one seen; True if now at history[-1]."""
+        if not history: return False
+        last = _as_int(self.last_period)
+        if last is not None and (_as_int(history[0]['p']) or 0) > last + 1:
+            self.state, last = 0, None  # draws were missed
+        for h in history:
+            p = _as_int(h['p'])
+            if last is None or (p is not None and p > last):
+                self.state = self.automaton.step(self.state, h['o'])
+                self.last_period, last = h['p'], p
+        return str(self.last_period) == str(history[-1]['p'])
+
+def _as_int(period):
+    try: return int(period)
+    except (TypeError, ValueError): return None
@@ -0,0 +1,179 @@
+import time
+import logging
+from collections import defaultdict, OrderedDict
+from database import get_user_wallet, get_token_prices, save_valuation_snapshots
+from config import PORTFOLIO_CACHE_SIZE, PORTFOLIO_CACHE_TTL
+
+logger = logging.getLogger(__name__)
+
+# --- IN-MEMORY MARKET & PORTFOLIO STATE ---
+# Per-user totals are kept up to date incrementally:
+#   - trades / deposits apply deltas to the one user involved
+#   - a price tick revalues only the holders of that symbol (symbol -> holders index)
+# so reading a user's valuation never loops over tokens or holdings.
+# The cache holds at most PORTFOLIO_CACHE_SIZE users (least recently used are
+# evicted) and a state older than PORTFOLIO_CACHE_TTL is reloaded from the
+# database on its next read, so writes that bypass these hooks heal on their own.
+_prices = {}                  # symbol -> last price
+_names = {}                   # symbol -> display name
+_portfolios = OrderedDict()   # user_id -> state dict (see _build_state), least recently used first
+_holders = defaultdict(set)   # symbol -> user_ids holding qty > 0
+_last_snapshot = {}           # user_id -> (net_worth, cost) at last snapshot
+
+def _ensure_prices():
+    if _prices: return
+    for sym, (name, price) in get_token_prices().items():
+        _prices[sym] = price
+        _names[sym] = name
+
+def get_price(symbol):
+    _ensure_prices()
+    return _prices.get(symbol)
+
+def get_token_name(symbol):
+    _ensure_prices()
+    return _names.get(symbol, symbol)
+
+def _build_state(wallet):
+    holdings = {s: q for s, q in wallet.get("holdings", {}).items() if q > 0}
+    invested = dict(wallet.get("invested_amt", {}))
+    return {
+        "balance": float(wallet.get("balance", 0.0)),
+        "holdings": holdings,
+        "invested": invested,
+        "assets": sum(q * _prices.get(s, 0) for s, q in holdings.items()),
+        "cost": sum(invested.get(s, 0) for s in holdings),
+        "loaded_at": time.monotonic(),
+    }
+
+def load_wallet(user_id, wallet):
+    """(Re)builds a user's state from a wallet document, e.g. a post-trade wallet."""
+    _ensure_prices()
+    old = _portfolios.get(user_id)
+    if old:
+        for sym in old["holdings"]: _holders[sym].discard(user_id)
+    state = _build_state(wallet)
+    _portfolios[user_id] = state
+    _portfolios.move_to_end(user_id)
+    for sym in state["holdings"]: _holders[sym].add(user_id)
+    while len(_portfolios) > PORTFOLIO_CACHE_SIZE:
+        _evict(next(iter(_portfolios)))
+    return state
+
+def _evict(user_id):
+    state = _portfolios.pop(user_id, None)
+    if state:
+        for sym in state["holdings"]: _holders[sym].discard(user_id)
+    _last_snapshot.pop(user_id, None)
+
+def _fresh(state):
+    return time.monotonic() - state["loaded_at"] < PORTFOLIO_CACHE_TTL
+
+def _state(user_id):
+    state = _portfolios.get(user_id)
+    if state is None or not _fresh(state):
+        return load_wallet(user_id, get_user_wallet(user_id))
+    _portfolios.move_to_end(user_id)
+    return state
+
+# ==========================================
+# DELTAS (Trades / Cash)
+# ==========================================
+
+def apply_cash(user_id, amount):
+    """Deposit / withdrawal / refund. Unloaded users are simply loaded fresh later."""
+    state = _portfolios.get(user_id)
+    if state: state["balance"] += float(amount)
+
+def apply_trade(user_id, symbol, qty_delta, cash_delta, cost_delta=0.0):
+    state = _portfolios.get(user_id)
+    if state is None: return
+    _ensure_prices()
+    price = _prices.get(symbol, 0)
+    old_qty = state["holdings"].get(symbol, 0)
+    new_qty = old_qty + qty_delta
+
+    state["balance"] += float(cash_delta)
+    state["assets"] += qty_delta * price
+
+    old_cost = state["invested"].get(symbol, 0) if old_qty > 0 else 0
+    state["invested"][symbol] = state["invested"].get(symbol, 0) + cost_delta
+    new_cost = state["invested"][symbol] if new_qty > 0 else 0
+    state["cost"] += new_cost - old_cost
+
+    if new_qty > 0:
+        state["holdings"][symbol] = new_qty
+        _holders[symbol].add(user_id)
+    else:
+        state["holdings"].pop(symbol, None)
+        _holders[symbol].discard(user_id)
+
+# ==========================================
+# PRICE TICKS
+# ==========================================
+
+def on_price_tick(symbol, new_price):
+    """Revalues only the holders of `symbol`. O(holders of symbol)."""
+    _ensure_prices()
+    old = _prices.get(symbol)
+    _prices[symbol] = new_price
+    if old is None or old == new_price: return
+    diff = new_price - old
+    for uid in _holders.get(symbol, ()):
+        st = _portfolios[uid]
+        st["assets"] += st["holdings"][symbol] * diff
+
+def sync_prices(tokens):
+    """Feeds a fresh token list (e.g. from get_all_tokens) in; returns {symbol: price} that moved."""
+    _ensure_prices()
+    moved = {}
+    for t in tokens:
+        sym, price = t["symbol"], t["price"]
+        if "name" in t: _names[sym] = t["name"]
+        if _prices.get(sym) != price:
+            on_price_tick(sym, price)
+            moved[sym] = price
+    return moved
+
+# ==========================================
+# READS
+# ==========================================
+
+def get_valuation(user_id):
+    """O(1) totals for one user (positions list is only the user's own holdings)."""
+    st = _state(user_id)
+    return {
+        "balance": st["balance"],
+        "assets": st["assets"],
+        "net_worth": st["balance"] + st["assets"],
+        "invested": st["cost"],
+        "positions": [(s, _names.get(s, s), q, q * _prices.get(s, 0)) for s, q in st["holdings"].items()],
+    }
+
+def get_holding(user_id, symbol):
+    return _state(user_id)["holdings"].get(symbol, 0)
+
+# ==========================================
+# SNAPSHOTS (History)
+# ==========================================
+
+def snapshot_valuations():
+    """Writes one compact row per loaded (and still fresh) user whose valuation changed since the last snapshot."""
+    now = int(time.time())
+    rows = []
+    for uid, st in _portfolios.items():
+        if not _fresh(st): continue
+        point = (round(st["balance"] + st["assets"], 2), round(st["cost"], 2))
+        if _last_snapshot.get(uid) == point: continue
+        _last_snapshot[uid] = point
+        rows.append({"user_id": uid, "ts": now, "nw": point[0], "inv": point[1]})
+    if rows: save_valuation_snapshots(rows)
+    return len(rows)
+
+async def valuation_snapshot_job(context):
+    """JobQueue callback."""
+    try:
+        count = snapshot_valuations()
+        if count: logger.info(f"📸 Valuation snapshot: {count} users")
+    except Exception as e:
+        logger.error(f"Valuation snapshot failed: {e}")
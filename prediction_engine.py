@@ -1,8 +1,78 @@
 import random
-import hashlib
+import asyncio
+import logging
 from typing import Optional
-from config import BETTING_SEQUENCE, MAX_LEVEL, ALL_PATTERNS, PATTERN_LENGTH, V5_SALT, TRUSTWIN_SALT
-from database import get_user_data, update_user_field
+from config import BETTING_SEQUENCE, MAX_LEVEL, ALL_PATTERNS, V5_SALT, TRUSTWIN_SALT, PREDICTION_CACHE_PERIODS
+from config import TREND_STREAK, TREND_SUPER_STREAK, TREND_ZIGZAG, TREND_MIN_HISTORY
+from database import archive_draws, get_custom_patterns
+from v5_table import lookup as v5_digit
+from trend_tracker import feed_tracker
+from pattern_automaton import PatternAutomaton, FeedPatternState
+from markov_engine import feed_model
+from number_shot import feed_stats
+
+logger = logging.getLogger(__name__)
+
+# --- PER-PERIOD PREDICTION CACHE ---
+# A V5 prediction depends only on (period, platform salt, last TREND_TAIL outcomes), so
+# it is computed once per period and served to every user asking for it.
+# Entries live under (platform, game_type) -> int(period); when a new period
+# appears the numerically smallest periods beyond PREDICTION_CACHE_PERIODS are
+# dropped, so a late request for an old period can't push out the live one.
+# Placeholder / non-numeric periods ("000", "") are computed but never cached.
+# A new period also queues the draws that led up to it; archive_job writes
+# them off the loop.
+_period_cache = {}
+_archive_queue = {}   # (platform, game_type) -> {period: draw}
+TREND_TAIL = max(TREND_STREAK, TREND_SUPER_STREAK, TREND_ZIGZAG, TREND_MIN_HISTORY)
+
+def get_period_prediction(period_number, game_type="30s", history_data=None, platform="Tiranga"):
+    """
+    Cached V5 result for a period:
+    {"pred", "pattern", "digit", "hash_pred", "trend", "super_trend", "confluence"}.
+    Treat it as read-only; it is shared by every caller.
+    """
+    key = _period_key(period_number)
+    if key is None: return _compute_v5(period_number, game_type, history_data, platform)
+    periods = _period_cache.get((platform, game_type))
+    if periods is None:
+        periods = _period_cache[(platform, game_type)] = {}
+    # Only the last TREND_TAIL outcomes (and how many there are) matter
+    tail = tuple(x['o'] for x in history_data[-TREND_TAIL:]) if history_data else ()
+
+    by_tail = periods.get(key)
+    if by_tail is None:
+        by_tail = periods[key] = {}
+        while len(periods) > PREDICTION_CACHE_PERIODS:
+            del periods[min(periods)]
+        # New period: keep the draws that led up to it for backtesting
+        if history_data:
+            queue = _archive_queue.setdefault((platform, game_type), {})
+            for h in history_data[-10:]: queue[str(h['p'])] = h
+    result = by_tail.get(tail)
+    if result is None:
+        result = by_tail[tail] = _compute_v5(period_number, game_type, history_data, platform)
+    return result
+
+def _period_key(period_number):
+    """int period for the cache, or None for placeholders / non-numeric periods."""
+    try: number = int(period_number)
+    except (TypeError, ValueError): return None
+    return number if number > 0 else None
+
+def _write_archive(batches):
+    for (platform, game_type), draws in batches:
+        archive_draws(platform, game_type, list(draws.values()))
+
+async def archive_job(context):
+    """JobQueue callback: writes the draws queued by new periods in a worker thread."""
+    batches = list(_archive_queue.items())
+    _archive_queue.clear()
+    if not batches: return
+    try:
+        await asyncio.to_thread(_write_archive, batches)
+    except Exception as e:
+        logger.error(f"Draw archive write failed: {e}")
 
 # --- V5+ ENGINE (HASH + TREND CONFLUENCE + PLATFORM SALT) ---
 def get_v5_logic(period_number, game_type="30s", history_data=None, platform="Tiranga"):
@@ -11,63 +81,66 @@ def get_v5_logic(period_number, game_type="30s", history_data=None, platform="Ti
     1. Selects Salt based on Platform (TrustWin vs Others).
     2. SHA256(Period + Salt).
     3. Checks Confluence with History Trend.
+    Served from the per-period cache.
     """
+    r = get_period_prediction(period_number, game_type, history_data, platform)
+    return r["pred"], r["pattern"], r["digit"]
+
+def _compute_v5(period_number, game_type, history_data, platform):
     # 1. SELECT SALT
     salt = TRUSTWIN_SALT if platform == "TrustWin" else V5_SALT
     
-    # 2. Base Hash Prediction
-    data_str = str(period_number) + salt
-    try:
-        hash_obj = hashlib.sha256(data_str.encode('utf-8'))
-        hash_hex = hash_obj.hexdigest()
-    except:
-        hash_hex = "0000"
-
-    digit = None
-    for char in reversed(hash_hex):
-        if char.isdigit():
-            digit = int(char)
-            break
-    if digit is None: digit = 0
+    # 2. Base Hash Prediction (precomputed table, hashed on a miss)
+    digit = v5_digit(period_number, salt, game_type)
     
     hash_pred = "Big" if digit > 4 else "Small"
     
     # 3. Confluence Check (Refining the prediction)
     confluence_txt = ""
     final_pred = hash_pred
+    # The feed's incremental tracker answers in O(1) when it is in step with this history
+    tracker = feed_tracker(platform, game_type) if history_data else None
+    if tracker is not None and tracker.observe(history_data):
+        trend_pred, super_trend = tracker.high_confidence(), tracker.super_trend()
+    else:
+        trend_pred, super_trend = get_high_confidence_prediction(history_data), is_super_trend(history_data)
     
     if history_data and len(history_data) >= 5:
-        trend_pred = get_high_confidence_prediction(history_data)
         if trend_pred:
             if trend_pred == hash_pred:
                 confluence_txt = "🔥"
             else:
-                # If Trend is SUPER strong (streak of 5+), override Hash
-                if is_super_trend(history_data):
+                # If Trend is SUPER strong (TREND_SUPER_STREAK+ streak), override Hash
+                if super_trend:
                     final_pred = trend_pred
                     confluence_txt = "⚡"
     
-    pattern_name = f"V5+ {platform} {confluence_txt}"
-    return final_pred, pattern_name, digit
+    return {
+        "pred": final_pred, "pattern": f"V5+ {platform} {confluence_txt}", "digit": digit,
+        "hash_pred": hash_pred, "trend": trend_pred, "super_trend": super_trend,
+        "confluence": bool(trend_pred) and trend_pred == final_pred,
+    }
 
 # --- SURESHOT / TREND HELPERS ---
 
+# List-based versions for arbitrary histories (the feed TrendTracker answers the same in O(1))
+
 def is_super_trend(history):
     if not history: return False
-    recent = [x['o'] for x in history[-5:]]
+    recent = [x['o'] for x in history[-TREND_SUPER_STREAK:]]
     if len(set(recent)) == 1: return True
     return False
 
 def get_high_confidence_prediction(history):
-    if not history or len(history) < 10: return None
-    recent = [x['o'] for x in history[-10:]]
+    if not history or len(history) < TREND_MIN_HISTORY: return None
+    recent = [x['o'] for x in history[-max(TREND_STREAK, TREND_ZIGZAG):]]
     
-    # Streak Logic (4 in a row)
-    if recent[-1] == recent[-2] == recent[-3] == recent[-4]:
+    # Streak Logic (TREND_STREAK in a row)
+    if len(recent) >= TREND_STREAK and len(set(recent[-TREND_STREAK:])) == 1:
         return recent[-1]
     
     # ZigZag (ABAB)
-    if (recent[-1] != recent[-2] and recent[-2] != recent[-3] and recent[-3] != recent[-4]):
+    if len(recent) >= TREND_ZIGZAG and all(recent[-i] != recent[-i - 1] for i in range(1, TREND_ZIGZAG)):
         return "Small" if recent[-1] == "Big" else "Big"
         
     return None
@@ -77,12 +150,8 @@ def get_sureshot_confluence(period, history, game_type="30s"):
     Used for the Sureshot Ladder. 
     Note: Always uses default Tiranga salt for safety unless passed otherwise.
     """
-    v5_outcome, _, _ = get_v5_logic(period, game_type, history, platform="Tiranga")
-    trend_outcome = get_high_confidence_prediction(history)
-    
-    if trend_outcome and trend_outcome == v5_outcome:
-        return v5_outcome, True 
-    return v5_outcome, False
+    r = get_period_prediction(period, game_type, history, platform="Tiranga")
+    return r["pred"], r["confluence"]
 
 # --- UTILS ---
 
@@ -90,30 +159,52 @@ def get_bet_unit(level: int) -> int:
     if 1 <= level <= MAX_LEVEL: return BETTING_SEQUENCE[level - 1]
     return 1
 
-def get_number_for_outcome(outcome: str) -> int:
+def get_number_for_outcome(outcome: str, platform="Tiranga", game_type="30s") -> int:
+    # Likeliest number of that side from the feed's Number Shot stats
+    stats = feed_stats(platform, game_type)
+    if stats.ready(): return stats.top(1, outcome)[0][0]
     return random.randint(0, 4) if outcome == "Small" else random.randint(5, 9)
 
+# --- V1 PATTERN SET ---
+# Built-in ALL_PATTERNS + admin patterns (/patterns), compiled once into one
+# automaton; each feed keeps its automaton state and advances it per new draw.
+_automaton = None
+_feed_patterns = {}   # (platform, game_type) -> FeedPatternState
+
+def builtin_patterns():
+    return [("".join(o[0] for o in seq), seq[0], 1.0, name) for seq, name in ALL_PATTERNS]
+
+def get_pattern_automaton():
+    global _automaton
+    if _automaton is None:
+        custom = [(p["seq"], p["next"], p.get("weight", 1.0), p.get("name") or p["seq"]) for p in get_custom_patterns()]
+        _automaton = PatternAutomaton(builtin_patterns() + custom)
+        _feed_patterns.clear()
+    return _automaton
+
+def reload_patterns():
+    """Recompiles on next use (call after the admin pattern list changes)."""
+    global _automaton
+    _automaton = None
+
 # --- V1 to V4 ENGINES (RESTORED) ---
 
-def get_next_pattern_prediction(history_objs: list) -> tuple[Optional[str], str]:
+def get_next_pattern_prediction(history_objs: list, feed=("Tiranga", "30s")) -> tuple[Optional[str], str]:
     if not history_objs: return None, "Random"
-    history_outcomes = [x['o'] for x in history_objs]
-    recent_history = history_outcomes[-PATTERN_LENGTH:] 
-    recent_len = len(recent_history)
-    
-    for pattern_list, pattern_name in ALL_PATTERNS:
-        pattern_len = len(pattern_list)
-        if recent_len < pattern_len:
-            if recent_history == pattern_list[:recent_len]:
-                return pattern_list[recent_len], pattern_name
-        elif recent_len == pattern_len:
-            if recent_history == pattern_list:
-                return pattern_list[0], pattern_name
-    return None, None
-
-def generate_v1_prediction(api_history, current_prediction, outcome):
+    automaton = get_pattern_automaton()
+    fs = _feed_patterns.get(feed)
+    if fs is None:
+        fs = _feed_patterns[feed] = FeedPatternState(automaton)
+    if fs.observe(history_objs):
+        state = fs.state
+    else:  # history not from this feed's stream: walk its tail
+        state = automaton.run(x['o'] for x in history_objs[-automaton.max_len:])
+    pred, name, _ = automaton.predict(state)
+    return pred, name
+
+def generate_v1_prediction(api_history, current_prediction, outcome, feed=("Tiranga", "30s")):
     # Pattern Matcher
-    pattern_prediction, pattern_name = get_next_pattern_prediction(api_history)
+    pattern_prediction, pattern_name = get_next_pattern_prediction(api_history, feed)
     if pattern_prediction: return pattern_prediction, pattern_name
     if api_history: return api_history[-1]['o'], "V1 Streak"
     return random.choice(['Small', 'Big']), "V1 Random"
@@ -136,31 +227,17 @@ def generate_v4_prediction(history_outcomes, current_prediction, outcome, curren
             return history_outcomes[-1], "V4 Strong Trend"
     return ('Small' if current_prediction == 'Big' else 'Big'), "V4 Smart Switch"
 
-# --- MAIN CONTROLLER (ROUTER) ---
-
-def process_prediction_request(user_id, outcome, api_history=[]):
-    """
-    Decides which engine to use based on user settings.
-    Legacy V1-V4 logic is preserved here.
-    """
-    state = get_user_data(user_id)
-    mode = state.get("prediction_mode", "V5")
-    current_prediction = state.get('current_prediction', "Small")
-    current_level = state.get('current_level', 1)
-
-    if mode == "V1":
-        new_pred, p_name = generate_v1_prediction(api_history, current_prediction, outcome)
-    elif mode == "V2":
-        new_pred, p_name = generate_v2_prediction(api_history, current_prediction, outcome, current_level)
-    elif mode == "V3":
-        new_pred, p_name = generate_v3_prediction()
-    elif mode == "V4":
-        hist_strings = [x['o'] for x in api_history] if api_history else []
-        new_pred, p_name = generate_v4_prediction(hist_strings, current_prediction, outcome, current_level)
-    else: 
-        # Default to V5 logic (Standard Tiranga salt if called this way)
-        new_pred, p_name, _ = get_v5_logic("000", "30s", api_history, platform="Tiranga")
-
-    update_user_field(user_id, "current_prediction", new_pred)
-    update_user_field(user_id, "current_pattern_name", p_name)
-    return new_pred, p_name
+# --- V6 ENGINE (MARKOV) ---
+
+def generate_v6_prediction(api_history, platform="Tiranga", game_type="30s"):
+    # Order-k Markov model of the feed (markov_engine.py)
+    model = feed_model(platform, game_type)
+    if model is None:   # still loading off the event loop (markov_engine.warm_job)
+        if api_history: return api_history[-1]['o'], "V6 Warming Up"
+        return random.choice(['Small', 'Big']), "V6 Random"
+    model.observe(api_history)
+    pred, order, prob = model.predict()
+    if pred is None:
+        if api_history: return api_history[-1]['o'], "V6 Warming Up"
+        return random.choice(['Small', 'Big']), "V6 Random"
+    return pred, f"V6 Markov k={order} ({prob:.0%})"
@@ -0,0 +1,140 @@
+import re
+import csv
+import logging
+from database import (
+    get_pending_utr_claims, approve_deposits_bulk, approve_purchases_bulk,
+    flag_utr_claims, normalize_utr
+)
+from handlers_shop import access_fields, access_message
+from bulk_sender import send_bulk
+
+logger = logging.getLogger(__name__)
+
+# --- STATEMENT FORMAT ---
+# Header names seen in bank / UPI statement exports (lower-cased substrings, first match wins)
+UTR_COLUMNS = ("utr", "rrn", "reference", "ref no", "ref_no", "txn id", "transaction id")
+AMOUNT_COLUMNS = ("credit", "deposit", "amount")
+NARRATION_COLUMNS = ("narration", "description", "remarks", "particulars")
+UTR_IN_TEXT = re.compile(r"(?<!\d)(\d{12})(?!\d)")  # UPI UTRs are 12 digits
+AMOUNT_TOLERANCE = 0.01
+
+def _pick(header, names):
+    for name in names:
+        for i, col in enumerate(header):
+            if name in col: return i
+    return None
+
+def _amount(cell):
+    cell = re.sub(r"[^\d.\-]", "", cell or "")
+    try: return float(cell)
+    except ValueError: return None
+
+def _claim_id(kind, doc):
+    return doc["tx_id"] if kind == "dep" else doc["purchase_id"]
+
+def iter_statement(lines):
+    """
+    Streams (utr, amount, line_no) credit rows from statement CSV lines.
+    Preamble lines before the header are skipped. The UTR comes from a UTR/reference
+    column, else the first 12-digit number in the narration.
+    """
+    utr_i = amt_i = nar_i = None
+    header_found = False
+    for line_no, row in enumerate(csv.reader(lines), 1):
+        if not header_found:
+            cols = [c.strip().lower() for c in row]
+            amt_i, utr_i, nar_i = _pick(cols, AMOUNT_COLUMNS), _pick(cols, UTR_COLUMNS), _pick(cols, NARRATION_COLUMNS)
+            header_found = amt_i is not None and (utr_i is not None or nar_i is not None)
+            continue
+        if amt_i >= len(row): continue
+        amount = _amount(row[amt_i])
+        if not amount or amount <= 0: continue  # debit / blank credit
+
+        utr = normalize_utr(row[utr_i]) if utr_i is not None and utr_i < len(row) else ""
+        if not utr and nar_i is not None and nar_i < len(row):
+            m = UTR_IN_TEXT.search(row[nar_i])
+            utr = m.group(1) if m else ""
+        if utr: yield utr, amount, line_no
+
+def match_statement(rows, claims):
+    """
+    Hash join of statement rows against pending UTR claims.
+    Build side: pending deposits + purchases (utr -> claim). Probe side: the streamed statement.
+    Exact UTR + amount matches are approved; everything else is flagged or counted.
+    """
+    index, flags = {}, []
+    for kind, doc in claims:
+        other = index.get(doc["utr"], False)
+        if other is False:
+            index[doc["utr"]] = (kind, doc)
+            continue
+        # Same UTR on a deposit AND a purchase: never auto-approve either
+        flags.append((kind, doc, "duplicate_utr", "claimed by a deposit and a purchase"))
+        if other: flags.append((other[0], other[1], "duplicate_utr", "claimed by a deposit and a purchase"))
+        index[doc["utr"]] = None
+
+    matched, seen = {}, set()
+    report = {"rows": 0, "unmatched": 0}
+    for utr, amount, line_no in rows:
+        report["rows"] += 1
+        if utr in seen:
+            # UTR twice in the statement (e.g. reversal + re-credit): needs a human
+            if utr in matched:
+                kind, doc = matched.pop(utr)
+                flags.append((kind, doc, "duplicate_statement", f"UTR repeated at line {line_no}"))
+            continue
+        seen.add(utr)
+        claim = index.get(utr)
+        if not claim:
+            report["unmatched"] += 1
+            continue
+        kind, doc = claim
+        if abs(amount - doc["amount"]) > AMOUNT_TOLERANCE:
+            flags.append((kind, doc, "amount_mismatch", f"statement ₹{amount:g} vs claimed ₹{doc['amount']:g}"))
+        else:
+            matched[utr] = claim
+
+    report["dep"] = [doc for kind, doc in matched.values() if kind == "dep"]
+    report["shop"] = [doc for kind, doc in matched.values() if kind == "shop"]
+    report["flags"] = flags
+    return report
+
+def run_reconciliation(lines):
+    """
+    Blocking: match a statement, bulk-approve matches and flag the rest. Run via asyncio.to_thread.
+    report["cash"] lists the (user_id, amount) credits for the caller to apply to the
+    portfolio cache on the event-loop thread.
+    """
+    report = match_statement(iter_statement(lines), get_pending_utr_claims())
+    report["dep"] = approve_deposits_bulk(report["dep"])
+    report["shop"] = approve_purchases_bulk(report["shop"], access_fields)
+    report["cash"] = [(t["user_id"], t["amount"]) for t in report["dep"]]
+    flag_utr_claims([(kind, _claim_id(kind, doc), flag, detail) for kind, doc, flag, detail in report["flags"]])
+
+    messages = [(t["user_id"], f"✅ **Deposit Approved!**\nAdded: ₹{t['amount']}", None) for t in report["dep"]]
+    for p in report["shop"]:
+        text, kb = access_message(p["item"])
+        messages.append((p["user_id"], text, kb))
+    report["messages"] = messages
+    logger.info(f"🧾 Reconciled {report['rows']} rows: {len(report['dep'])} deposits, {len(report['shop'])} purchases, {len(report['flags'])} flags")
+    return report
+
+async def send_notifications(bot, messages):
+    """Fans the approval messages out through the rate-limited sender. Returns the number delivered."""
+    sent, _ = await send_bulk(bot, messages)
+    return sent
+
+def format_report(report, sent):
+    msg = (
+        f"🧾 **RECONCILIATION DONE**\n━━━━━━━━━━━━━━\n"
+        f"📄 Statement credits: {report['rows']}\n"
+        f"✅ Deposits approved: {len(report['dep'])} (₹{sum(t['amount'] for t in report['dep']):g})\n"
+        f"✅ Purchases approved: {len(report['shop'])}\n"
+        f"⚠️ Flagged: {len(report['flags'])}\n"
+        f"❔ No pending claim: {report['unmatched']}\n"
+        f"📨 Notified: {sent}/{len(report['messages'])}\n"
+    )
+    for kind, doc, flag, detail in report["flags"][:10]:
+        msg += f"\n`{doc['utr']}` `{flag}` ({'deposit' if kind == 'dep' else 'shop'}, user `{doc['user_id']}`): {detail}"
+    if len(report["flags"]) > 10: msg += f"\n…and {len(report['flags']) - 10} more"
+    return msg
@@ -0,0 +1,231 @@
+"""
+Monte-Carlo risk calibration of the target packs and the sureshot ladder.
+
+Sessions are NumPy arrays (one row per session, all stepped together, finished
+rows dropped as they end), simulated in chunks over a process pool. For every
+pack / the ladder and each game type it reports the chance to reach the goal,
+to go bankrupt or to run out of rounds, the session-length distribution and
+the expected rounds (and minutes). Win rates come from the backtest engines
+over a draw history (fake, CSV or the draw archive) unless --hit-rate is given.
+
+--search tries geometric stake sequences (first stake x ratio per loss) for
+TARGET_SEQUENCE_PERCENTAGES and keeps, per pack, the one with the best target
+rate whose bankruptcy stays within --budget (and timeouts within --max-timeout).
+
+Usage: python risk_calibrator.py [--sessions 1000000] [--game-types 30s 1m] [--workers N]
+                                 [--source fake|csv|archive] [--csv draws.csv] [--draws 200000]
+                                 [--hit-rate 0.5] [--profit 1.0] [--max-rounds 2000]
+                                 [--search] [--budget 0.25] [--max-timeout 0.05] [--search-sessions 20000]
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from config import TARGET_PACKS, TARGET_SEQUENCE_PERCENTAGES, TARGET_MIN_BALANCE
+from config import MAX_LADDER_LEVEL, LADDER_START_BET, LADDER_PAYOUT, GAME_ROUND_SECONDS, V5_SALT
+import backtest
+
+CHUNK = 250_000                       # sessions per pool task
+SEARCH_FIRST = (0.005, 0.01, 0.02, 0.03, 0.05)
+SEARCH_RATIO = (1.5, 2.0, 2.5, 3.0)
+
+# ==========================================
+# WIN RATES (from the backtest engines)
+# ==========================================
+
+def estimate_rates(periods, numbers):
+    """Target bets use the plain V5 hash pick; sureshot bets only on confluence (Tiranga salt)."""
+    o = (numbers > 4).astype(np.int8)
+    v5, hash_only, confluence = backtest.v5_engine(o, periods, V5_SALT)
+    live = np.arange(len(o)) >= backtest.WINDOW
+    signal = live & confluence
+    return {
+        "target": float(np.mean((hash_only == o)[live])),
+        "sureshot": float(np.mean((v5 == o)[signal])) if signal.any() else 0.5,
+        "signal": float(np.mean(signal[live])),
+    }
+
+# ==========================================
+# SIMULATION (pool workers)
+# ==========================================
+
+def simulate_targets(start, target, fractions, p, profit, n, max_rounds, seed):
+    """
+    n target sessions; a win pays stake x profit (process_target_outcome books 1.0).
+    calculate_sequence(bal) is floor(max(bal, TARGET_MIN_BALANCE) x pct), its last
+    stake capped so the sequence never exceeds bal. After k losses the balance is
+    bal minus the first k stakes, so that cap is simply "at most the current balance"
+    and a session needs only (balance, sequence base, level), no stored sequence.
+    """
+    rng = np.random.default_rng(seed)
+    fractions = np.asarray(fractions, dtype=np.float64)
+    last = len(fractions) - 1
+    bal = np.full(n, float(start))
+    base = np.maximum(bal, TARGET_MIN_BALANCE)
+    level = np.zeros(n, dtype=np.int64)
+    lengths = np.zeros(max_rounds + 1, dtype=np.int64)
+    hits = busts = 0
+    for t in range(1, max_rounds + 1):
+        if not len(bal): break
+        win = rng.random(len(bal)) < p
+        at_end = level == last
+        bet = np.floor(base * fractions[level])
+        bet = np.where(at_end, np.minimum(bet, bal), bet)
+        bal += np.where(win, bet * profit, -bet)
+        reseq = win | at_end
+        base = np.where(reseq, np.maximum(bal, TARGET_MIN_BALANCE), base)
+        level = np.where(reseq, 0, level + 1)
+        hit, bust = bal >= target, bal <= TARGET_MIN_BALANCE
+        done = hit | bust
+        if done.any():
+            hits += int(hit.sum())
+            busts += int(bust.sum())
+            lengths[t] += int(done.sum())
+            keep = ~done
+            bal, base, level = bal[keep], base[keep], level[keep]
+    lengths[max_rounds] += len(bal)   # still running: timed out
+    return {"n": n, "goal": hits, "bust": busts, "timeout": len(bal), "lengths": lengths}
+
+def simulate_ladders(p, signal_rate, n, max_rounds, seed):
+    """n sureshot ladders: wait for a confluence signal, then all-in; one loss ends it."""
+    rng = np.random.default_rng(seed)
+    waits = rng.geometric(max(signal_rate, 1e-9), (n, MAX_LADDER_LEVEL))   # rounds until each signal
+    wins = rng.random((n, MAX_LADDER_LEVEL)) < p
+    complete = wins.all(axis=1)
+    played = np.where(complete, MAX_LADDER_LEVEL, np.argmin(wins, axis=1) + 1)
+    rounds = np.minimum(np.cumsum(waits, axis=1)[np.arange(n), played - 1], max_rounds)
+    goal = int(complete.sum())
+    return {"n": n, "goal": goal, "bust": n - goal, "timeout": 0,
+            "lengths": np.bincount(rounds, minlength=max_rounds + 1)}
+
+def _run(task):
+    kind, args = task
+    return simulate_targets(*args) if kind == "target" else simulate_ladders(*args)
+
+def _merge(parts):
+    total = {"n": 0, "goal": 0, "bust": 0, "timeout": 0, "lengths": None}
+    for r in parts:
+        for k in ("n", "goal", "bust", "timeout"): total[k] += r[k]
+        total["lengths"] = r["lengths"] if total["lengths"] is None else total["lengths"] + r["lengths"]
+    return total
+
+def run_jobs(pool, jobs, seed=0):
+    """jobs: {name: (kind, args without n/max_rounds/seed, sessions, max_rounds)} -> merged results."""
+    tasks, owners = [], []
+    for name, (kind, args, sessions, max_rounds) in jobs.items():
+        for i, start in enumerate(range(0, sessions, CHUNK)):
+            n = min(CHUNK, sessions - start)
+            tasks.append((kind, (*args, n, max_rounds, seed + 7919 * len(tasks) + i)))
+            owners.append(name)
+    results = {name: [] for name in jobs}
+    for name, r in zip(owners, pool.map(_run, tasks)):
+        results[name].append(r)
+    return {name: _merge(parts) for name, parts in results.items()}
+
+# ==========================================
+# REPORT / SEARCH
+# ==========================================
+
+def summarize(r):
+    lengths = r["lengths"]
+    rounds = np.arange(len(lengths))
+    cdf = np.cumsum(lengths) / r["n"]
+    pct = lambda q: int(np.searchsorted(cdf, q))
+    return {
+        "goal": r["goal"] / r["n"], "bust": r["bust"] / r["n"], "timeout": r["timeout"] / r["n"],
+        "mean": float((lengths * rounds).sum() / r["n"]), "p50": pct(0.5), "p90": pct(0.9), "p99": pct(0.99),
+    }
+
+def print_table(title, rows, game_type):
+    print(f"\n{title} ({game_type}, {GAME_ROUND_SECONDS[game_type]}s rounds)")
+    print(f"{'':<18}{'goal %':>8}{'bust %':>8}{'t/o %':>7}{'rounds':>8}{'p50':>6}{'p90':>6}{'p99':>6}{'minutes':>9}")
+    for name, s in rows.items():
+        minutes = s["mean"] * GAME_ROUND_SECONDS[game_type] / 60
+        print(f"{name:<18}{s['goal'] * 100:>8.2f}{s['bust'] * 100:>8.2f}{s['timeout'] * 100:>7.2f}"
+              f"{s['mean']:>8.1f}{s['p50']:>6}{s['p90']:>6}{s['p99']:>6}{minutes:>9.1f}")
+
+def geometric_sequences():
+    """Candidate percentages: first stake x ratio per step, skipped if they exceed the balance."""
+    steps = len(TARGET_SEQUENCE_PERCENTAGES)
+    for first in SEARCH_FIRST:
+        for ratio in SEARCH_RATIO:
+            seq = tuple(round(first * ratio ** i, 4) for i in range(steps))
+            if sum(seq) <= 1: yield seq
+
+def search(pool, rates, args):
+    """Per pack: the candidate with the best target rate whose bust rate is within the budget (else the closest)."""
+    jobs = {}
+    for key, pack in TARGET_PACKS.items():
+        for seq in (TARGET_SEQUENCE_PERCENTAGES, *geometric_sequences()):
+            jobs[(key, seq)] = ("target", (pack["start"], pack["target"], seq, rates["target"], args.profit),
+                                args.search_sessions, args.max_rounds)
+    results = {k: summarize(r) for k, r in run_jobs(pool, jobs, seed=1).items()}
+    print(f"\nSEARCH (bust budget {args.budget * 100:.0f}%, {args.search_sessions} sessions per candidate)")
+    for key, pack in TARGET_PACKS.items():
+        current = results[(key, TARGET_SEQUENCE_PERCENTAGES)]
+        ok = [(s["goal"], -s["mean"], seq) for (k, seq), s in results.items()
+              if k == key and s["bust"] <= args.budget and s["timeout"] <= args.max_timeout]
+        print(f"{pack['name']:<16} current: goal {current['goal'] * 100:5.1f}%  bust {current['bust'] * 100:5.1f}%  rounds {current['mean']:.0f}")
+        if ok:
+            best, label = max(ok)[2], "best:   "
+        else:   # nothing fits: show the least risky candidate that still finishes
+            finishing = [(s["bust"], seq) for (k, seq), s in results.items() if k == key and s["timeout"] <= args.max_timeout]
+            if not finishing:
+                print(f"{'':<16} no candidate finishes within --max-rounds")
+                continue
+            best, label = min(finishing)[1], "closest:"
+        s = results[(key, best)]
+        print(f"{'':<16} {label} goal {s['goal'] * 100:5.1f}%  bust {s['bust'] * 100:5.1f}%  rounds {s['mean']:.0f}  "
+              f"timeout {s['timeout'] * 100:.1f}%  TARGET_SEQUENCE_PERCENTAGES = {best}")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--sessions", type=int, default=1_000_000, help="sessions per pack / ladder and game type")
+    ap.add_argument("--game-types", nargs="+", choices=list(GAME_ROUND_SECONDS), default=list(GAME_ROUND_SECONDS))
+    ap.add_argument("--workers", type=int, default=os.cpu_count())
+    ap.add_argument("--source", choices=["fake", "csv", "archive"], default="fake", help="draws for the win-rate estimate")
+    ap.add_argument("--csv", help="draw CSV (with --source csv)")
+    ap.add_argument("--draws", type=int, default=200_000, help="draws to generate (fake source)")
+    ap.add_argument("--hit-rate", type=float, help="override every win rate (skips the draw history)")
+    ap.add_argument("--profit", type=float, default=1.0, help="target win pays stake x this (the app books 1.0)")
+    ap.add_argument("--max-rounds", type=int, default=2000, help="rounds before a session counts as timed out")
+    ap.add_argument("--search", action="store_true", help="search sequence percentages within --budget")
+    ap.add_argument("--budget", type=float, default=0.25, help="max bankruptcy probability for --search")
+    ap.add_argument("--max-timeout", type=float, default=0.05, help="max timed-out share for --search")
+    ap.add_argument("--search-sessions", type=int, default=20_000)
+    args = ap.parse_args()
+
+    t0 = time.perf_counter()
+    done = {}   # rates -> (rows, search ran); game types with the same rates differ only in round length
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        for game_type in args.game_types:
+            if args.hit_rate is not None:
+                rates = {"target": args.hit_rate, "sureshot": args.hit_rate, "signal": 1.0}
+            else:
+                if args.source == "fake": periods, numbers = backtest.fake_draws(args.draws)
+                elif args.source == "csv": periods, numbers = backtest.load_csv(args.csv)
+                else: periods, numbers = backtest.load_archive("Tiranga", game_type)
+                if len(numbers) <= backtest.WINDOW:
+                    print(f"\n{game_type}: not enough draws ({len(numbers)})")
+                    continue
+                rates = estimate_rates(periods, numbers)
+            print(f"\n{game_type}: target win {rates['target'] * 100:.2f}%  sureshot win {rates['sureshot'] * 100:.2f}%  "
+                  f"signal rate {rates['signal'] * 100:.2f}%")
+
+            key = tuple(sorted(rates.items()))
+            if key in done:
+                print_table(f"{args.sessions} sessions each (same rates as above)", done[key], game_type)
+                continue
+            jobs = {pack["name"]: ("target", (pack["start"], pack["target"], TARGET_SEQUENCE_PERCENTAGES, rates["target"], args.profit),
+                                   args.sessions, args.max_rounds)
+                    for pack in TARGET_PACKS.values()}
+            jobs["Sureshot ladder"] = ("ladder", (rates["sureshot"], rates["signal"]), args.sessions, args.max_rounds)
+            rows = done[key] = {name: summarize(r) for name, r in run_jobs(pool, jobs).items()}
+            print_table(f"{args.sessions} sessions each; ladder: {MAX_LADDER_LEVEL} wins, "
+                        f"{LADDER_START_BET} -> {LADDER_START_BET * LADDER_PAYOUT ** MAX_LADDER_LEVEL:.0f}", rows, game_type)
+            if args.search: search(pool, rates, args)
+    print(f"\nDone in {time.perf_counter() - t0:.1f}s")
+
+if __name__ == "__main__":
+    main()
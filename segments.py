@@ -0,0 +1,29 @@
+import time
+from database import BROADCAST_AUDIENCE
+
+# --- AUDIENCE SEGMENTS ---
+# Each segment compiles to a Mongo filter on an indexed field (see database.py).
+# Selected segments are ANDed. Relative windows ("last 7 days") are computed
+# from a fixed reference time so a resumed broadcast targets the same users.
+DAY = 86400
+
+SEGMENTS = {
+    "vip":       ("💎 VIP Active",      lambda now: {"prediction_status": "ACTIVE", "expiry_timestamp": {"$gt": now}}),
+    "expired7":  ("⌛ Expired ≤7d",     lambda now: {"expiry_timestamp": {"$gt": now - 7 * DAY, "$lte": now}}),
+    "expired30": ("⌛ Expired ≤30d",    lambda now: {"expiry_timestamp": {"$gt": now - 30 * DAY, "$lte": now}}),
+    "lang_EN":   ("🇺🇸 English",        lambda now: {"language": "EN"}),
+    "lang_HI":   ("🇮🇳 Hindi",          lambda now: {"language": "HI"}),
+    "target":    ("🎯 Target Access",   lambda now: {"target_access": {"$type": "string"}}),
+    "holders":   ("💰 Wallet Holders",  lambda now: {"wallet.holdings": {"$gt": {}}}),
+    # Users never seen since last_active tracking began are "unknown", not inactive.
+    "inactive30": ("💤 Inactive 30d+",  lambda now: {"last_active": {"$lt": now - 30 * DAY}}),
+}
+
+def compile_audience(keys, now=None):
+    """Segment keys -> one Mongo filter (reachable users only). No keys = everyone."""
+    now = int(now or time.time())
+    clauses = [BROADCAST_AUDIENCE] + [SEGMENTS[k][1](now) for k in keys if k in SEGMENTS]
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+def describe(keys):
+    return " + ".join(SEGMENTS[k][0] for k in keys if k in SEGMENTS) or "👥 All Users"
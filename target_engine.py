@@ -1,30 +1,30 @@
 import random
-from database import get_user_data, update_user_field
-from config import TARGET_PACKS
+import asyncio
+import logging
+from database import update_user_field, start_session, get_active_session, advance_session, migrate_legacy_sessions
+from config import TARGET_PACKS, TARGET_SEQUENCE_PERCENTAGES, TARGET_MIN_BALANCE, MAX_LADDER_LEVEL, LADDER_START_BET, LADDER_PAYOUT
 from prediction_engine import get_v5_logic, get_sureshot_confluence
 from api_helper import get_game_data
 
-MAX_LADDER_LEVEL = 5
+logger = logging.getLogger(__name__)
 
 def calculate_sequence(balance):
     # Safety: Ensure we don't bet 0 or negative
-    safe_balance = max(balance, 50)
+    safe_balance = max(balance, TARGET_MIN_BALANCE)
     
-    # Aggressive compounding sequence (can be adjusted)
-    seq = [
-        int(safe_balance * 0.01), # Step 1: 1%
-        int(safe_balance * 0.02), # Step 2: 2%
-        int(safe_balance * 0.05), # Step 3: 5%
-        int(safe_balance * 0.12), # Step 4: 12%
-        int(safe_balance * 0.30), # Step 5: 30%
-        int(safe_balance * 0.50)  # Step 6: All-in/Recovery
-    ]
+    # Aggressive compounding sequence (TARGET_SEQUENCE_PERCENTAGES; calibrate with risk_calibrator.py)
+    seq = [int(safe_balance * pct) for pct in TARGET_SEQUENCE_PERCENTAGES]
     # Cap the last bet to not exceed balance
     if sum(seq) > balance: 
         seq[-1] = balance - sum(seq[:-1])
     return seq
 
 # --- TARGET SESSION LOGIC ---
+# Sessions live in the sessions collection. Every step computes its changes
+# from the copy the caller last saw (`session`, loaded if not given) and writes
+# them in one guarded update; a second tap on the same step gets "Stale".
+# Buttons carry the version they were drawn at (tgt_win_<version>), so a tap
+# from an older screen is turned away before anything is computed.
 def start_target_session(user_id, target_key, game_type):
     pack = TARGET_PACKS.get(target_key)
     if not pack: return None
@@ -38,57 +38,45 @@ def start_target_session(user_id, target_key, game_type):
 
     start_bal = pack['start']
     
-    session = {
+    return start_session(user_id, "target", {
         "target_amount": pack['target'],
         "start_balance": start_bal,  # For Profit Calculation
         "current_balance": start_bal,
         "current_level_index": 0,
         "current_prediction": initial_pred,
-        "is_active": True,
         "pack_name": pack['name'],
         "sequence": calculate_sequence(start_bal),
         "current_period": current_period,
         "game_type": game_type
-    }
-    update_user_field(user_id, "target_session", session)
-    return session
+    })
 
-def process_target_outcome(user_id, outcome):
-    user_data = get_user_data(user_id)
-    session = user_data.get("target_session")
-    if not session or not session.get("is_active"): return None, "Ended"
+def process_target_outcome(user_id, outcome, session=None):
+    session = session or get_active_session(user_id, "target")
+    if not session: return None, "Ended"
 
     # Update Balance
-    level_idx = session["current_level_index"]
-    if level_idx >= len(session["sequence"]):
-        level_idx = len(session["sequence"]) - 1
-        
+    level_idx = min(session["current_level_index"], len(session["sequence"]) - 1)
     bet_amount = session["sequence"][level_idx]
+    new_balance = session["current_balance"] + (bet_amount if outcome == 'win' else -bet_amount)
 
-    if outcome == 'win':
-        session["current_balance"] += bet_amount
-        session["current_level_index"] = 0
-        # Recalculate sequence based on NEW balance
-        session["sequence"] = calculate_sequence(session["current_balance"])
+    changes = {}
+    if outcome == 'win' or level_idx >= len(session["sequence"]) - 1:
+        # Win, or end of sequence (Reset): recalculate sequence based on NEW balance
+        changes["current_level_index"] = 0
+        changes["sequence"] = calculate_sequence(new_balance)
     else:
-        session["current_balance"] -= bet_amount
-        if level_idx < len(session["sequence"]) - 1:
-            session["current_level_index"] += 1
-        else:
-            # Reached end of sequence (Reset)
-            session["current_level_index"] = 0
-            session["sequence"] = calculate_sequence(session["current_balance"])
+        changes["current_level_index"] = level_idx + 1
+    inc = {"current_balance": new_balance - session["current_balance"]}
 
     # --- END CONDITIONS (BUG FIX: Clear target_access) ---
-    if session["current_balance"] >= session["target_amount"]:
-        update_user_field(user_id, "target_session", None)
-        update_user_field(user_id, "target_access", None) # Fix
-        return session, "TargetReached"
-        
-    if session["current_balance"] <= 50: # Effectively Bankrupt
-        update_user_field(user_id, "target_session", None)
+    end_state = None
+    if new_balance >= session["target_amount"]: end_state, state = "TargetReached", "target_reached"
+    elif new_balance <= TARGET_MIN_BALANCE: end_state, state = "Bankrupt", "bankrupt" # Effectively Bankrupt
+    if end_state:
+        updated = advance_session(session, changes, inc, state=state)
+        if not updated: return _current(user_id, "target")
         update_user_field(user_id, "target_access", None) # Fix
-        return session, "Bankrupt"
+        return updated, end_state
 
     # Fetch NEW Period Logic
     game_type = session.get("game_type", "30s")
@@ -104,11 +92,33 @@ def process_target_outcome(user_id, outcome):
     # Generate Next Prediction
     new_pred, _, _ = get_v5_logic(next_period, game_type)
     
-    session["current_prediction"] = new_pred
-    session["current_period"] = next_period
+    changes["current_prediction"] = new_pred
+    changes["current_period"] = next_period
     
-    update_user_field(user_id, "target_session", session)
-    return session, "Continue"
+    updated = advance_session(session, changes, inc)
+    if not updated: return _current(user_id, "target")
+    return updated, "Continue"
+
+def _current(user_id, kind):
+    """After a failed guard: the session as it is now ("Stale"), or "Ended" if it closed."""
+    session = get_active_session(user_id, kind)
+    return (session, "Stale") if session else (None, "Ended")
+
+def tap_version(callback_data):
+    """The session version a button was drawn at (its last '_' field), or None."""
+    try: return int(callback_data.rsplit("_", 1)[1])
+    except (IndexError, ValueError): return None
+
+def session_at(user_id, kind, version, cached=None):
+    """The session a button was drawn from, only while it is still at `version`; None = stale tap."""
+    if cached is None or cached.get("version") != version:
+        cached = get_active_session(user_id, kind)
+    return cached if cached and cached.get("version") == version else None
+
+async def migrate_sessions_job(context):
+    """JobQueue (once at startup): moves sessions still stored on user documents to the sessions collection."""
+    moved = await asyncio.to_thread(migrate_legacy_sessions)
+    if moved: logger.info(f"Moved {moved} legacy target/sureshot sessions")
 
 # --- SURESHOT LADDER LOGIC ---
 def start_sureshot_session(user_id, game_type):
@@ -122,49 +132,47 @@ def start_sureshot_session(user_id, game_type):
     # Check first signal immediately
     pred, is_safe = get_sureshot_confluence(current_period, history, game_type)
 
-    session = {
+    return start_session(user_id, "sureshot", {
         "type": "SURESHOT",
         "current_level": 1,
-        "balance_history": [100], # Start with 100
-        "current_bet_amount": 100,
+        "balance_history": [LADDER_START_BET],
+        "current_bet_amount": LADDER_START_BET,
         "current_prediction": pred, # Can be None if scanning
         "is_waiting_signal": not is_safe,
         "current_period": current_period,
         "game_type": game_type,
-        "start_bal": 100,
+        "start_bal": LADDER_START_BET,
         "target": 1000
-    }
-    update_user_field(user_id, "sureshot_session", session)
-    return session
+    })
 
-def process_sureshot_loop(user_id, outcome=None):
+def process_sureshot_loop(user_id, outcome=None, session=None):
     """
     Handles the game loop. 
     If outcome='win', advance level.
     If outcome='loss', game over.
     If outcome=None (Just refreshing), check for new signal.
     """
-    ud = get_user_data(user_id)
-    sess = ud.get("sureshot_session")
+    sess = session or get_active_session(user_id, "sureshot")
     if not sess: return None, "Ended"
 
+    changes, inc, push = {}, None, None
     # 1. Handle Previous Result (if any)
     if outcome == "win":
-        sess["current_level"] += 1
-        if sess["current_level"] > MAX_LADDER_LEVEL:
-            update_user_field(user_id, "sureshot_session", None)
-            return sess, "Completed"
+        if sess["current_level"] + 1 > MAX_LADDER_LEVEL:
+            updated = advance_session(sess, inc={"current_level": 1}, state="completed")
+            return (updated, "Completed") if updated else _current(user_id, "sureshot")
         
         # Compounding Math: Bet everything from previous win
-        # Approx 96% payout assumed
+        # LADDER_PAYOUT (approx 96% profit) assumed
         prev_bet = sess["current_bet_amount"]
-        winnings = int(prev_bet * 1.96)
-        sess["current_bet_amount"] = winnings
-        sess["balance_history"].append(winnings)
+        winnings = int(prev_bet * LADDER_PAYOUT)
+        inc = {"current_level": 1}
+        changes["current_bet_amount"] = winnings
+        push = {"balance_history": winnings}
         
     elif outcome == "loss":
-        update_user_field(user_id, "sureshot_session", None)
-        return sess, "Failed"
+        updated = advance_session(sess, state="failed")
+        return (updated, "Failed") if updated else _current(user_id, "sureshot")
 
     # 2. Get Next Period Data
     # Fetch live data to see if we have a NEW period
@@ -179,9 +187,10 @@ def process_sureshot_loop(user_id, outcome=None):
     # 3. Check Confluence (V5 + Trend)
     pred, is_safe = get_sureshot_confluence(live_period, history, sess["game_type"])
     
-    sess["current_period"] = live_period
-    sess["current_prediction"] = pred
-    sess["is_waiting_signal"] = not is_safe
+    changes["current_period"] = live_period
+    changes["current_prediction"] = pred
+    changes["is_waiting_signal"] = not is_safe
     
-    update_user_field(user_id, "sureshot_session", sess)
-    return sess, "Active"
\ No newline at end of file
+    updated = advance_session(sess, changes, inc, push)
+    if not updated: return _current(user_id, "sureshot")
+    return updated, "Active"
\ No newline at end of file
@@ -0,0 +1,95 @@
+from config import TREND_STREAK, TREND_SUPER_STREAK, TREND_ZIGZAG, TREND_MIN_HISTORY, TREND_WINDOWS
+
+# --- INCREMENTAL TREND STATE (one per feed) ---
+# Updated once per new draw; every query is O(1) and allocates nothing.
+#   streak       draws in the current run of one side
+#   alternation  draws in the current Big/Small/Big/... run
+#   counts       Big draws in each of the last TREND_WINDOWS draws (rolling)
+BIG, SMALL = "Big", "Small"
+
+class TrendTracker:
+    __slots__ = ("last_period", "seen", "side", "streak", "alternation", "windows", "big_counts", "_ring", "_pos")
+
+    def __init__(self, windows=TREND_WINDOWS):
+        self.windows = tuple(windows)
+        self._ring = bytearray(max(self.windows))  # last max(windows) outcomes, 1 = Big
+        self.reset()
+
+    def reset(self):
+        self.last_period = None
+        self.seen = 0
+        self.side = None
+        self.streak = 0
+        self.alternation = 0
+        self.big_counts = [0] * len(self.windows)
+        self._pos = 0
+        self._ring[:] = bytes(len(self._ring))
+
+    def push(self, period, outcome):
+        big = outcome == BIG
+        size = len(self._ring)
+        # Roll every window: add the new draw, drop the one falling out of it
+        for i, w in enumerate(self.windows):
+            if self.seen >= w: self.big_counts[i] -= self._ring[(self._pos - w) % size]
+            self.big_counts[i] += big
+        self._ring[self._pos] = big
+        self._pos = (self._pos + 1) % size
+
+        if outcome == self.side:
+            self.streak += 1
+            self.alternation = 1
+        else:
+            self.streak = 1
+            self.alternation = self.alternation + 1 if self.side else 1
+        self.side = outcome
+        self.seen += 1
+        self.last_period = period
+
+    def observe(self, history):
+        """
+        Ingests the draws of an API history ({'p', 'o'} items, oldest first) that
+        are newer than the last one seen. A gap in the numbering means draws were
+        missed, so the state is rebuilt from this history alone.
+        Returns True when the tracker now ends at the history's last draw.
+        """
+        if not history: return False
+        last = _as_int(self.last_period)
+        first = _as_int(history[0]['p'])
+        if last is not None and first is not None and first > last + 1:
+            self.reset()
+            last = None
+        for h in history:
+            p = _as_int(h['p'])
+            if last is None or (p is not None and p > last):
+                self.push(h['p'], h['o'])
+                last = p
+        return str(self.last_period) == str(history[-1]['p'])
+
+    # --- QUERIES ---
+    def high_confidence(self):
+        """Streak -> follow it; zigzag -> expect the flip (get_high_confidence_prediction)."""
+        if self.seen < TREND_MIN_HISTORY: return None
+        if self.streak >= TREND_STREAK: return self.side
+        if self.alternation >= TREND_ZIGZAG: return SMALL if self.side == BIG else BIG
+        return None
+
+    def super_trend(self):
+        return self.seen > 0 and self.streak >= min(TREND_SUPER_STREAK, self.seen)
+
+    def big_ratio(self, window):
+        """Share of Big among the last `window` draws (window must be in TREND_WINDOWS)."""
+        i = self.windows.index(window)
+        n = min(self.seen, window)
+        return self.big_counts[i] / n if n else 0.5
+
+def _as_int(period):
+    try: return int(period)
+    except (TypeError, ValueError): return None
+
+_trackers = {}
+
+def feed_tracker(platform, game_type):
+    tracker = _trackers.get((platform, game_type))
+    if tracker is None:
+        tracker = _trackers[(platform, game_type)] = TrendTracker()
+    return tracker
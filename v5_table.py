@@ -0,0 +1,59 @@
+import asyncio
+import hashlib
+import logging
+from array import array
+from config import V5_TABLE_PERIODS
+
+logger = logging.getLogger(__name__)
+
+# --- PRECOMPUTED V5 HASH DIGITS ---
+# The V5 hash digit depends only on (period, salt). Periods are sequential, so
+# for each feed (salt, game type) the digits of the next V5_TABLE_PERIODS periods
+# are computed ahead into an array('b') indexed by (period - base). A lookup is
+# then one subtraction and one array read; anything outside the table (a new
+# day's numbering, a feed not seen yet) falls back to hashing on the spot.
+_tables = {}    # (salt, game_type) -> (base_period, array('b'))
+_latest = {}    # (salt, game_type) -> newest period seen
+stats = {"hits": 0, "misses": 0}
+
+def hash_digit(period, salt):
+    """Last decimal digit of sha256(period + salt).hexdigest(), 0 if it has none."""
+    try:
+        tail = hashlib.sha256((str(period) + salt).encode("utf-8")).hexdigest().rstrip("abcdef")
+    except Exception:
+        return 0
+    return int(tail[-1]) if tail else 0
+
+def digits_for(periods, salt):
+    """hash_digit for many periods at once (array('b'), same order)."""
+    return array("b", [hash_digit(p, salt) for p in periods])
+
+def lookup(period, salt, game_type="30s"):
+    key = (salt, game_type)
+    try:
+        number = int(period)
+    except (TypeError, ValueError):
+        return hash_digit(period, salt)
+    if number > _latest.get(key, -1): _latest[key] = number
+
+    table = _tables.get(key)
+    if table:
+        offset = number - table[0]
+        if 0 <= offset < len(table[1]):
+            stats["hits"] += 1
+            return table[1][offset]
+    stats["misses"] += 1
+    return hash_digit(period, salt)
+
+def refresh(ahead=V5_TABLE_PERIODS):
+    """(Re)builds tables for feeds that have no table or have used up half of it."""
+    for key, latest in list(_latest.items()):
+        table = _tables.get(key)
+        if table and 0 <= latest - table[0] < len(table[1]) // 2: continue
+        salt = key[0]
+        _tables[key] = (latest, digits_for(range(latest, latest + ahead), salt))
+        logger.info(f"V5 table for {key[1]} rebuilt from period {latest} ({ahead} periods)")
+
+async def refresh_job(context):
+    """JobQueue callback: keeps the tables ahead of the live periods."""
+    await asyncio.to_thread(refresh)